@@ -0,0 +1,157 @@
+# ----------------------------------------
+# Vectorized Aggregation
+# ----------------------------------------
+# NumPy bucketing for raw time/value series. Timestamps are epoch seconds (UTC)
+# and buckets are aligned to multiples of the bucket size, so 3600 gives clock
+# hours and 86400 gives UTC days.
+
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+
+from profiling import timed
+
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+
+@timed("parse")
+def parse_series(time_strs: Sequence[str], value_strs: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse getgraphdata's ISO "time" and "value" lists into (epoch seconds,
+    float values). Points that fail to parse are dropped.
+    """
+    n = min(len(time_strs), len(value_strs))
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    try:
+        stamps = np.char.rstrip(np.asarray(time_strs[:n], dtype=str), "Z")
+        times = stamps.astype("datetime64[ms]").astype("datetime64[s]").astype(np.int64)
+        values = np.asarray(value_strs[:n]).astype(np.float64)
+        return times, values
+    except (ValueError, TypeError):
+        pass
+
+    # Slow path: at least one malformed point, parse one by one and skip it
+    times_out: List[int] = []
+    values_out: List[float] = []
+    for ts_str, val in zip(time_strs[:n], value_strs[:n]):
+        try:
+            t = np.datetime64(str(ts_str).rstrip("Z"), "ms").astype("datetime64[s]").astype(np.int64)
+            v = float(val)
+        except (ValueError, TypeError):
+            continue
+        times_out.append(int(t))
+        values_out.append(v)
+    return np.asarray(times_out, dtype=np.int64), np.asarray(values_out, dtype=np.float64)
+
+
+@timed("aggregation")
+def bucket_mean(times: Any, values: Any, bucket_seconds: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Average values into fixed-size buckets in one pass.
+
+    Returns (bucket_starts, means, counts) for the non-empty buckets, oldest
+    first. Input does not need to be sorted.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if times.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+
+    keys = times // bucket_seconds
+    if keys.size > 1 and np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = values[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    sums = np.add.reduceat(values, starts)
+    counts = np.diff(np.append(starts, keys.size))
+    return keys[starts] * bucket_seconds, sums / counts, counts
+
+
+@timed("aggregation")
+def bucket_mean_of_means(
+    times: Any,
+    values: Any,
+    bucket_seconds: int,
+    base_seconds: int = HOUR,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Average into base buckets first, then average those means into the target
+    buckets, so every base bucket (e.g. hour) weighs the same in its day no
+    matter how many raw points it had. Counts are base buckets per bucket.
+    """
+    base_starts, base_means, _ = bucket_mean(times, values, base_seconds)
+    return bucket_mean(base_starts, base_means, bucket_seconds)
+
+
+@timed("aggregation")
+def fill_buckets(starts: np.ndarray, means: np.ndarray, first: int, count: int, bucket_seconds: int) -> np.ndarray:
+    """Lay bucket means onto a dense grid of `count` buckets from `first`; gaps are NaN."""
+    out = np.full(count, np.nan)
+    idx = (np.asarray(starts, dtype=np.int64) - first) // bucket_seconds
+    mask = (idx >= 0) & (idx < count)
+    out[idx[mask]] = np.asarray(means)[mask]
+    return out
+
+
+# ----------------------------------------
+# Shape-preserving Downsampling
+# ----------------------------------------
+
+
+@timed("aggregation")
+def lttb(times: Any, values: Any, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets: keep `threshold` points (first and last
+    included) that best preserve the visual shape of a sorted series.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    n = times.size
+    if threshold >= n or threshold < 3:
+        return times, values
+
+    x = times.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # the third corner is the mean of the next bucket (the last point for the last bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < edges.size else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = values[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (values[lo:hi] - values[a]) - (x[a] - x[lo:hi]) * (avg_y - values[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return times[keep], values[keep]
+
+
+@timed("aggregation")
+def minmax_envelope(times: Any, values: Any, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split a sorted series into max_points // 2 equal-count buckets and keep
+    each bucket's min and max (in time order), so spikes always survive.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    n = times.size
+    buckets = max_points // 2
+    if n <= max_points or buckets < 1:
+        return times, values
+
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    keep = np.empty(2 * buckets, dtype=np.int64)
+    for i in range(buckets):
+        lo, hi = edges[i], edges[i + 1]
+        chunk = values[lo:hi]
+        keep[2 * i] = lo + int(np.argmin(chunk))
+        keep[2 * i + 1] = lo + int(np.argmax(chunk))
+    keep = np.unique(keep)
+    return times[keep], values[keep]
@@ -0,0 +1,315 @@
+# ----------------------------------------
+# Unhealthy-Air Alerts (Pipedream)
+# ----------------------------------------
+# Alert detection runs after each snapshot is published: sensors that were safe
+# last cycle and are now in an unhealthy category become events in a local
+# SQLite outbox. Nothing on the refresh path talks to the webhook; a background
+# worker delivers pending events in batches, retrying with backoff, so a slow or
+# failing webhook only delays alerts instead of the data refresh.
+#
+# Events are keyed by sensor, category and detection window, so the same
+# transition is never queued twice (e.g. after a restart that lost the last
+# checkpoint) and every delivered item carries its id for receiver-side dedup.
+#
+# The set of previously safe sensors lives in memory; it is read from disk once
+# at startup and written back by the worker whenever it changed.
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import httpx
+import numpy as np
+
+import logs
+from aqi import AQI_CATEGORIES, UNKNOWN_CATEGORY
+from sensor_table import SensorTable
+
+
+log = logs.get_logger("alerts")
+
+
+ALERT_OUTBOX_PATH = os.getenv("ALERT_OUTBOX_PATH", "alerts.db")
+SAFE_IDS_PATH = os.getenv("PREV_SAFE_IDS_PATH", "prev_safe_ids.txt")
+
+UNHEALTHY_CATEGORIES = {"Unhealthy", "Very Unhealthy", "Hazardous", "Unhealthy for Sensitive Groups"}
+UNHEALTHY_CODES = [i for i, (name, _) in enumerate(AQI_CATEGORIES) if name in UNHEALTHY_CATEGORIES]
+
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "50"))
+ALERT_MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "8"))
+ALERT_RETRY_BASE_SECONDS = 5.0
+ALERT_RETRY_MAX_SECONDS = 600.0
+# A sensor re-entering the same category within this window isn't alerted again
+ALERT_DEDUP_SECONDS = int(os.getenv("ALERT_DEDUP_SECONDS", "3600"))
+# How often the worker wakes up when nothing notifies it
+ALERT_POLL_SECONDS = 30.0
+DELIVERED_RETENTION_DAYS = 7
+ALERT_TIMEOUT = httpx.Timeout(5.0, read=10.0)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    event_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    delivered_at REAL,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (next_attempt) WHERE delivered_at IS NULL;
+"""
+
+
+class Outbox:
+    """Durable queue of alert events, one SQLite connection behind a lock."""
+
+    def __init__(self, path: str = ALERT_OUTBOX_PATH):
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, events: List[Dict[str, Any]]) -> int:
+        """Add events (each with an "id"); ids already in the outbox are ignored."""
+        now = time.time()
+        rows = [(e["id"], now, json.dumps(e), now) for e in events]
+        with self._lock:
+            conn = self._get_conn()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (event_id, created_at, payload, next_attempt) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def due(self, limit: int = ALERT_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Oldest undelivered events whose retry time has come."""
+        with self._lock:
+            rows = self._get_conn().execute(
+                "SELECT payload FROM outbox WHERE delivered_at IS NULL AND attempts < ? AND next_attempt <= ? "
+                "ORDER BY created_at LIMIT ?",
+                (ALERT_MAX_ATTEMPTS, time.time(), limit),
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def next_due(self) -> Optional[float]:
+        """When the earliest pending event can be retried, or None if none are pending."""
+        with self._lock:
+            (next_attempt,) = self._get_conn().execute(
+                "SELECT MIN(next_attempt) FROM outbox WHERE delivered_at IS NULL AND attempts < ?",
+                (ALERT_MAX_ATTEMPTS,),
+            ).fetchone()
+        return next_attempt
+
+    def mark_delivered(self, event_ids: List[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._get_conn().executemany(
+                "UPDATE outbox SET delivered_at = ?, attempts = attempts + 1, last_error = NULL WHERE event_id = ?",
+                [(now, event_id) for event_id in event_ids],
+            )
+
+    def mark_failed(self, event_ids: List[str], error: str) -> None:
+        """Count a failed attempt and schedule the next one with jittered backoff."""
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN")
+            try:
+                for event_id in event_ids:
+                    row = conn.execute("SELECT attempts FROM outbox WHERE event_id = ?", (event_id,)).fetchone()
+                    if row is None:
+                        continue
+                    delay = min(ALERT_RETRY_BASE_SECONDS * 2 ** row[0], ALERT_RETRY_MAX_SECONDS)
+                    conn.execute(
+                        "UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE event_id = ?",
+                        (now + delay * random.uniform(0.5, 1.0), error, event_id),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def prune(self, retention_days: int = DELIVERED_RETENTION_DAYS) -> None:
+        """Drop delivered (or abandoned) events older than the retention window."""
+        cutoff = time.time() - retention_days * 86400
+        with self._lock:
+            self._get_conn().execute(
+                "DELETE FROM outbox WHERE created_at < ? AND (delivered_at IS NOT NULL OR attempts >= ?)",
+                (cutoff, ALERT_MAX_ATTEMPTS),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            pending, failed, delivered = self._get_conn().execute(
+                "SELECT "
+                "COALESCE(SUM(delivered_at IS NULL AND attempts < ?), 0), "
+                "COALESCE(SUM(delivered_at IS NULL AND attempts >= ?), 0), "
+                "COALESCE(SUM(delivered_at IS NOT NULL), 0) FROM outbox",
+                (ALERT_MAX_ATTEMPTS, ALERT_MAX_ATTEMPTS),
+            ).fetchone()
+        return {"pending": pending, "failed": failed, "delivered": delivered}
+
+
+class AlertPipeline:
+    """Detects safe -> unhealthy transitions and delivers them from the outbox."""
+
+    def __init__(self, outbox: Optional[Outbox] = None, webhook_url: Optional[str] = None,
+                 safe_ids_path: str = SAFE_IDS_PATH):
+        self.outbox = outbox or Outbox()
+        self._webhook_url = webhook_url
+        self._safe_ids_path = safe_ids_path
+        self._safe_ids: Optional[Set[str]] = None
+        self._state_lock = threading.Lock()
+        self._dirty = False
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def webhook_url(self) -> Optional[str]:
+        return self._webhook_url or os.getenv("VITE_PIPEDREAM_REALTIME")
+
+    # --- previous-state tracking ---
+
+    def _load_safe_ids(self) -> Set[str]:
+        try:
+            with open(self._safe_ids_path) as f:
+                return set(f.read().splitlines())
+        except FileNotFoundError:
+            return set()
+        except Exception as e:
+            log.error("Error loading previous safe sensors", error=repr(e))
+            return set()
+
+    def _checkpoint(self) -> None:
+        with self._state_lock:
+            if not self._dirty or self._safe_ids is None:
+                return
+            ids = sorted(self._safe_ids)
+            self._dirty = False
+        try:
+            tmp_path = f"{self._safe_ids_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(ids))
+            os.replace(tmp_path, self._safe_ids_path)
+        except Exception as e:
+            log.error("Error saving previous safe sensors", error=repr(e))
+            with self._state_lock:
+                self._dirty = True
+
+    # --- detection ---
+
+    def process(self, sensors: SensorTable, removed: Optional[Iterable[str]] = None) -> int:
+        """
+        Queue an event for every sensor that was safe last time and is unhealthy
+        now, and remember which sensors are safe for the next call. Returns the
+        number of newly queued events.
+
+        With `removed` (ids that dropped out of this table) only the state of
+        this table's sensors is replaced, so each region can be processed on its
+        own; without it the table is taken to hold every sensor.
+        """
+        unhealthy = np.isin(sensors.category, UNHEALTHY_CODES)
+        known = sensors.category != UNKNOWN_CATEGORY
+
+        with self._state_lock:
+            if self._safe_ids is None:
+                self._safe_ids = self._load_safe_ids()
+            previously_safe = self._safe_ids
+            triggered_rows = [i for i in np.flatnonzero(unhealthy).tolist() if sensors.ids[i] in previously_safe]
+            new_safe_ids = {sensors.ids[i] for i in np.flatnonzero(known & ~unhealthy).tolist()}
+            if removed is not None:
+                new_safe_ids |= previously_safe - set(sensors.ids) - set(removed)
+            if new_safe_ids != previously_safe:
+                self._safe_ids = new_safe_ids
+                self._dirty = True
+
+        queued = 0
+        if triggered_rows:
+            window = int(time.time() // ALERT_DEDUP_SECONDS)
+            events = []
+            for s in sensors.records(triggered_rows):
+                category = s["aqiCategory"]["category"]
+                events.append({
+                    "id": f"{s['id']}:{category}:{window}",
+                    "name": s["name"],
+                    "aqi": s["aqi"],
+                    "category": category,
+                })
+            queued = self.outbox.enqueue(events)
+            for e in events:
+                log.warning("Sensor became unhealthy", sensor=e["name"], category=e["category"], aqi=e["aqi"])
+            log.info("Queued alerts", triggered=len(events), queued=queued)
+        self._wake.set()
+        return queued
+
+    # --- delivery ---
+
+    def deliver_pending(self, client: httpx.Client) -> int:
+        """Send due events in batches until none are left; returns how many were delivered."""
+        url = self.webhook_url
+        if not url:
+            return 0
+        delivered = 0
+        while not self._stopping.is_set():
+            batch = self.outbox.due()
+            if not batch:
+                break
+            event_ids = [e["id"] for e in batch]
+            try:
+                response = client.post(url, json={"sensors": batch})
+                response.raise_for_status()
+            except Exception as e:
+                log.warning("Alert delivery failed, will retry", events=len(batch), error=repr(e))
+                self.outbox.mark_failed(event_ids, repr(e))
+                break
+            self.outbox.mark_delivered(event_ids)
+            delivered += len(batch)
+        return delivered
+
+    def _run(self) -> None:
+        with httpx.Client(timeout=ALERT_TIMEOUT) as client:
+            timeout = 0.0
+            while not self._stopping.is_set():
+                self._wake.wait(timeout)
+                self._wake.clear()
+                timeout = ALERT_POLL_SECONDS
+                try:
+                    self._checkpoint()
+                    self.deliver_pending(client)
+                    self.outbox.prune()
+                    next_due = self.outbox.next_due()
+                    if next_due is not None and self.webhook_url:
+                        timeout = min(timeout, max(next_due - time.time(), 0.0))
+                except Exception:
+                    log.exception("Error in alert worker")
+        self._checkpoint()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="alerts", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,94 @@
+# ----------------------------------------
+# AQI Calculation (from aqiUtils.ts)
+# ----------------------------------------
+# Breakpoint tables are turned into NumPy arrays once, so whole series convert
+# to AQI values and category codes with a single searchsorted lookup.
+#
+# PM2.5 keeps the site's own scale (50 AQI points per band, matching
+# aqiUtils.ts); the other pollutants use the EPA breakpoints with concentrations
+# in the units SimpleAQ reports (ug/m3 for PM10, ppm for gases).
+
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+AQI_BREAKPOINTS = [
+    {"min": 0, "max": 12, "category": "Good", "color": "#4ade80"},
+    {"min": 12.1, "max": 35.4, "category": "Moderate", "color": "#facc15"},
+    {"min": 35.5, "max": 55.4, "category": "Unhealthy for Sensitive Groups", "color": "#fb923c"},
+    {"min": 55.5, "max": 150.4, "category": "Unhealthy", "color": "#f87171"},
+    {"min": 150.5, "max": 250.4, "category": "Very Unhealthy", "color": "#c084fc"},
+    {"min": 250.5, "max": 500, "category": "Hazardous", "color": "#ef4444"}
+]
+
+# (category, color) per category code
+AQI_CATEGORIES = tuple((bp["category"], bp["color"]) for bp in AQI_BREAKPOINTS)
+
+UNKNOWN_CATEGORY = -1
+MAX_AQI = 500
+
+# EPA index bands shared by the non-PM2.5 pollutants
+_EPA_INDEX = [(0, 50), (51, 100), (101, 150), (151, 200), (201, 300), (301, 500)]
+
+# pollutant (DATA_VAL_DICT key) -> [(conc_lo, conc_hi, aqi_lo, aqi_hi), ...]
+POLLUTANT_BREAKPOINTS: Dict[str, list] = {
+    "pm2.5": [(bp["min"], bp["max"], i * 50, i * 50 + 50) for i, bp in enumerate(AQI_BREAKPOINTS)],
+    "pm10": [(c_lo, c_hi, a_lo, a_hi) for (c_lo, c_hi), (a_lo, a_hi) in zip(
+        [(0, 54), (55, 154), (155, 254), (255, 354), (355, 424), (425, 604)], _EPA_INDEX)],
+    # 8-hour bands up to 0.200 ppm, then the 1-hour bands EPA uses above that
+    "O3": [(c_lo, c_hi, a_lo, a_hi) for (c_lo, c_hi), (a_lo, a_hi) in zip(
+        [(0, 0.054), (0.055, 0.070), (0.071, 0.085), (0.086, 0.105), (0.106, 0.200), (0.205, 0.404), (0.405, 0.604)],
+        _EPA_INDEX[:5] + [(201, 300), (301, 500)])],
+    "NO2": [(c_lo, c_hi, a_lo, a_hi) for (c_lo, c_hi), (a_lo, a_hi) in zip(
+        [(0, 0.053), (0.054, 0.100), (0.101, 0.360), (0.361, 0.649), (0.650, 1.249), (1.250, 2.049)], _EPA_INDEX)],
+    "SO2": [(c_lo, c_hi, a_lo, a_hi) for (c_lo, c_hi), (a_lo, a_hi) in zip(
+        [(0, 0.035), (0.036, 0.075), (0.076, 0.185), (0.186, 0.304), (0.305, 0.604), (0.605, 1.004)], _EPA_INDEX)],
+}
+
+
+def _tables(breakpoints: list) -> Tuple[np.ndarray, ...]:
+    arr = np.asarray(breakpoints, dtype=np.float64)
+    conc_lo, conc_hi, aqi_lo, aqi_hi = arr.T
+    slope = (aqi_hi - aqi_lo) / (conc_hi - conc_lo)
+    # category per band, so O3's 8-hour and 1-hour 201-300 bands share one
+    category = np.searchsorted(np.unique(aqi_lo), aqi_lo)
+    return conc_lo, conc_hi, aqi_lo, slope, category
+
+
+_TABLES = {pollutant: _tables(bps) for pollutant, bps in POLLUTANT_BREAKPOINTS.items()}
+
+
+def has_aqi(pollutant: Optional[str]) -> bool:
+    return pollutant in _TABLES
+
+
+def aqi_array(values: Any, pollutant: str = "pm2.5") -> np.ndarray:
+    """
+    AQI for every concentration in `values` (float array, NaN stays NaN).
+    Negative values give 0 and anything above the top band gives 500.
+    """
+    conc_lo, conc_hi, aqi_lo, slope, _ = _TABLES[pollutant]
+    x = np.asarray(values, dtype=np.float64)
+    band = np.searchsorted(conc_hi, x, side="left")
+    over = band >= len(conc_hi)
+    band = np.minimum(band, len(conc_hi) - 1)
+    # Values in the gap below a band's lower bound clamp to that band's floor
+    aqi = np.round(np.maximum(slope[band] * (x - conc_lo[band]), 0) + aqi_lo[band])
+    aqi = np.where(over, MAX_AQI, aqi)
+    aqi = np.where(x < 0, 0, aqi)
+    return np.where(np.isnan(x), np.nan, aqi)
+
+
+def category_codes(values: Any, pollutant: str = "pm2.5") -> np.ndarray:
+    """Index into AQI_CATEGORIES for every value; UNKNOWN_CATEGORY for NaN."""
+    _, conc_hi, _, _, category = _TABLES[pollutant]
+    x = np.asarray(values, dtype=np.float64)
+    codes = category[np.minimum(np.searchsorted(conc_hi, x, side="left"), len(conc_hi) - 1)]
+    return np.where(np.isnan(x), UNKNOWN_CATEGORY, codes).astype(np.int8)
+
+
+def aqi_list(values: Sequence[Optional[float]], pollutant: str = "pm2.5") -> list:
+    """aqi_array for JSON output: ints, with None where the input is None/NaN."""
+    aqi = aqi_array(np.asarray(values, dtype=np.float64), pollutant)
+    return [None if a != a else int(a) for a in aqi.tolist()]
@@ -0,0 +1,333 @@
+# ----------------------------------------
+# Offline Benchmark Suite
+# ----------------------------------------
+# Runs the backend against mock_simpleaq.py (started as a subprocess) and
+# reports:
+#   - refresh_data wall time (cold, warm with nothing new, all sensors new)
+#   - generate_24hour_data / generate_historical_data latency (first call and
+#     repeated calls)
+#   - requests/s and p50/p99 latency per endpoint under concurrent load, against
+#     the app served by uvicorn in its own process
+#
+#   python benchmark.py --sensors 200 --latency 50 --concurrency 32 --duration 5
+#   python benchmark.py --json results.json
+#   python benchmark.py --baseline results.json   # exit 1 on regressions
+#
+# All state (series store, snapshot, alert outbox) goes to a temporary directory.
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import httpx
+import numpy as np
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until(check: Callable[[], bool], timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"timed out waiting for {what}")
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def start_mock(args: argparse.Namespace) -> subprocess.Popen:
+    port = _free_port()
+    cmd = [
+        sys.executable, os.path.join(BACKEND_DIR, "mock_simpleaq.py"), "--port", str(port),
+        "--sensors", str(args.sensors), "--interval", str(args.interval),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--offline", str(args.offline), "--stale", str(args.stale),
+    ]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR)
+    proc.url = f"http://127.0.0.1:{port}"
+    _wait_until(lambda: httpx.get(f"{proc.url}/stats").status_code == 200, 30, "mock SimpleAQ")
+    return proc
+
+
+def mock_calls(mock: subprocess.Popen) -> Dict[str, int]:
+    return httpx.get(f"{mock.url}/stats").json()
+
+
+def _calls_delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {k: after[k] - before.get(k, 0) for k in after}
+
+
+# ----------------------------------------
+# In-process: refresh and series generation
+# ----------------------------------------
+
+
+def bench_refresh_and_series(args: argparse.Namespace, mock: subprocess.Popen) -> Dict[str, Any]:
+    import server
+    from polling import PollScheduler
+
+    results: Dict[str, Any] = {}
+
+    def timed_refresh(name: str) -> None:
+        before = mock_calls(mock)
+        start = time.perf_counter()
+        snap = server.refresh_data()
+        results[name] = {
+            "seconds": time.perf_counter() - start,
+            "sensors": len(snap.sensors),
+            "upstream_calls": _calls_delta(before, mock_calls(mock)),
+        }
+
+    timed_refresh("refresh_cold")
+    timed_refresh("refresh_warm")
+    # Fresh polling state: every sensor looks like it has new points again
+    region = server.REGION_STATES[server.regions.DEFAULT_REGION]
+    region.poller = PollScheduler(base_seconds=region.region.refresh_minutes * 60)
+    timed_refresh("refresh_all_new")
+
+    sensor_ids = list(server.snapshot.current().sensors.ids)[:args.series_sensors]
+    field = server.DATA_VAL_DICT["pm2.5"]
+    loop = asyncio.new_event_loop()
+
+    def series_latency(name: str, call: Callable[[str], Any]) -> None:
+        first, repeat = [], []
+        for sensor_id in sensor_ids:
+            start = time.perf_counter()
+            call(sensor_id)
+            first.append(time.perf_counter() - start)
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                call(sensor_id)
+                repeat.append(time.perf_counter() - start)
+        results[name] = {"first": _summary(first), "repeat": _summary(repeat)}
+
+    now = lambda: server.datetime.now().isoformat()
+    series_latency("generate_24hour_data", lambda s: loop.run_until_complete(server.generate_24hour_data(now(), field, s)))
+    for time_range in ("7d", "30d"):
+        series_latency(
+            f"generate_historical_data_{time_range}",
+            lambda s: loop.run_until_complete(server.generate_historical_data(s, field, time_range)),
+        )
+    loop.close()
+    return results
+
+
+# ----------------------------------------
+# Out of process: endpoint throughput
+# ----------------------------------------
+
+
+def start_server(env: Dict[str, str]) -> subprocess.Popen:
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    proc.url = f"http://127.0.0.1:{port}"
+    _wait_until(
+        lambda: httpx.get(f"{proc.url}/api/status").json()["source"] == "live", 300, "first server refresh"
+    )
+    return proc
+
+
+async def _load(client: httpx.AsyncClient, path: str, concurrency: int, duration: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                resp = await client.get(path)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"rps": len(latencies) / elapsed, "errors": errors, **_summary(latencies)}
+
+
+def bench_endpoints(args: argparse.Namespace, server_proc: subprocess.Popen) -> Dict[str, Any]:
+    sensors = httpx.get(f"{server_proc.url}/api/sensors").json()
+    sensor_id = sensors[0]["id"] if sensors else ""
+    paths = [
+        "/api/sensors",
+        "/api/sensors/changes?since=0",
+        "/api/sensors/near?lat=40.1&lng=-82.5&k=5",
+        "/api/statistics",
+        "/api/counter",
+        "/api/status",
+        "/api/pm25/grid",
+        f"/api/hourly?sensor_id={sensor_id}&metric=pm2.5",
+        f"/api/historical?sensor_id={sensor_id}&metric=pm2.5&time_range=7d",
+        f"/api/historical?sensor_id={sensor_id}&metric=pm2.5&time_range=30d",
+    ]
+
+    async def run_all():
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=server_proc.url, limits=limits, timeout=60.0,
+                                     headers={"Accept-Encoding": "gzip"}) as client:
+            out = {}
+            for path in paths:
+                await client.get(path)  # warm caches
+                out[path] = await _load(client, path, args.concurrency, args.duration)
+            return out
+
+    return asyncio.run(run_all())
+
+
+# ----------------------------------------
+# Reporting
+# ----------------------------------------
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print("\n== refresh_data ==")
+    for name in ("refresh_cold", "refresh_warm", "refresh_all_new"):
+        r = results[name]
+        calls = ", ".join(f"{k}={v}" for k, v in r["upstream_calls"].items() if v)
+        print(f"{name:<18} {r['seconds']:8.3f}s  sensors={r['sensors']}  upstream: {calls or 'none'}")
+
+    print("\n== series generation (ms) ==")
+    print(f"{'':<34} {'first p50':>10} {'first p99':>10} {'repeat p50':>11} {'repeat p99':>11}")
+    for name, r in results.items():
+        if name.startswith("generate_"):
+            print(f"{name:<34} {r['first']['p50_ms']:10.2f} {r['first']['p99_ms']:10.2f} "
+                  f"{r['repeat']['p50_ms']:11.2f} {r['repeat']['p99_ms']:11.2f}")
+
+    if "endpoints" in results:
+        print("\n== endpoints ==")
+        print(f"{'':<62} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for path, r in results["endpoints"].items():
+            print(f"{path:<62} {r['rps']:9.1f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f} {r['errors']:7d}")
+
+
+def _metrics(results: Dict[str, Any]) -> Dict[str, tuple]:
+    """Flatten results to {name: (value, higher_is_better)} for baseline comparison."""
+    flat = {}
+    for name in ("refresh_cold", "refresh_warm", "refresh_all_new"):
+        flat[f"{name}.seconds"] = (results[name]["seconds"], False)
+    for name, r in results.items():
+        if name.startswith("generate_"):
+            flat[f"{name}.repeat_p50_ms"] = (r["repeat"]["p50_ms"], False)
+    for path, r in results.get("endpoints", {}).items():
+        flat[f"{path}.rps"] = (r["rps"], True)
+        flat[f"{path}.p99_ms"] = (r["p99_ms"], False)
+    return flat
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    current, previous = _metrics(results), _metrics(baseline)
+    regressions = []
+    for name, (value, higher_is_better) in current.items():
+        if name not in previous or not previous[name][0]:
+            continue
+        change = (value - previous[name][0]) / previous[name][0]
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {previous[name][0]:.3f} -> {value:.3f} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the backend against a local SimpleAQ mock")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--interval", type=int, default=120, help="seconds between mock points")
+    parser.add_argument("--latency", type=float, default=20.0, help="mean mock latency (ms)")
+    parser.add_argument("--jitter", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--offline", type=float, default=0.05)
+    parser.add_argument("--stale", type=float, default=0.05)
+    parser.add_argument("--series-sensors", type=int, default=5, help="sensors used for series latency")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of load per endpoint")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression vs baseline")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="clearairwave-bench-")
+    mock = start_mock(args)
+    env = {
+        **os.environ,
+        "SIMPLEAQ_API_URL": f"{mock.url}/api",
+        "SERIES_STORE_PATH": os.path.join(workdir, "series.db"),
+        "SNAPSHOT_PATH": os.path.join(workdir, "snapshot.json"),
+        "SHARED_SNAPSHOT_PATH": os.path.join(workdir, "snapshot.shm"),
+        "CLUSTER_LOCK_PATH": os.path.join(workdir, "refresh.lock"),
+        "ALERT_OUTBOX_PATH": os.path.join(workdir, "alerts.db"),
+        "PREV_SAFE_IDS_PATH": os.path.join(workdir, "prev_safe_ids.txt"),
+        "VITE_PIPEDREAM_REALTIME": "",
+    }
+    os.environ.update(env)
+    server_proc = None
+    try:
+        results = bench_refresh_and_series(args, mock)
+        if not args.skip_endpoints:
+            # Separate state so the served app starts cold like a fresh deploy
+            env["SERIES_STORE_PATH"] = os.path.join(workdir, "series-server.db")
+            env["SNAPSHOT_PATH"] = os.path.join(workdir, "snapshot-server.json")
+            env["SHARED_SNAPSHOT_PATH"] = os.path.join(workdir, "snapshot-server.shm")
+            env["CLUSTER_LOCK_PATH"] = os.path.join(workdir, "refresh-server.lock")
+            server_proc = start_server(env)
+            results["endpoints"] = bench_endpoints(args, server_proc)
+    finally:
+        for proc in (server_proc, mock):
+            if proc is not None:
+                proc.terminate()
+                proc.wait(10)
+
+    results["config"] = vars(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions vs baseline:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("\nNo regressions vs baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# ----------------------------------------
+# Sensor Update Stream (Server-Sent Events)
+# ----------------------------------------
+# Each published snapshot is encoded once into SSE frames (a full "snapshot"
+# event and a "delta" event) and appended to one shared ring buffer. Every
+# connected client just keeps a cursor into that buffer and writes the same
+# bytes, so an update costs the publisher the same whether 1 or 5000 clients
+# are listening. The publisher never waits on clients: a client that falls
+# behind the buffer is resynced with the latest full snapshot instead.
+
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+# Updates kept for slow or reconnecting clients (one day at 10 min refreshes)
+STREAM_BUFFER_SIZE = 144
+# Comment line sent on idle connections so proxies don't drop them
+KEEPALIVE_SECONDS = 15.0
+
+
+def sse_frame(event: str, event_id: int, data: bytes) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, event.encode(), data)
+
+
+class Broadcaster:
+    def __init__(self, buffer_size: int = STREAM_BUFFER_SIZE):
+        # (generation, delta frame); only touched on the event loop thread
+        self._buffer: Deque[Tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self._latest: Optional[Tuple[int, bytes]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self.subscribers = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Attach to the loop that serves the stream; call from that loop."""
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def publish(self, generation: int, snapshot_data: bytes, delta_data: bytes) -> None:
+        """Queue a new generation for all clients. Safe to call from any thread."""
+        snapshot_frame = sse_frame("snapshot", generation, snapshot_data)
+        delta_frame = sse_frame("delta", generation, delta_data)
+        if self._loop is None:
+            self._latest = (generation, snapshot_frame)
+            return
+        self._loop.call_soon_threadsafe(self._append, generation, snapshot_frame, delta_frame)
+
+    def _append(self, generation: int, snapshot_frame: bytes, delta_frame: bytes) -> None:
+        # A generation that doesn't follow the last one (e.g. restart) breaks the
+        # delta chain, so clients will resync from the full snapshot
+        if self._buffer and generation != self._buffer[-1][0] + 1:
+            self._buffer.clear()
+        self._buffer.append((generation, delta_frame))
+        self._latest = (generation, snapshot_frame)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _pending(self, cursor: Optional[int]) -> Tuple[Optional[int], list]:
+        """Frames a client at `cursor` still needs, and its new cursor."""
+        if self._latest is None:
+            return cursor, []
+        latest_generation = self._latest[0]
+        if cursor == latest_generation:
+            return cursor, []
+        if cursor is not None and self._buffer and self._buffer[0][0] <= cursor + 1 and cursor < latest_generation:
+            return latest_generation, [frame for gen, frame in self._buffer if gen > cursor]
+        return latest_generation, [self._latest[1]]
+
+    async def subscribe(self, last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield SSE frames for one client until it disconnects."""
+        if self._loop is None:
+            self.bind(asyncio.get_running_loop())
+        self.subscribers += 1
+        cursor = last_event_id
+        try:
+            while True:
+                changed = self._changed
+                cursor, frames = self._pending(cursor)
+                if frames:
+                    for frame in frames:
+                        yield frame
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            self.subscribers -= 1
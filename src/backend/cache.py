@@ -0,0 +1,153 @@
+# ----------------------------------------
+# Response Cache
+# ----------------------------------------
+# Bounded LRU cache with TTL expiry and single-flight loading: when several
+# requests miss on the same key at once, only the first one runs the loader and
+# the rest wait for its result. Works from both sync handlers (threadpool) and
+# async handlers since waiters share a concurrent.futures.Future. If the leading
+# request is cancelled, one of its waiters takes the load over.
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Abandoned(Exception):
+    """The leading load was cancelled; its waiters look the key up again."""
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any, Future, bool]:
+        """
+        Returns (hit, value, future, is_leader). On a miss the caller either
+        leads the load (is_leader) or waits on the leader's future.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, None, False
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, None, future, False
+
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return False, None, future, True
+
+    def _finish(self, key: Hashable, future: Future, value: Any = None, error: BaseException = None) -> None:
+        with self._lock:
+            # A clear() during the load detaches it: its waiters still get the
+            # result, but it was computed from pre-clear state so isn't cached
+            current = self._inflight.get(key) is future
+            if current:
+                del self._inflight[key]
+            if error is None and current:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def _abandon(self, key: Hashable, future: Future) -> None:
+        # Cancellation (or an interrupt) is the leader's own, not the load's
+        # result: detach it and let a waiter take the load over
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.set_exception(_Abandoned())
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        while True:
+            hit, value, future, is_leader = self._lookup(key)
+            if hit:
+                return value
+            if not is_leader:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    continue
+            try:
+                value = loader()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._finish(key, future, value)
+            return value
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            hit, value, future, is_leader = self._lookup(key)
+            if hit:
+                return value
+            if not is_leader:
+                try:
+                    return await asyncio.wrap_future(future)
+                except _Abandoned:
+                    continue
+            try:
+                value = await loader()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._finish(key, future, value)
+            return value
+
+    def clear(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """
+        Drop all cached entries, or only those whose key satisfies `match`.
+        Matching loads still in flight complete for their waiters but are not
+        cached, and later misses start a fresh load instead of joining them.
+        """
+        with self._lock:
+            if match is None:
+                self._entries.clear()
+                self._inflight.clear()
+                return
+            for key in [k for k in self._entries if match(k)]:
+                del self._entries[key]
+            for key in [k for k in self._inflight if match(k)]:
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
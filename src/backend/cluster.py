@@ -0,0 +1,158 @@
+# ----------------------------------------
+# Leader Election for Multi-worker Deployments
+# ----------------------------------------
+# With several uvicorn/gunicorn workers only one of them should crawl SimpleAQ.
+# Every worker tries to take an exclusive lock on CLUSTER_LOCK_PATH at startup:
+#
+# - the winner is the leader: it runs the scheduler/refreshers as a single
+#   process would and writes every published snapshot to SHARED_SNAPSHOT_PATH
+#   (one file per region, see regions.path_for)
+# - the others are followers: they never refresh, they watch the shared files
+#   and publish whatever the leader wrote (memory-mapped, see shared_snapshot)
+#
+# The OS drops the lock when the leader process dies, and followers keep trying
+# to take it, so one of them takes over the refresh within LEADER_RETRY_SECONDS.
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import logs
+import regions
+import shared_snapshot
+import snapshot
+from snapshot import Snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+CLUSTER_LOCK_PATH = os.getenv("CLUSTER_LOCK_PATH", "refresh.lock")
+SHARED_SNAPSHOT_PATH = os.getenv("SHARED_SNAPSHOT_PATH", "snapshot.shm")
+# How often followers look for a new shared snapshot / a free leader lock
+FOLLOWER_POLL_SECONDS = float(os.getenv("FOLLOWER_POLL_SECONDS", "1.0"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "5.0"))
+
+log = logs.get_logger("cluster")
+
+
+class FileLock:
+    """Non-blocking exclusive lock on a file, held until release() or process exit."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Cluster:
+    def __init__(self, on_leader: Callable[[], None], on_snapshot: Callable[[Snapshot], None],
+                 lock_path: str = CLUSTER_LOCK_PATH, shared_path: str = SHARED_SNAPSHOT_PATH):
+        self._on_leader = on_leader
+        self._on_snapshot = on_snapshot
+        self._lock = FileLock(lock_path)
+        self.shared_path = shared_path
+        self.shared_paths = {r.name: regions.path_for(shared_path, r.name) for r in regions.REGIONS}
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # region -> version of its shared file last loaded (or tried)
+        self._seen: Dict[str, Tuple[int, int, int]] = {}
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock.held
+
+    @property
+    def role(self) -> str:
+        return "leader" if self.is_leader else "follower"
+
+    def start(self) -> None:
+        self._stopping.clear()
+        if self._lock.try_acquire():
+            self._become_leader()
+            return
+        log.info("Running as follower", pid=os.getpid(), shared_path=self.shared_path)
+        self._thread = threading.Thread(target=self._follow, name="cluster-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(FOLLOWER_POLL_SECONDS * 2)
+            self._thread = None
+        self._lock.release()
+
+    def publish(self, snap: Snapshot) -> None:
+        """Share a snapshot the leader just published with the followers."""
+        if self.is_leader:
+            shared_snapshot.write(snap, self.shared_paths[snap.region])
+
+    def _become_leader(self) -> None:
+        log.info("Running as refresh leader", pid=os.getpid(), lock=self._lock.path)
+        self._on_leader()
+
+    def _load_shared(self, region: str) -> None:
+        path = self.shared_paths[region]
+        version = shared_snapshot.file_version(path)
+        if version is None or version == self._seen.get(region):
+            return
+        # marked before reading so a bad file is only retried once it changes
+        self._seen[region] = version
+        snap = shared_snapshot.read(path)
+        current = snapshot.current(region)
+        # skip what we already serve (e.g. the same refresh loaded from SNAPSHOT_PATH)
+        if (snap.generation, snap.source) != (current.generation, current.source):
+            self._on_snapshot(snap)
+
+    def _follow(self) -> None:
+        next_lock_attempt = time.monotonic() + LEADER_RETRY_SECONDS
+        wait = 0.0  # the first check runs right away
+        while not self._stopping.wait(wait):
+            wait = FOLLOWER_POLL_SECONDS
+            for region in self.shared_paths:
+                try:
+                    self._load_shared(region)
+                except Exception as e:
+                    log.error("Error reading shared snapshot", region=region, error=repr(e))
+            if time.monotonic() >= next_lock_attempt:
+                next_lock_attempt = time.monotonic() + LEADER_RETRY_SECONDS
+                if self._lock.try_acquire():
+                    self._become_leader()
+                    return
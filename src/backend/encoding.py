@@ -0,0 +1,114 @@
+# ----------------------------------------
+# Pre-encoded Responses
+# ----------------------------------------
+# Snapshot endpoints only change once per refresh, so their JSON body and its
+# gzip/brotli variants are built once when the snapshot is published and then
+# handed out as raw bytes, skipping validation and serialization per request.
+
+import gzip
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+from fastapi.responses import Response
+
+from profiling import timed
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli variant is skipped
+    brotli = None
+
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+@dataclass(frozen=True)
+class EncodedPayload:
+    identity: bytes
+    gzip: bytes
+    br: Optional[bytes] = None
+    media_type: str = "application/json"
+
+
+@timed("serialization")
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def encode_payload(obj: Any) -> EncodedPayload:
+    return compress_payload(dumps(obj))
+
+
+def compress_payload(body: bytes, media_type: str = "application/json") -> EncodedPayload:
+    return EncodedPayload(
+        identity=body,
+        gzip=gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+        br=brotli.compress(body, quality=BROTLI_QUALITY) if brotli is not None else None,
+        media_type=media_type,
+    )
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    return accepted
+
+
+def respond(payload: EncodedPayload, accept_encoding: str = "", headers: Optional[Dict[str, str]] = None) -> Response:
+    """Pick the best pre-built variant for the client's Accept-Encoding."""
+    accepted = _accepted_encodings(accept_encoding)
+    response_headers = {"Vary": "Accept-Encoding"}
+    if headers:
+        response_headers.update(headers)
+
+    if payload.br is not None and accepted.get("br", 0) > 0:
+        body = payload.br
+        response_headers["Content-Encoding"] = "br"
+    elif accepted.get("gzip", 0) > 0:
+        body = payload.gzip
+        response_headers["Content-Encoding"] = "gzip"
+    else:
+        body = payload.identity
+    return Response(content=body, media_type=payload.media_type, headers=response_headers)
+
+
+def not_modified(request_headers: Mapping[str, str], etag: str, last_modified: Optional[datetime]) -> bool:
+    """True if a conditional GET already has the current version."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison: W/"x" and "x" name the same version
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    return False
@@ -0,0 +1,201 @@
+# ----------------------------------------
+# Raw Data Export
+# ----------------------------------------
+# Streams one sensor/field series as CSV, NDJSON or Parquet for /api/export.
+# The range is walked in fixed EXPORT_WINDOW_SECONDS windows: each window is
+# read from the local store when its coverage holds it, otherwise fetched from
+# getgraphdata (and not stored, so arbitrary old ranges don't bloat the store).
+# Only the window being written and the one being prefetched are in memory, so
+# the cost of an export is flat no matter how long the range is.
+
+import asyncio
+import csv
+import io
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+import numpy as np
+
+import encoding
+import ingest
+import logs
+import profiling
+import store
+import upstream
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet exports are refused
+    pa = None
+
+
+EXPORT_WINDOW_SECONDS = int(os.getenv("EXPORT_WINDOW_HOURS", "24")) * 3600
+# Longest range one export may ask for
+EXPORT_MAX_DAYS = int(os.getenv("EXPORT_MAX_DAYS", "400"))
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+COLUMNS = ("sensor_id", "metric", "timestamp", "value")
+
+Window = Tuple[np.ndarray, np.ndarray]
+
+log = logs.get_logger("export")
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+# ----------------------------------------
+# Windowed Reads
+# ----------------------------------------
+
+
+async def _read_window(sensor_id: str, field: str, start: int, end: int,
+                       coverage: Optional[Tuple[int, int]]) -> Window:
+    if coverage is not None and coverage[0] <= start and end <= coverage[1]:
+        times, values = await asyncio.to_thread(store.query, sensor_id, field, start, end)
+        return np.asarray(times, dtype=np.int64), np.asarray(values, dtype=np.float64)
+    return await upstream.run_async(ingest.fetch_window(sensor_id, field, start, end))
+
+
+async def iter_windows(sensor_id: str, field: str, start: int, end: int,
+                       window: int = EXPORT_WINDOW_SECONDS) -> AsyncIterator[Window]:
+    """
+    Yield (times, values) for [start, end] one window at a time, oldest first.
+    The next window is fetched while the caller writes out the current one.
+    """
+    coverage = await asyncio.to_thread(store.get_coverage, sensor_id, field)
+    bounds = [(a, min(a + window - 1, end)) for a in range(start, end + 1, window)]
+    if not bounds:
+        return
+    pending = asyncio.ensure_future(_read_window(sensor_id, field, *bounds[0], coverage))
+    try:
+        for i in range(len(bounds)):
+            result = await pending
+            if i + 1 < len(bounds):
+                pending = asyncio.ensure_future(_read_window(sensor_id, field, *bounds[i + 1], coverage))
+            yield result
+    finally:
+        pending.cancel()
+
+
+# ----------------------------------------
+# Writers
+# ----------------------------------------
+
+
+def _timestamps(times: np.ndarray) -> np.ndarray:
+    return np.char.add(np.datetime_as_string(times.astype("datetime64[s]"), unit="s"), "Z")
+
+
+class CsvWriter:
+    def header(self) -> bytes:
+        return (",".join(COLUMNS) + "\r\n").encode()
+
+    def rows(self, sensor_id: str, metric: str, times: np.ndarray, values: np.ndarray) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerows((sensor_id, metric, t, repr(v)) for t, v in zip(_timestamps(times).tolist(), values.tolist()))
+        return buf.getvalue().encode()
+
+    def close(self) -> bytes:
+        return b""
+
+
+class NdjsonWriter:
+    def header(self) -> bytes:
+        return b""
+
+    def rows(self, sensor_id: str, metric: str, times: np.ndarray, values: np.ndarray) -> bytes:
+        return b"".join(
+            encoding.dumps({"sensor_id": sensor_id, "metric": metric, "timestamp": t, "value": v}) + b"\n"
+            for t, v in zip(_timestamps(times).tolist(), values.tolist())
+        )
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose contents are handed out (and dropped) by take()."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        return len(b)
+
+    def take(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+class ParquetWriter:
+    """One row group per window; the footer goes out on close()."""
+
+    def __init__(self):
+        self._schema = pa.schema([
+            ("sensor_id", pa.string()),
+            ("metric", pa.string()),
+            ("timestamp", pa.timestamp("s", tz="UTC")),
+            ("value", pa.float64()),
+        ])
+        self._sink = _Drain()
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression="zstd")
+
+    def header(self) -> bytes:
+        return self._sink.take()
+
+    def rows(self, sensor_id: str, metric: str, times: np.ndarray, values: np.ndarray) -> bytes:
+        n = len(times)
+        table = pa.Table.from_arrays([
+            pa.array([sensor_id] * n, pa.string()),
+            pa.array([metric] * n, pa.string()),
+            pa.array(times, pa.timestamp("s", tz="UTC")),
+            pa.array(values, pa.float64()),
+        ], schema=self._schema)
+        self._writer.write_table(table)
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.take()
+
+
+WRITERS = {"csv": CsvWriter, "ndjson": NdjsonWriter, "parquet": ParquetWriter}
+
+
+async def stream(sensor_id: str, field: str, metric: str, start: int, end: int, fmt: str) -> AsyncIterator[bytes]:
+    """
+    Encoded chunks of the export, one per window (empty windows are skipped).
+    An upstream failure ends the body early rather than leaving a silent gap.
+    """
+    writer = WRITERS[fmt]()
+    chunk = writer.header()
+    if chunk:
+        yield chunk
+    try:
+        async for times, values in iter_windows(sensor_id, field, start, end):
+            if not len(times):
+                continue
+            with profiling.phase("serialization"):
+                chunk = writer.rows(sensor_id, metric, times, values)
+            if chunk:
+                yield chunk
+    except Exception as e:
+        # headers are already out; ending the body early is all that's left
+        log.error("Export aborted", sensor_id=sensor_id, field=field, error=repr(e))
+        raise
+    chunk = writer.close()
+    if chunk:
+        yield chunk
@@ -0,0 +1,224 @@
+# ----------------------------------------
+# Sensor Ingestion Engine
+# ----------------------------------------
+# Fetches the graph series for every (sensor, field) pair of a refresh at once
+# through the shared upstream client instead of one blocking request at a time.
+
+import asyncio
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+import aggregation
+import store
+import upstream
+
+
+# Fields pulled for every sensor on refresh
+SENSOR_FIELDS = ["pm2.5_ug_m3", "pressure_hPa", "temperature_C", "humidity_percent"]
+
+
+# Backfill is fetched in week-sized getgraphdata chunks
+CHUNK_HOURS = 7 * 24
+# Re-fetch a little before the stored edge in case late points arrived
+TAIL_OVERLAP_SECONDS = 10 * 60
+# Don't bother going upstream for a tail shorter than this
+MIN_TAIL_SECONDS = 60
+
+
+SensorReadings = Union[Dict[str, Dict[str, Any]], Exception]
+
+
+async def fetch_sensor_readings(
+    sensor_ids: List[str],
+    end_time: str,
+    range_hours: int = 1,
+    fields: List[str] = SENSOR_FIELDS,
+) -> Dict[str, SensorReadings]:
+    """
+    Fetch every sensor/field pair concurrently.
+
+    Returns {sensor_id: {field: {"time": [...], "value": [...]}}}. If any field of
+    a sensor fails, that sensor maps to the exception instead, so one bad sensor
+    never takes the rest of the refresh down with it.
+    """
+    pairs: List[Tuple[str, str]] = [(s, f) for s in sensor_ids for f in fields]
+    results = await asyncio.gather(
+        *(upstream.get_graph_data(s, f, range_hours, end_time) for s, f in pairs),
+        return_exceptions=True,
+    )
+
+    readings: Dict[str, SensorReadings] = {s: {} for s in sensor_ids}
+    for (sensor_id, field), result in zip(pairs, results):
+        if isinstance(readings[sensor_id], Exception):
+            continue
+        if isinstance(result, Exception):
+            readings[sensor_id] = result
+        else:
+            readings[sensor_id][field] = result
+    return readings
+
+
+# ----------------------------------------
+# Incremental Series Sync
+# ----------------------------------------
+
+
+def parse_series(data: Dict[str, Any]) -> Tuple[List[int], List[float]]:
+    """Turn getgraphdata's ISO time/value strings into epoch seconds and floats."""
+    times, values = aggregation.parse_series(data.get("time", []), data.get("value", []))
+    return times.tolist(), values.tolist()
+
+
+def _chunks(start: int, end: int) -> List[Tuple[str, int]]:
+    """Split [start, end] into (end_time_iso, range_hours) getgraphdata requests."""
+    chunks = []
+    chunk_end = end
+    while chunk_end > start:
+        hours = min(CHUNK_HOURS, math.ceil((chunk_end - start) / 3600))
+        end_iso = datetime.fromtimestamp(chunk_end, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        chunks.append((end_iso, hours))
+        chunk_end -= hours * 3600
+    return chunks
+
+
+async def fetch_window(sensor_id: str, field: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (times, values) for [start, end] straight from getgraphdata, in week-sized
+    chunks and trimmed to that range. Nothing is stored.
+    """
+    # getgraphdata's range excludes its start, so ask from just before it
+    chunks = _chunks(start - 1, end + 1)
+    results = await asyncio.gather(
+        *(upstream.get_graph_data(sensor_id, field, hours, end_iso) for end_iso, hours in chunks)
+    )
+    parsed = [aggregation.parse_series(r.get("time", []), r.get("value", [])) for r in reversed(results)]
+    times = np.concatenate([np.empty(0, dtype=np.int64)] + [t for t, _ in parsed])
+    values = np.concatenate([np.empty(0, dtype=np.float64)] + [v for _, v in parsed])
+    keep = (times >= start) & (times <= end)
+    return times[keep], values[keep]
+
+
+async def sync_series(
+    sensor_id: str,
+    field: str,
+    start: int,
+    now: Optional[int] = None,
+    max_staleness: int = MIN_TAIL_SECONDS,
+) -> None:
+    """
+    Make sure the store holds (sensor_id, field) from start up to now (which
+    may be the end of a past window, in which case no tail is fetched).
+
+    Only the edges missing from the stored coverage are requested: a backfill if
+    start is older than anything held, and the tail since the last fetch once
+    that is at least max_staleness seconds old. The coverage stays contiguous,
+    so a start far before it fetches the whole gap; a window apart from the
+    coverage is better read with fetch_window.
+
+    Chunks that fail don't discard the ones that arrived: those are stored and
+    the coverage advances as far as it is unbroken, then the first error is
+    raised so callers know the series is incomplete.
+    """
+    if now is None:
+        now = int(time.time())
+
+    # The store blocks on its lock, so it is kept off the upstream loop that
+    # every request, hedge timer and deadline shares
+    coverage = await asyncio.to_thread(store.get_coverage, sensor_id, field)
+    # (start, end, grows_forward): a tail grows the coverage forward from its
+    # start, a backfill (or a first fetch) grows it backward from its end
+    if coverage is None:
+        windows = [(start, now, False)]
+    else:
+        windows = []
+        if start < coverage[0]:
+            windows.append((start, coverage[0], False))
+        if now - coverage[1] >= max(max_staleness, MIN_TAIL_SECONDS):
+            windows.append((coverage[1] - TAIL_OVERLAP_SECONDS, now, True))
+    if not windows:
+        return
+
+    requests = [(w, chunk) for w in windows for chunk in _chunks(w[0], w[1])]
+    results = await asyncio.gather(
+        *(upstream.get_graph_data(sensor_id, field, hours, end_iso) for _, (end_iso, hours) in requests),
+        return_exceptions=True,
+    )
+
+    # Keep every chunk that arrived, but only count as covered the part of each
+    # window that is contiguous with the edge it grows from
+    times: List[int] = []
+    values: List[float] = []
+    covered = coverage
+    error: Optional[BaseException] = None
+    for window in windows:
+        w_start, w_end, forward = window
+        # _chunks runs newest first
+        chunks = [(chunk, r) for (w, chunk), r in zip(requests, results) if w == window]
+        if forward:
+            chunks.reverse()
+        reached = w_start if forward else w_end
+        contiguous = True
+        for (end_iso, hours), data in chunks:
+            if isinstance(data, BaseException):
+                error = error or data
+                contiguous = False
+                continue
+            t, v = parse_series(data)
+            times.extend(t)
+            values.extend(v)
+            if contiguous:
+                chunk_end = int(datetime.fromisoformat(end_iso.replace("Z", "+00:00")).timestamp())
+                reached = min(chunk_end, w_end) if forward else max(chunk_end - hours * 3600, w_start)
+        lo, hi = (w_start, reached) if forward else (reached, w_end)
+        if lo < hi:
+            covered = (lo, hi) if covered is None else (min(covered[0], lo), max(covered[1], hi))
+
+    if times or covered != coverage:
+        await asyncio.to_thread(store.append, sensor_id, field, times, values, *(covered or (None, None)))
+    if error is not None:
+        raise error
+
+
+def _read_recent(sensor_ids: List[str], start: int, end: int) -> Dict[str, Dict[str, Dict[str, list]]]:
+    return {
+        s: {f: dict(zip(("time", "value"), store.query(s, f, start, end))) for f in SENSOR_FIELDS}
+        for s in sensor_ids
+    }
+
+
+async def sync_readings(
+    sensor_ids: List[str],
+    fields: List[str],
+    start: int,
+    now: Optional[int] = None,
+    range_hours: int = 1,
+) -> Tuple[Dict[str, SensorReadings], int]:
+    """
+    Sync every sensor/field series concurrently, then read each sensor's last
+    range_hours of SENSOR_FIELDS back from the store, so a refresh requests
+    each window upstream once.
+
+    Returns (readings, failed). readings has fetch_sensor_readings' shape with
+    epoch-second times; a sensor whose SENSOR_FIELDS sync failed maps to the
+    exception instead. failed counts every series that failed, of any field.
+    """
+    if now is None:
+        now = int(time.time())
+    pairs = [(s, f) for s in sensor_ids for f in fields]
+    results = await asyncio.gather(
+        *(sync_series(s, f, start, now) for s, f in pairs),
+        return_exceptions=True,
+    )
+
+    errors: Dict[str, BaseException] = {}
+    for (sensor_id, field), result in zip(pairs, results):
+        if isinstance(result, Exception) and field in SENSOR_FIELDS:
+            errors.setdefault(sensor_id, result)
+    synced = [s for s in sensor_ids if s not in errors]
+    readings: Dict[str, SensorReadings] = dict(errors)
+    readings.update(await asyncio.to_thread(_read_recent, synced, now - range_hours * 3600, now))
+    return readings, sum(1 for r in results if isinstance(r, Exception))
@@ -0,0 +1,109 @@
+# ----------------------------------------
+# Per-endpoint Concurrency Limits
+# ----------------------------------------
+# Upstream-dependent endpoints each get a fixed number of in-flight requests.
+# Extra requests wait up to queue_timeout for a slot and are then turned away
+# with a 503 + Retry-After, so one slow endpoint can't pile up unbounded work
+# (or open upstream calls) while the snapshot endpoints keep answering.
+#
+# Use as a FastAPI dependency:
+#
+#     HOURLY_LIMIT = ConcurrencyLimit("hourly", 32)
+#
+#     @app.get("/api/hourly", dependencies=[Depends(HOURLY_LIMIT)])
+#
+# FastAPI finishes yield dependencies before a StreamingResponse body runs, so
+# streaming endpoints acquire() themselves and wrap the body in hold().
+
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List
+
+from fastapi import HTTPException
+
+import metrics
+
+
+# How long a request may wait for a slot before it gets a 503
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ENDPOINT_QUEUE_TIMEOUT", "10"))
+
+LIMITS: List["ConcurrencyLimit"] = []
+
+
+class ConcurrencyLimit:
+    def __init__(self, name: str, limit: int, queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        # ENDPOINT_CONCURRENCY_<NAME> overrides the default
+        self.limit = int(os.getenv(f"ENDPOINT_CONCURRENCY_{name.upper()}", limit))
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(self.limit)
+        LIMITS.append(self)
+
+    async def acquire(self) -> None:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            metrics.ENDPOINT_REJECTED.inc(self.name)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many concurrent {self.name} requests, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.inflight += 1
+        metrics.ENDPOINT_INFLIGHT.set(self.inflight, self.name)
+
+    def release(self) -> None:
+        self.inflight -= 1
+        metrics.ENDPOINT_INFLIGHT.set(self.inflight, self.name)
+        self._semaphore.release()
+
+    async def __call__(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self, body: AsyncIterator[bytes]) -> "_HeldBody":
+        """Stream `body`, releasing the slot (taken with acquire()) once it is done."""
+        return _HeldBody(self, body)
+
+
+class _HeldBody:
+    """
+    Releases its slot when the body finishes, fails or is closed, and also if it
+    is dropped without ever being iterated (client gone before the body began).
+    """
+
+    def __init__(self, limit: ConcurrencyLimit, body: AsyncIterator[bytes]):
+        self._limit = limit
+        self._body = body
+        self._released = False
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._body:
+                yield chunk
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limit.release()
+
+    def __del__(self):
+        self._release()
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return {
+        limit.name: {"inflight": limit.inflight, "limit": limit.limit, "rejected": limit.rejected}
+        for limit in LIMITS
+    }
@@ -0,0 +1,103 @@
+# ----------------------------------------
+# Structured Logging
+# ----------------------------------------
+# Leveled logging on top of the stdlib logging module. Each call takes an event
+# message plus keyword fields:
+#
+#   log.info("Data refreshed", sensors=120, seconds=3.2)
+#
+# LOG_FORMAT=json writes one JSON object per line; the default is plain text
+# with key=value fields. LOG_LEVEL sets the threshold.
+#
+# Loggers created with hot=True sit on per-request/per-sensor paths. They stay
+# off unless LOG_HOT_PATHS=1, and a disabled call returns before formatting.
+
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+
+ROOT_LOGGER = "clearairwave"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_HOT_PATHS = os.getenv("LOG_HOT_PATHS", "0") == "1"
+
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+def configure() -> None:
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root = logging.getLogger(ROOT_LOGGER)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    hot = logging.getLogger(f"{ROOT_LOGGER}.hot")
+    hot.setLevel(logging.DEBUG if LOG_HOT_PATHS else logging.CRITICAL + 1)
+    _configured = True
+
+
+class StructLogger:
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def enabled(self, level: int = logging.INFO) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name: str, hot: bool = False) -> StructLogger:
+    """Logger for a module; hot=True for per-request or per-item paths."""
+    configure()
+    prefix = f"{ROOT_LOGGER}.hot" if hot else ROOT_LOGGER
+    return StructLogger(logging.getLogger(f"{prefix}.{name}"))
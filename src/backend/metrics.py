@@ -0,0 +1,221 @@
+# ----------------------------------------
+# Prometheus Metrics
+# ----------------------------------------
+# A small in-process registry of counters, gauges and histograms, rendered in
+# the Prometheus text exposition format for scrapes of /metrics. Recording is
+# a dict lookup and a few additions under a lock, cheap enough for every
+# upstream call and request.
+#
+# RequestMetricsMiddleware times every HTTP request by route template (not raw
+# path, so query strings and ids don't create new series).
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}" for key, v in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = self._header()
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> bytes:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# ----------------------------------------
+# Metric Definitions
+# ----------------------------------------
+
+UPSTREAM_LATENCY = Histogram(
+    "simpleaq_request_duration_seconds", "SimpleAQ API call latency", ("endpoint", "field"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "simpleaq_requests_total", "SimpleAQ API calls by outcome", ("endpoint", "field", "outcome"),
+)
+UPSTREAM_BREAKER_STATE = Gauge(
+    "simpleaq_circuit_state", "Upstream circuit breaker: 0 closed, 1 half-open, 2 open",
+)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until response headers, by route", ("method", "route", "status"),
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size (when known up front), by route", ("route",),
+    buckets=SIZE_BUCKETS,
+)
+
+ENDPOINT_INFLIGHT = Gauge("endpoint_inflight_requests", "Requests holding a concurrency slot, by endpoint", ("endpoint",))
+ENDPOINT_REJECTED = Counter(
+    "endpoint_rejected_total", "Requests turned away with a 503 after waiting for a slot", ("endpoint",),
+)
+
+REFRESH_DURATION = Histogram("refresh_duration_seconds", "Refresh wall time, by region", ("region",))
+REFRESH_FAILURES = Counter(
+    "refresh_failures_total", "Refreshes that failed and kept the previous snapshot, by region", ("region",),
+)
+REFRESH_SENSORS = Gauge("refresh_sensors", "Sensors in the last published snapshot, by region", ("region",))
+REFRESH_LAST_SUCCESS = Gauge(
+    "refresh_last_success_timestamp_seconds", "Unix time of the last successful refresh, by region", ("region",),
+)
+
+AGGREGATION_DURATION = Histogram(
+    "aggregation_duration_seconds", "Time spent in aggregation stages", ("stage",),
+)
+SNAPSHOT_PAYLOAD_SIZE = Gauge(
+    "snapshot_payload_bytes", "Size of the pre-encoded snapshot payloads", ("region", "payload", "encoding"),
+)
+
+
+# ----------------------------------------
+# Request Timing Middleware
+# ----------------------------------------
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware recording HTTP_LATENCY / HTTP_RESPONSE_SIZE per route."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            app = scope.get("app")
+            for r in getattr(app, "routes", ()):
+                if getattr(r, "endpoint", None) is endpoint:
+                    route = r.path
+                    break
+            route = self._routes[endpoint] = route or "unmatched"
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                route = self._route(scope)
+                HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], route, str(message["status"]))
+                for name, value in message.get("headers", ()):
+                    if name == b"content-length":
+                        HTTP_RESPONSE_SIZE.observe(int(value), route)
+                        break
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
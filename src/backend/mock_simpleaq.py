@@ -0,0 +1,203 @@
+# ----------------------------------------
+# Local SimpleAQ Stand-in
+# ----------------------------------------
+# Serves getdata, getgraphdata and getmostrecentdevicepoint with synthetic,
+# deterministic data so refreshes and endpoints can be exercised (and
+# benchmarked) without touching simpleaq.org. Point the backend at it with
+# SIMPLEAQ_API_URL=http://127.0.0.1:<port>/api.
+#
+#   python mock_simpleaq.py --sensors 200 --interval 120 --latency 50 --error-rate 0.01
+#
+# Sensors sit at fixed pseudo-random spots inside the configured regions (see
+# regions.py), spread evenly over them, and getdata only lists the ones inside
+# the bounding box it is asked for. Each reports one point every --interval seconds; a --offline share
+# of them has no points at all and a --stale share stopped reporting hours ago.
+
+import argparse
+import asyncio
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException, Query
+
+import regions
+
+
+# (base, amplitude) of the synthetic daily cycle per field
+FIELD_PROFILES: Dict[str, Tuple[float, float]] = {
+    "pm2.5_ug_m3": (18.0, 12.0),
+    "pm10.0_ug_m3": (28.0, 15.0),
+    "pm4.0_ug_m3": (22.0, 13.0),
+    "pm1.0_ug_m3": (12.0, 8.0),
+    "temperature_C": (18.0, 8.0),
+    "humidity_percent": (55.0, 20.0),
+    "pressure_hPa": (1005.0, 8.0),
+    "NO2_concentration_ppm": (0.03, 0.02),
+    "O3_concentration_ppm": (0.04, 0.02),
+    "SO2_concentration_ppm": (0.01, 0.008),
+}
+DEFAULT_PROFILE = (10.0, 5.0)
+# How long ago --stale sensors stopped reporting
+STALE_FOR_SECONDS = 6 * 3600
+
+
+@dataclass
+class MockConfig:
+    sensors: int = 50
+    # seconds between a sensor's points
+    interval: int = 120
+    # mean / standard deviation of the added response delay, in ms
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # share of getgraphdata/getmostrecentdevicepoint calls that fail with a 500
+    error_rate: float = 0.0
+    offline: float = 0.0
+    stale: float = 0.0
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        return cls(
+            sensors=int(os.getenv("MOCK_SENSORS", cls.sensors)),
+            interval=int(os.getenv("MOCK_INTERVAL", cls.interval)),
+            latency_ms=float(os.getenv("MOCK_LATENCY_MS", cls.latency_ms)),
+            jitter_ms=float(os.getenv("MOCK_JITTER_MS", cls.jitter_ms)),
+            error_rate=float(os.getenv("MOCK_ERROR_RATE", cls.error_rate)),
+            offline=float(os.getenv("MOCK_OFFLINE", cls.offline)),
+            stale=float(os.getenv("MOCK_STALE", cls.stale)),
+            seed=int(os.getenv("MOCK_SEED", cls.seed)),
+        )
+
+
+def _parse_time(value: str) -> int:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _iso(ts: np.ndarray) -> list:
+    return np.datetime_as_string(ts.astype("datetime64[s]"), unit="ms").astype(object) + "Z"
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+    rng = np.random.default_rng(config.seed)
+    boxes = np.array([regions.REGIONS[i % len(regions.REGIONS)].bbox for i in range(config.sensors)]).reshape(-1, 4)
+    ids = [f"mock{i:05d}" for i in range(config.sensors)]
+    lats = rng.uniform(boxes[:, 0], boxes[:, 1], config.sensors)
+    lngs = rng.uniform(boxes[:, 2], boxes[:, 3], config.sensors)
+    phases = rng.uniform(0, 2 * np.pi, config.sensors)
+    status = rng.choice(
+        ["online", "offline", "stale"], size=config.sensors,
+        p=[max(1 - config.offline - config.stale, 0), config.offline, config.stale],
+    )
+    sensors = {
+        sensor_id: {"row": i, "status": status[i]} for i, sensor_id in enumerate(ids)
+    }
+    calls = {"getdata": 0, "getgraphdata": 0, "getmostrecentdevicepoint": 0, "errors": 0}
+    errors = random.Random(config.seed)
+
+    def values(row: int, field: str, ts: np.ndarray) -> np.ndarray:
+        base, amplitude = FIELD_PROFILES.get(field, DEFAULT_PROFILE)
+        day = 2 * np.pi * (ts % 86400) / 86400
+        # cheap deterministic noise so repeated calls return the same series
+        noise = np.sin(ts * 12.9898 + row * 78.233) * 0.1 * amplitude
+        return np.round(base + amplitude * np.sin(day + phases[row]) + noise, 4)
+
+    def latest_point(sensor_id: str, now: int) -> Optional[int]:
+        sensor = sensors.get(sensor_id)
+        if sensor is None or sensor["status"] == "offline":
+            return None
+        if sensor["status"] == "stale":
+            now -= STALE_FOR_SECONDS
+        return now - now % config.interval
+
+    async def simulate(endpoint: str, can_fail: bool = True) -> None:
+        calls[endpoint] += 1
+        if config.latency_ms or config.jitter_ms:
+            await asyncio.sleep(max(errors.gauss(config.latency_ms, config.jitter_ms), 0) / 1000)
+        if can_fail and config.error_rate and errors.random() < config.error_rate:
+            calls["errors"] += 1
+            raise HTTPException(status_code=500, detail="injected error")
+
+    @app.get("/api/getdata")
+    async def getdata(
+        field: str = "pm2.5",
+        min_lat: float = -90.0, max_lat: float = 90.0, min_lon: float = -180.0, max_lon: float = 180.0,
+    ):
+        await simulate("getdata", can_fail=False)
+        now = int(datetime.now(timezone.utc).timestamp())
+        out = {}
+        for sensor_id, sensor in sensors.items():
+            row = sensor["row"]
+            if not (min_lat <= lats[row] <= max_lat and min_lon <= lngs[row] <= max_lon):
+                continue
+            latest = latest_point(sensor_id, now)
+            value = values(row, "pm2.5_ug_m3", np.array([latest if latest is not None else now]))[0]
+            out[sensor_id] = {
+                "name": f"Mock Sensor {row}",
+                "latitude": float(lats[row]),
+                "longitude": float(lngs[row]),
+                "value": float(value),
+            }
+        return out
+
+    @app.get("/api/getgraphdata")
+    async def getgraphdata(id: str, field: str, rangehours: int = Query(1), time: str = Query(...)):
+        await simulate("getgraphdata")
+        end = _parse_time(time)
+        latest = latest_point(id, end)
+        if latest is None:
+            return {"sensor": id, "time": [], "value": []}
+        start = end - rangehours * 3600
+        first = start - start % config.interval + config.interval
+        ts = np.arange(first, latest + 1, config.interval, dtype=np.int64)
+        vals = values(sensors[id]["row"], field, ts)
+        return {"sensor": id, "time": _iso(ts).tolist(), "value": vals.astype(str).tolist()}
+
+    @app.get("/api/getmostrecentdevicepoint")
+    async def getmostrecentdevicepoint(id: str):
+        await simulate("getmostrecentdevicepoint")
+        latest = latest_point(id, int(datetime.now(timezone.utc).timestamp()))
+        if latest is None:
+            return {"found": False}
+        ts = datetime.fromtimestamp(latest, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return {"found": True, "timestamp": ts}
+
+    @app.get("/stats")
+    async def stats():
+        return calls
+
+    return app
+
+
+def parse_args(argv=None) -> Tuple[MockConfig, argparse.Namespace]:
+    defaults = MockConfig.from_env()
+    parser = argparse.ArgumentParser(description="Local SimpleAQ stand-in with synthetic data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sensors", type=int, default=defaults.sensors)
+    parser.add_argument("--interval", type=int, default=defaults.interval, help="seconds between points")
+    parser.add_argument("--latency", type=float, default=defaults.latency_ms, help="mean added latency (ms)")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter_ms, help="latency std deviation (ms)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--offline", type=float, default=defaults.offline, help="share of sensors with no data")
+    parser.add_argument("--stale", type=float, default=defaults.stale, help="share of sensors that stopped reporting")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+    config = MockConfig(
+        sensors=args.sensors, interval=args.interval, latency_ms=args.latency, jitter_ms=args.jitter,
+        error_rate=args.error_rate, offline=args.offline, stale=args.stale, seed=args.seed,
+    )
+    return config, args
+
+
+if __name__ == "__main__":
+    config, args = parse_args()
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,121 @@
+# ----------------------------------------
+# Adaptive Sensor Polling
+# ----------------------------------------
+# Before a refresh downloads graph data it asks getmostrecentdevicepoint (one
+# tiny request per sensor) whether anything new arrived. Only sensors with new
+# points get their series fetched; the rest keep their previous readings.
+#
+# Sensors that report nothing new, are offline, or whose latest point is old
+# are checked less and less often (doubling up to MAX_POLL_SECONDS), and drop
+# back to every refresh as soon as a new point shows up. Upstream traffic per
+# cycle therefore follows the number of active sensors, not all sensors. A
+# check that fails (upstream down, circuit open) says nothing about the sensor,
+# so it keeps its interval and is checked again next refresh.
+
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set
+
+import upstream
+
+
+MAX_POLL_SECONDS = int(os.getenv("MAX_POLL_SECONDS", str(6 * 3600)))
+# A sensor whose newest point is older than this is treated as stale
+STALE_AFTER_SECONDS = int(os.getenv("STALE_AFTER_SECONDS", "3600"))
+
+
+@dataclass
+class SensorPollState:
+    # newest point SimpleAQ reported, and newest one we've fetched data for
+    latest: Optional[int] = None
+    fetched: Optional[int] = None
+    interval: float = 0.0
+    next_check: float = 0.0
+    offline: bool = False
+
+
+class PollScheduler:
+    def __init__(self, base_seconds: float, max_seconds: float = MAX_POLL_SECONDS,
+                 stale_after: float = STALE_AFTER_SECONDS):
+        self.base_seconds = base_seconds
+        self.max_seconds = max(max_seconds, base_seconds)
+        self.stale_after = stale_after
+        self._states: Dict[str, SensorPollState] = {}
+        self._lock = threading.Lock()
+        self._last_checked = 0
+        self._last_active = 0
+
+    def _state(self, sensor_id: str) -> SensorPollState:
+        state = self._states.get(sensor_id)
+        if state is None:
+            state = self._states[sensor_id] = SensorPollState(interval=self.base_seconds)
+        return state
+
+    def _schedule(self, state: SensorPollState, now: float, active: bool) -> None:
+        state.interval = self.base_seconds if active else min(state.interval * 2, self.max_seconds)
+        # A little slack so a sensor due "next refresh" isn't missed by jitter
+        state.next_check = now + state.interval - 0.1 * self.base_seconds
+
+    def _retry(self, state: SensorPollState, now: float) -> None:
+        state.next_check = now + 0.9 * self.base_seconds
+
+    async def plan(self, sensor_ids: Iterable[str], now: Optional[float] = None) -> Set[str]:
+        """
+        Check the latest point of every sensor that is due and return the ids
+        that have points newer than what was last fetched for them.
+        """
+        now = time.time() if now is None else now
+        sensor_ids = list(sensor_ids)
+        with self._lock:
+            # Forget sensors SimpleAQ no longer lists
+            for sensor_id in set(self._states) - set(sensor_ids):
+                del self._states[sensor_id]
+            due = [s for s in sensor_ids if self._state(s).next_check <= now]
+
+        # no stale fallback: an old answer would look like an idle sensor
+        results = await asyncio.gather(
+            *(upstream.get_latest_point(s, stale=False) for s in due), return_exceptions=True
+        )
+
+        active = set()
+        with self._lock:
+            for sensor_id, latest in zip(due, results):
+                state = self._state(sensor_id)
+                if isinstance(latest, Exception):
+                    self._retry(state, now)
+                    continue
+                if latest is None:
+                    state.offline = True
+                    self._schedule(state, now, active=False)
+                    continue
+                state.offline = False
+                state.latest = latest
+                has_new = state.fetched is None or latest > state.fetched
+                if has_new:
+                    active.add(sensor_id)
+                # Stale sensors get one fetch for their new point, then back off
+                self._schedule(state, now, active=has_new and now - latest <= self.stale_after)
+            self._last_checked = len(due)
+            self._last_active = len(active)
+        return active
+
+    def mark_fetched(self, sensor_ids: Iterable[str]) -> None:
+        """Record that data up to each sensor's latest point has been fetched."""
+        with self._lock:
+            for sensor_id in sensor_ids:
+                state = self._states.get(sensor_id)
+                if state is not None and state.latest is not None:
+                    state.fetched = state.latest
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "tracked": len(self._states),
+                "backedOff": sum(s.interval > self.base_seconds for s in self._states.values()),
+                "offline": sum(s.offline for s in self._states.values()),
+                "lastChecked": self._last_checked,
+                "lastActive": self._last_active,
+            }
@@ -0,0 +1,227 @@
+# ----------------------------------------
+# Request Profiling
+# ----------------------------------------
+# Opt-in capture of where a request's time went. ProfilingMiddleware picks
+# requests two ways:
+#
+# - PROFILE_SAMPLE_RATE: this fraction of requests is captured up front
+# - PROFILE_SLOW_MS: any request slower than this is kept after the fact
+#
+# While a request is being captured, code wrapped in phase("upstream"),
+# phase("store"), phase("parse"), phase("aggregation") or
+# phase("serialization") adds its time to the request's breakdown. Phases are
+# summed per name; concurrent work (e.g. gathered upstream calls) can make a
+# phase add up to more than the request's wall time. Outside a capture a phase
+# costs one context variable lookup.
+#
+# With PROFILE_CPROFILE=1 sampled requests also carry a cProfile dump. cProfile
+# hooks the whole event loop thread, so it runs for one request at a time and
+# its numbers include whatever else the loop did meanwhile. Slow-only captures
+# have no dump since nothing was profiling when they started.
+#
+# A streamed response (SSE, exports) is captured only up to its first body
+# chunk. Profiling the rest would keep cProfile on the loop, and the slow
+# threshold on, for as long as the client stays connected.
+#
+# Captures go into a ring buffer of the last PROFILE_BUFFER_SIZE, served at
+# /api/debug/profiles.
+
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "0") == "1"
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "100"))
+# Lines of the cProfile dump kept per capture (sorted by cumulative time)
+PROFILE_DUMP_LINES = 40
+# If set, /api/debug/profiles wants it in the X-Debug-Token header
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+
+class Capture:
+    def __init__(self, method: str, path: str, query: str, sampled: bool):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.sampled = sampled
+        self.started = time.time()
+        self.status: Optional[int] = None
+        # name -> [seconds, calls]; phases may be recorded from the upstream loop thread
+        self.phases: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+
+_capture: contextvars.ContextVar[Optional[Capture]] = contextvars.ContextVar("profile_capture", default=None)
+# Phase names already open in this task, so nested calls aren't counted twice
+_open: contextvars.ContextVar[Tuple[str, ...]] = contextvars.ContextVar("profile_phases", default=())
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    capture = _capture.get()
+    if capture is None or name in _open.get():
+        yield
+        return
+    token = _open.set(_open.get() + (name,))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        capture.add(name, time.perf_counter() - start)
+        _open.reset(token)
+
+
+def timed(name: str) -> Callable:
+    """Decorator form of phase() for plain functions."""
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _capture.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose encoding counts as the "serialization" phase."""
+
+    def render(self, content: Any) -> bytes:
+        with phase("serialization"):
+            return super().render(content)
+
+
+# ----------------------------------------
+# Ring Buffer
+# ----------------------------------------
+
+_captures: Deque[Dict[str, Any]] = deque(maxlen=PROFILE_BUFFER_SIZE)
+_ids = itertools.count(1)
+_captures_lock = threading.Lock()
+
+
+def _record(capture: Capture, wall: float, dump: Optional[str]) -> None:
+    entry = {
+        "id": next(_ids),
+        "at": datetime.fromtimestamp(capture.started, timezone.utc).isoformat(),
+        "method": capture.method,
+        "path": capture.path,
+        "query": capture.query,
+        "status": capture.status,
+        "reason": "sampled" if capture.sampled else "slow",
+        "wallMs": round(wall * 1000, 3),
+        "phases": {
+            name: {"ms": round(seconds * 1000, 3), "calls": calls}
+            for name, (seconds, calls) in sorted(capture.phases.items(), key=lambda p: -p[1][0])
+        },
+        "profile": dump,
+    }
+    with _captures_lock:
+        _captures.append(entry)
+
+
+def captures(limit: int = PROFILE_BUFFER_SIZE, path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Newest first, optionally only requests whose path starts with `path`."""
+    with _captures_lock:
+        entries = list(_captures)
+    entries.reverse()
+    if path:
+        entries = [e for e in entries if e["path"].startswith(path)]
+    return entries[:limit]
+
+
+def clear() -> None:
+    with _captures_lock:
+        _captures.clear()
+
+
+# ----------------------------------------
+# Middleware
+# ----------------------------------------
+
+_profiler_lock = threading.Lock()
+
+
+def _dump(profiler: cProfile.Profile) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(PROFILE_DUMP_LINES)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware; a straight pass-through unless profiling is configured."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http" or scope["path"].startswith("/api/debug/"):
+            await self.app(scope, receive, send)
+            return
+        sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not sampled and PROFILE_SLOW_MS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), sampled)
+        token = _capture.set(capture)
+        profiler = None
+        if sampled and PROFILE_CPROFILE and _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        finished = False
+
+        def finish() -> None:
+            nonlocal finished, profiler
+            if finished:
+                return
+            finished = True
+            wall = time.perf_counter() - start
+            dump = None
+            if profiler is not None:
+                profiler.disable()
+                dump = _dump(profiler)
+                profiler = None
+                _profiler_lock.release()
+            if capture.sampled or wall * 1000 >= PROFILE_SLOW_MS:
+                _record(capture, wall, dump)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body":
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _capture.reset(token)
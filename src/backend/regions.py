@@ -0,0 +1,94 @@
+# ----------------------------------------
+# Configured Regions
+# ----------------------------------------
+# Each region is one bounding box crawled from SimpleAQ /getdata, with its own
+# snapshot, statistics and refresh interval. Without REGIONS_FILE the server
+# runs the single Columbus region it always has. Otherwise REGIONS_FILE points
+# at a JSON list, the first entry being the default region:
+#
+#     [
+#         {"name": "columbus", "bbox": [39.94, 40.28, -82.78, -82.20]},
+#         {"name": "cleveland", "bbox": [41.35, 41.60, -81.88, -81.53], "refresh_minutes": 15}
+#     ]
+#
+# bbox is (min_lat, max_lat, min_lon, max_lon). Names end up in query strings
+# and file names, so they are limited to lowercase letters, digits, - and _.
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from spatial import REGION_BBOX
+
+
+REGIONS_FILE = os.getenv("REGIONS_FILE")
+DEFAULT_REFRESH_MINUTES = 10
+
+_NAME = re.compile(r"^[a-z0-9_-]+$")
+
+
+@dataclass(frozen=True)
+class Region:
+    name: str
+    bbox: Tuple[float, float, float, float]
+    refresh_minutes: int = DEFAULT_REFRESH_MINUTES
+
+    @property
+    def ref_lat(self) -> float:
+        """Latitude distances in the region are projected around."""
+        return (self.bbox[0] + self.bbox[1]) / 2
+
+    @property
+    def query(self) -> Dict[str, float]:
+        """getdata bounding-box parameters."""
+        min_lat, max_lat, min_lon, max_lon = self.bbox
+        return {"min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon}
+
+
+def _parse(entries: List[dict]) -> List[Region]:
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{REGIONS_FILE}: expected a non-empty list of regions")
+    regions: List[Region] = []
+    for entry in entries:
+        name = entry.get("name")
+        if not isinstance(name, str) or not _NAME.match(name):
+            raise ValueError(f"{REGIONS_FILE}: invalid region name {name!r}")
+        if any(r.name == name for r in regions):
+            raise ValueError(f"{REGIONS_FILE}: duplicate region {name!r}")
+        bbox = tuple(float(v) for v in entry.get("bbox", ()))
+        if len(bbox) != 4 or bbox[0] >= bbox[1] or bbox[2] >= bbox[3]:
+            raise ValueError(f"{REGIONS_FILE}: region {name!r} needs bbox [min_lat, max_lat, min_lon, max_lon]")
+        refresh_minutes = int(entry.get("refresh_minutes", DEFAULT_REFRESH_MINUTES))
+        if refresh_minutes < 1:
+            raise ValueError(f"{REGIONS_FILE}: region {name!r} refresh_minutes must be at least 1")
+        regions.append(Region(name=name, bbox=bbox, refresh_minutes=refresh_minutes))
+    return regions
+
+
+def _load() -> List[Region]:
+    if not REGIONS_FILE:
+        return [Region(name="columbus", bbox=REGION_BBOX)]
+    with open(REGIONS_FILE) as f:
+        return _parse(json.load(f))
+
+
+REGIONS: List[Region] = _load()
+BY_NAME: Dict[str, Region] = {r.name: r for r in REGIONS}
+DEFAULT_REGION = REGIONS[0].name
+
+
+def get(name: str) -> Region:
+    return BY_NAME[name]
+
+
+def path_for(path: str, name: str) -> str:
+    """
+    Per-region variant of a state file path: "snapshot.json" becomes
+    "snapshot.<name>.json". Single-region deployments keep the plain path.
+    """
+    if len(REGIONS) == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
@@ -0,0 +1,163 @@
+# ----------------------------------------
+# Columnar Sensor Table
+# ----------------------------------------
+# The current sensors as a struct of arrays: one NumPy column per reading plus
+# tuples for the string/datetime fields. Statistics and change detection run
+# as vectorized passes over the columns, and the JSON shape of the Sensor model
+# is only produced at the API edge by records().
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from aqi import UNKNOWN_CATEGORY
+
+
+# Columns compared to decide whether a sensor's readings changed
+READING_COLUMNS = ("lat", "lng", "pm25", "temperature", "humidity", "pressure")
+
+STAT_PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+
+def _column(values: Sequence[float], dtype=np.float64) -> np.ndarray:
+    arr = np.asarray(values, dtype=dtype)
+    arr.flags.writeable = False
+    return arr
+
+
+@dataclass(frozen=True)
+class SensorTable:
+    ids: Tuple[str, ...] = ()
+    names: Tuple[str, ...] = ()
+    last_updated: Tuple[datetime, ...] = ()
+    lat: np.ndarray = field(default_factory=lambda: _column([]))
+    lng: np.ndarray = field(default_factory=lambda: _column([]))
+    pm25: np.ndarray = field(default_factory=lambda: _column([]))
+    temperature: np.ndarray = field(default_factory=lambda: _column([]))
+    humidity: np.ndarray = field(default_factory=lambda: _column([]))
+    pressure: np.ndarray = field(default_factory=lambda: _column([]))
+    # NaN where a sensor has no AQI
+    aqi: np.ndarray = field(default_factory=lambda: _column([]))
+    # index into `categories`, UNKNOWN_CATEGORY if none
+    category: np.ndarray = field(default_factory=lambda: _column([], np.int8))
+    # (category name, color) for each category code
+    categories: Tuple[Tuple[str, str], ...] = ()
+    index: Dict[str, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "index", {sensor_id: i for i, sensor_id in enumerate(self.ids)})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List[Any]], categories: Sequence[Tuple[str, str]]) -> "SensorTable":
+        aqi = np.asarray(columns["aqi"], dtype=np.float64)
+        return cls(
+            ids=tuple(columns["ids"]),
+            names=tuple(columns["names"]),
+            last_updated=tuple(columns["last_updated"]),
+            lat=_column(columns["lat"]),
+            lng=_column(columns["lng"]),
+            pm25=_column(columns["pm25"]),
+            temperature=_column(columns["temperature"]),
+            humidity=_column(columns["humidity"]),
+            pressure=_column(columns["pressure"]),
+            aqi=_column(aqi),
+            category=_column(columns["category"], np.int8),
+            categories=tuple(categories),
+        )
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], categories: Sequence[Tuple[str, str]]) -> "SensorTable":
+        """Rebuild a table from records() output (e.g. a persisted snapshot)."""
+        codes = {name: i for i, (name, _) in enumerate(categories)}
+        columns: Dict[str, List[Any]] = {k: [] for k in (
+            "ids", "names", "last_updated", "lat", "lng", "pm25", "temperature",
+            "humidity", "pressure", "aqi", "category",
+        )}
+        for r in records:
+            columns["ids"].append(r["id"])
+            columns["names"].append(r["name"])
+            columns["last_updated"].append(datetime.fromisoformat(r["lastUpdated"]))
+            columns["lat"].append(r["location"]["lat"])
+            columns["lng"].append(r["location"]["lng"])
+            columns["pm25"].append(r["pm25"])
+            columns["temperature"].append(r["temperature"])
+            columns["humidity"].append(r["humidity"])
+            columns["pressure"].append(r["pressure"])
+            columns["aqi"].append(r.get("aqi"))
+            category = r.get("aqiCategory")
+            columns["category"].append(codes.get(category["category"], UNKNOWN_CATEGORY) if category else UNKNOWN_CATEGORY)
+        return cls.from_columns(columns, categories)
+
+    def records(self, rows: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        """Rows in the Sensor model's JSON shape (all rows, or just `rows`)."""
+        idx = np.arange(len(self)) if rows is None else np.asarray(list(rows), dtype=np.int64)
+        lat, lng = self.lat[idx].tolist(), self.lng[idx].tolist()
+        pm25, temperature = self.pm25[idx].tolist(), self.temperature[idx].tolist()
+        humidity, pressure = self.humidity[idx].tolist(), self.pressure[idx].tolist()
+        aqi, category = self.aqi[idx].tolist(), self.category[idx].tolist()
+        out = []
+        for j, i in enumerate(idx.tolist()):
+            code = category[j]
+            out.append({
+                "id": self.ids[i],
+                "name": self.names[i],
+                "location": {"lat": lat[j], "lng": lng[j]},
+                "pm25": pm25[j],
+                "temperature": temperature[j],
+                "humidity": humidity[j],
+                "lastUpdated": self.last_updated[i].isoformat(),
+                "pressure": pressure[j],
+                "aqi": None if aqi[j] != aqi[j] else aqi[j],
+                "aqiCategory": None if code == UNKNOWN_CATEGORY else {
+                    "category": self.categories[code][0],
+                    "color": self.categories[code][1],
+                },
+            })
+        return out
+
+    def changed_since(self, previous: "SensorTable") -> np.ndarray:
+        """Boolean mask of rows that are new or whose readings differ from `previous`."""
+        prev_idx = np.fromiter((previous.index.get(s, -1) for s in self.ids), dtype=np.int64, count=len(self))
+        present = prev_idx >= 0
+        changed = ~present
+        safe_idx = np.where(present, prev_idx, 0)
+        if len(previous):
+            for name in READING_COLUMNS:
+                ours, theirs = getattr(self, name), getattr(previous, name)[safe_idx]
+                changed |= present & (ours != theirs)
+            names_differ = [self.names[i] != previous.names[j] for i, j in enumerate(safe_idx.tolist())]
+            changed |= present & np.asarray(names_differ, dtype=bool)
+        return changed
+
+
+def compute_statistics(table: SensorTable) -> Dict[str, Any]:
+    """PM2.5 summary, percentiles, category distribution and per-category means."""
+    if len(table) == 0:
+        return {}
+    pm25 = table.pm25
+    codes = table.category.astype(np.int64)
+    n_categories = len(table.categories)
+
+    # Unknown category (-1) is counted in an extra trailing slot
+    slots = np.where(codes == UNKNOWN_CATEGORY, n_categories, codes)
+    counts = np.bincount(slots, minlength=n_categories + 1)
+    sums = np.bincount(slots, weights=pm25, minlength=n_categories + 1)
+    labels = [name for name, _ in table.categories] + ["Unknown"]
+
+    distribution = {labels[i]: int(counts[i]) for i in range(n_categories + 1) if counts[i]}
+    category_means = {labels[i]: float(sums[i] / counts[i]) for i in range(n_categories + 1) if counts[i]}
+    percentiles = np.percentile(pm25, STAT_PERCENTILES)
+
+    return {
+        "averagePM25": float(pm25.mean()),
+        "maxPM25": float(pm25.max()),
+        "minPM25": float(pm25.min()),
+        "aqiDistribution": distribution,
+        "percentilesPM25": {f"p{p}": float(v) for p, v in zip(STAT_PERCENTILES, percentiles)},
+        "categoryMeanPM25": category_means,
+    }
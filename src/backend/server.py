@@ -1,62 +1,79 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta, date
 import random
 import math
 import time
+import numpy as np
 import asyncio
 from pydantic import BaseModel
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from datetime import datetime, timezone
-from fastapi import Query
-from collections import defaultdict
+from fastapi import Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 import uvicorn
 
-from tenacity import (
-    retry,
-    stop_after_delay,
-    wait_exponential,
-    retry_if_exception_type,
-    stop_after_attempt,
-)
-
 #Loading Env Variables
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-todaysPoints = {"count": 0, "date": date.today()} #Gloval Variable
+import upstream
+import ingest
+import store
+import aggregation
+from cache import TTLCache
+import snapshot
+from snapshot import Snapshot
+from sensor_table import SensorTable, compute_statistics
+import aqi
+from aqi import AQI_CATEGORIES
+import encoding
+import export
+from broadcast import Broadcaster
+from alerts import AlertPipeline
+from polling import PollScheduler
+from cluster import Cluster
+import limits
+from limits import ConcurrencyLimit
+import profiling
+import regions
+from regions import Region
+import logs
+import metrics
+
+log = logs.get_logger("server")
+# Per-request logging, off unless LOG_HOT_PATHS=1
+request_log = logs.get_logger("server", hot=True)
 
 # ----------------------------------------
 #Firebase Integration for Real Time Notifications
 # ----------------------------------------
-import firebase_admin
-from firebase_admin import credentials, firestore
+# Initialized on first use so startup doesn't wait on it
+
+_db = None
+
+def get_db():
+    global _db
+    if _db is None:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
 
-cred = credentials.Certificate("firebase-credentials-new.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+        cred = credentials.Certificate("firebase-credentials-new.json")
+        firebase_admin.initialize_app(cred)
+        _db = firestore.client()
+    return _db
 
 def get_subscriber_emails():
-    emails_ref = db.collection("emails")
+    emails_ref = get_db().collection("emails")
     docs = emails_ref.stream()
     return [doc.to_dict().get("email") for doc in docs]
 
-###
-def load_prev_safe_ids():
-    try:
-        with open("prev_safe_ids.txt", "r") as f:
-            return set(f.read().splitlines())
-    except:
-        return set()
-
-def save_prev_safe_ids(ids: set):
-    with open("prev_safe_ids.txt", "w") as f:
-        f.write("\n".join(ids))
-
-#previously_safe_ids = load_prev_safe_ids() #Global Variable for trigger logic
+# Unhealthy-air alerts are detected after each refresh and delivered to
+# Pipedream from a durable outbox by a background worker (see alerts.py)
+ALERTS = AlertPipeline()
 
 # ----------------------------------------
 # AQI Utility Functions (from aqiUtils.ts)
@@ -64,16 +81,6 @@ def save_prev_safe_ids(ids: set):
 # ----------------------------------------
 
 
-AQI_BREAKPOINTS = [
-    {"min": 0, "max": 12, "category": "Good", "color": "#4ade80"},
-    {"min": 12.1, "max": 35.4, "category": "Moderate", "color": "#facc15"},
-    {"min": 35.5, "max": 55.4, "category": "Unhealthy for Sensitive Groups", "color": "#fb923c"},
-    {"min": 55.5, "max": 150.4, "category": "Unhealthy", "color": "#f87171"},
-    {"min": 150.5, "max": 250.4, "category": "Very Unhealthy", "color": "#c084fc"},
-    {"min": 250.5, "max": 500, "category": "Hazardous", "color": "#ef4444"}
-]
-
-
 DATA_VAL_DICT = {
     "pm2.5": "pm2.5_ug_m3",
     "pm10": "pm10.0_ug_m3",
@@ -91,40 +98,13 @@ DATA_VAL_DICT = {
 INVERSE_DATA_VAL_DICT = {v: k for k, v in DATA_VAL_DICT.items()}
 
 
-
-
-# Adjust these retry parameters as you like
-@retry(
-    stop=stop_after_attempt(1),              # give up after 30s
-    wait=wait_exponential(multiplier=1, min=1, max=10),
-    retry=(
-        retry_if_exception_type(httpx.RequestError) |
-        retry_if_exception_type(httpx.HTTPStatusError)
-    ),
-)
-
-
-
-
 def calculate_aqi(pm25: float) -> int:
-    if pm25 < 0:
-        return 0
-    for i, bp in enumerate(AQI_BREAKPOINTS):
-        if pm25 <= bp["max"]:
-            lower_aqi = 0 if i == 0 else i * 50
-            upper_aqi = lower_aqi + 50
-            lower_conc = bp["min"]
-            upper_conc = bp["max"]
-            aqi = ((upper_aqi - lower_aqi) / (upper_conc - lower_conc)) * (pm25 - lower_conc) + lower_aqi
-            return round(aqi)
-    return 500
+    return int(aqi.aqi_array(pm25))
 
 
 def get_aqi_category(pm25: float) -> dict:
-    for bp in AQI_BREAKPOINTS:
-        if pm25 <= bp["max"]:
-            return {"category": bp["category"], "color": bp["color"]}
-    return {"category": "Hazardous", "color": "#ef4444"}
+    category, color = AQI_CATEGORIES[int(aqi.category_codes(pm25))]
+    return {"category": category, "color": color}
 
 
 def get_health_recommendations(category: str) -> str:
@@ -154,16 +134,12 @@ def format_pm25(pm25: float) -> str:
 
 
 def fetch_latest_utc_epoch(sensor_id: str) -> int:
-    url = f"https://www.simpleaq.org/api/getmostrecentdevicepoint?id={sensor_id}"
     try:
-        response = httpx.get(url, timeout=5.0)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("found"):
-            dt = datetime.fromisoformat(data["timestamp"].replace("Z", "+00:00"))
-            return int(dt.timestamp() * 1000)
+        latest = upstream.run(upstream.get_latest_point(sensor_id))
+        if latest is not None:
+            return latest * 1000
     except Exception as e:
-        print("Error fetching latest UTC epoch:", e)
+        log.error("Error fetching latest UTC epoch", sensor_id=sensor_id, error=repr(e))
     return int(datetime.now(timezone.utc).timestamp() * 1000)
 
 
@@ -202,11 +178,13 @@ class Sensor(BaseModel):
 class HistoricalDataPoint(BaseModel):
     timestamp: datetime
     metric: Optional[float] = None
+    aqi: Optional[int] = None
 
 
 class HourlyDataPoint(BaseModel):
     time: datetime
     metric: Optional[float] = None
+    aqi: Optional[int] = None
 
 
 
@@ -216,14 +194,37 @@ class HourlyDataPoint(BaseModel):
 # ----------------------------------------
 # Global Data Store
 # ----------------------------------------
+# The current sensors/hourly/statistics live in an immutable snapshot.Snapshot,
+# one per region (see regions.py); use snapshot.current(region) and read
+# everything you need from that one object.
+
+
+REFRESH_INTERVAL_MINUTES = regions.DEFAULT_REFRESH_MINUTES
+# Last published snapshot, reloaded at startup (one file per region)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")
+# How far back refresh_data seeds a newly seen series; older history is
+# backfilled on demand by /api/historical
+ROLLUP_BACKFILL_HOURS = 24
+
+# Historical/hourly responses, keyed on region + normalized query params.
+# Entries live for one refresh cycle and a region's entries are dropped
+# whenever that region refreshes.
+RESPONSE_CACHE = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl=REFRESH_INTERVAL_MINUTES * 60,
+)
 
+# Upstream slots one region's crawl may hold at once, so regions refreshing
+# together share the connection pool instead of queueing behind each other
+REGION_UPSTREAM_CONCURRENCY = int(os.getenv(
+    "REGION_UPSTREAM_CONCURRENCY", max(4, upstream.UPSTREAM_CONCURRENCY // len(regions.REGIONS))
+))
 
-DATA = {
-    "sensors": [],
-    "historical": {},
-    "hourly": [],
-    "statistics": {}
-}
+# In-flight requests per upstream-dependent endpoint (cache hits included, they
+# release their slot right away); the rest queue briefly, then get a 503
+HISTORICAL_LIMIT = ConcurrencyLimit("historical", 32)
+HOURLY_LIMIT = ConcurrencyLimit("hourly", 32)
+EXPORT_LIMIT = ConcurrencyLimit("export", 4)
 
 
 # ----------------------------------------
@@ -231,22 +232,15 @@ DATA = {
 # ----------------------------------------
 
 
-def fetch_pm25_data() -> dict:
-    url = (
-        "https://www.simpleaq.org/api/getdata?field=pm2.5"
-        "&min_lat=39.939889&max_lat=40.277507&min_lon=-82.782446&max_lon=-82.195962"
-        f"&utc_epoch={int(time.time()) * 1000}"  # static timestamp that worked
-       
-    )
+def fetch_pm25_data(region: Region) -> dict:
     try:
-        response = httpx.get(url, timeout=10.0)
-        response.raise_for_status()
-        print("Fetched PM2.5 data")
-        # print(url)
-        return response.json()
+        # the gateway serves the last good list while SimpleAQ is unreachable
+        data = upstream.run(upstream.get_sensor_list("pm2.5", region.query), lane=region.name)
     except Exception as e:
-        print("Error fetching PM2.5 data:", str(e))
+        log.error("Error fetching PM2.5 data", region=region.name, error=repr(e))
         return {}
+    log.info("Fetched PM2.5 data", region=region.name, sensors=len(data))
+    return data
 
 
 
@@ -255,141 +249,123 @@ def random_in_range(min_val: float, max_val: float) -> float:
     return random.uniform(min_val, max_val)
 
 
-def generate_sensors(sensor_json: dict) -> List[Sensor]:
-    sensors = []
+def _latest_reading(graph_data: dict, default: Optional[float] = 0) -> Optional[float]:
+    values = graph_data.get("value", [])
+    if values and len(values) > 0:
+        try:
+            return float(values[-1])
+        except:
+            return 0
+    return default
+
+
+def generate_sensors(
+    sensor_json: dict,
+    readings: Optional[Dict[str, Any]] = None,
+    previous: Optional[SensorTable] = None,
+) -> SensorTable:
+    """
+    Build the sensor table from getdata output. `readings` holds the graph data
+    fetched this cycle (all sensors are fetched if it's None); sensors missing
+    from it, or whose fetch failed, keep their row from `previous`.
+    """
+    columns = {k: [] for k in (
+        "ids", "names", "last_updated", "lat", "lng", "pm25", "temperature",
+        "humidity", "pressure", "aqi", "category",
+    )}
+    timestamp_str = datetime.now().isoformat()
+    range_hours = 1
+
+    if readings is None:
+        # Fetch graph data for every sensor/field pair at once over the shared client
+        readings = upstream.run(
+            ingest.fetch_sensor_readings(list(sensor_json.keys()), timestamp_str, range_hours)
+        )
+    previous = previous if previous is not None else SensorTable()
+
     for sensor_id, sensor_data in sensor_json.items():
         try:
             idN = sensor_id
             name = sensor_data.get("name")
             latitude = sensor_data.get("latitude")
             longitude = sensor_data.get("longitude")
-            timestamp_str = datetime.now().isoformat()
             value = sensor_data.get("value")
-            range_hours = 1
-           
-            # Fetch additional graph data for PM2.5
-            field = {"pm2.5_ug_m3" : 0, "pressure_hPa" : 0 ,"temperature_C" : 0, "humidity_percent" : 0}
-            for f in field.keys():
-               
-                url = f"https://www.simpleaq.org/api/getgraphdata?id={idN}&field={f}&rangehours={range_hours}&time={timestamp_str}"
-                field[f] = httpx.get(url, timeout=10.0)
-                field[f].raise_for_status()
-                # print("each sensor data: ", field[f].json())
-                graph_data = field[f].json().get("value", [])
-                # print("Graph data for field", f, ":", graph_data)
-               
-                if f == "pm2.5_ug_m3":
-                    if graph_data and len(graph_data) > 0 :
-                        try:
-                           
-                            pm25 = float(graph_data[-1])
-                           
-                        except:
-                            pm25 = 0
-                    else:
-                        pm25 = float(value)
-                elif f == "pressure_hPa":
-                    if graph_data and len(graph_data) > 0:
-                        try:
-                            pressure = float(graph_data[-1])
-                        except:
-                            pressure = 0
-                    else:
-                        pressure = 0
-                elif f == "temperature_C":
-                    if graph_data and len(graph_data) > 0:
-                        try:
-                            temperature = float(graph_data[-1])
-                        except:
-                            temperature = 0
-                    else:
-                        temperature = 0
-                elif f == "humidity_percent":    
-                    if graph_data and len(graph_data) > 0:
-                        try:
-                            humidity = float(graph_data[-1])
-                        except:
-                            humidity = 0
-                    else:
-                        humidity = 0
-                try:
-                    last_updated = datetime.fromisoformat(timestamp_str)
-                except Exception:
-                    last_updated = datetime.now()
-           
-            sensor_obj = Sensor(
-                id=idN,
-                name=name,
-                location=Location(lat=float(latitude), lng=float(longitude)),
-                pm25=pm25,
-                temperature=temperature,
-                humidity=humidity,
-                pressure=pressure,
-                lastUpdated=last_updated,
-                aqi=calculate_aqi(pm25),
-                aqiCategory=get_aqi_category(pm25)
-            )
-            sensors.append(sensor_obj)
+            if not isinstance(name, str):
+                raise ValueError("missing sensor name")
+
+            fields = readings.get(idN)
+            row = previous.index.get(idN)
+            if (fields is None or isinstance(fields, Exception)) and row is not None:
+                # Nothing new (or fetch failed): carry the previous readings over
+                columns["ids"].append(idN)
+                columns["names"].append(name)
+                columns["last_updated"].append(previous.last_updated[row])
+                columns["lat"].append(float(latitude))
+                columns["lng"].append(float(longitude))
+                columns["pm25"].append(float(previous.pm25[row]))
+                columns["temperature"].append(float(previous.temperature[row]))
+                columns["humidity"].append(float(previous.humidity[row]))
+                columns["pressure"].append(float(previous.pressure[row]))
+                continue
+            if fields is None:
+                raise ValueError("no readings fetched")
+            if isinstance(fields, Exception):
+                raise fields
+
+            pm25 = _latest_reading(fields["pm2.5_ug_m3"], default=None)
+            if pm25 is None:
+                pm25 = float(value)
+            pressure = _latest_reading(fields["pressure_hPa"])
+            temperature = _latest_reading(fields["temperature_C"])
+            humidity = _latest_reading(fields["humidity_percent"])
+            try:
+                last_updated = datetime.fromisoformat(timestamp_str)
+            except Exception:
+                last_updated = datetime.now()
+            lat, lng = float(latitude), float(longitude)
         except Exception as e:
-            print(f"Error processing sensor {sensor_data.get('name')}: {e}")
-    # print(sensors)
-    return sensors
-
-
-async def _fetch_chunk_async(
-    client: httpx.AsyncClient,
-    sensor_id: str,
-    api_field: str,
-    end_time_iso: str,
-    range_hours: int,
-) -> Dict[str, Any]:
-    """
-    Fetch one chunk of data, retrying on network or HTTP errors
-    until either success or 30s total elapsed.
-    """
-    url = (
-        f"https://www.simpleaq.org/api/getgraphdata"
-        f"?id={sensor_id}"
-        f"&field={api_field}"
-        f"&rangehours={range_hours}"
-        f"&time={end_time_iso}"
-    )
-    print("url: ", url)
-    print("fetch attempt for:", end_time_iso)
+            log.warning("Error processing sensor", sensor=sensor_data.get("name"), error=str(e))
+            continue
+
+        columns["ids"].append(idN)
+        columns["names"].append(name)
+        columns["last_updated"].append(last_updated)
+        columns["lat"].append(lat)
+        columns["lng"].append(lng)
+        columns["pm25"].append(pm25)
+        columns["temperature"].append(temperature)
+        columns["humidity"].append(humidity)
+        columns["pressure"].append(pressure)
+    # AQI and category for every sensor in one pass over the breakpoint arrays
+    columns["aqi"] = aqi.aqi_array(columns["pm25"])
+    columns["category"] = aqi.category_codes(columns["pm25"])
+    return SensorTable.from_columns(columns, AQI_CATEGORIES)
+
+
+# refreshes keep every sensor's tail current, so request paths only go
+# upstream for sensors they don't cover or for older backfill
+SYNC_MAX_STALENESS = max(r.refresh_minutes for r in regions.REGIONS) * 60 + 60
+# Upstream budget of a request-path sync; past it the request is answered from
+# whatever the store holds (including any chunks that did arrive)
+REQUEST_UPSTREAM_DEADLINE = float(os.getenv("REQUEST_UPSTREAM_DEADLINE", "5"))
+
+
+async def _sync_series_async(sensor_id: str, api_field: str, start: int, now: int) -> None:
+    """Pull whatever the local store is missing for this window over the shared client."""
     try:
-        resp = await client.get(url, timeout=httpx.Timeout(10.0, read=60.0))
-        resp.raise_for_status()
+        await upstream.run_async(
+            ingest.sync_series(sensor_id, api_field, start, now, SYNC_MAX_STALENESS),
+            deadline=REQUEST_UPSTREAM_DEADLINE,
+        )
     except Exception as e:
-        print("  ↳ fetch failed:", repr(e))
-        raise
-    data = resp.json()
-    data.pop("sensor", None)
-    # ensure shape
-    return {
-        "time": data.get("time", []),
-        "value": data.get("value", []),
-    }
-
-
-
-
-import asyncio
-from datetime import datetime, timedelta, timezone
-from collections import defaultdict
-from typing import List, Dict, Optional, Any
-
-
-import httpx
-from tenacity import retry, stop_after_delay, wait_exponential, retry_if_exception_type
-
-
-# your existing retry‐decorated fetch_chunk_async here…
+        log.warning("Series sync failed, serving stored data", sensor_id=sensor_id, field=api_field, error=repr(e))
 
 
 async def generate_historical_data(
     sensor_id: str,
     api_field: str,
-    time_range: str
+    time_range: str,
+    sync: bool = True,
 ) -> List[Dict[str, Optional[float]]]:
     # 1️⃣ configure span
     if time_range == "7d":
@@ -398,121 +374,202 @@ async def generate_historical_data(
         days_to_return = 35
 
 
-    chunk_days  = 7
-    chunk_hours = chunk_days * 24
-
-
     # map api_field → output key
     output_key = INVERSE_DATA_VAL_DICT.get(api_field)
     if output_key is None:
         raise ValueError(f"No matching output key for API field: {api_field}")
 
 
-    # 2️⃣ build list of chunk end‐times
+    # 2️⃣ top up the local store (only the missing tail/backfill goes upstream)
     now = datetime.now(timezone.utc)
-    num_chunks = (days_to_return + chunk_days - 1) // chunk_days
-    end_times = [
-        (now - timedelta(days=i * chunk_days))
-        .strftime("%Y-%m-%dT%H:%M:%S.000Z")
-        for i in range(num_chunks)
-    ]
-
-
-    # 3️⃣ fetch all chunks in parallel
-    async with httpx.AsyncClient() as client:
-        tasks = [
-            _fetch_chunk_async(client, sensor_id, api_field, et, chunk_hours)
-            for et in end_times
-        ]
-        chunks: List[Dict[str, Any]] = await asyncio.gather(*tasks)
+    now_ts = int(now.timestamp())
+    start_ts = now_ts - days_to_return * 86400
+    if sync:
+        await _sync_series_async(sensor_id, api_field, start_ts, now_ts)
 
 
-    # 4️⃣ aggregate: raw → hourly buckets → daily buckets
-    daily_sum   = defaultdict(float)
-    daily_count = defaultdict(int)
+    # 3️⃣ read the precomputed daily rollup (raw → hourly → daily means)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - timedelta(days=days_to_return - 1)
+    day_starts, day_means = await asyncio.to_thread(
+        store.query_rollup, sensor_id, api_field, aggregation.DAY, int(first_day.timestamp()), now_ts
+    )
 
 
-    for chunk in chunks:
-        # first pass: bucket into hours
-        hourly_sum   = defaultdict(float)
-        hourly_count = defaultdict(int)
+    # 4️⃣ build the final list, one entry per day (fills in missing days with None)
+    daily = aggregation.fill_buckets(
+        day_starts, day_means, int(first_day.timestamp()), days_to_return, aggregation.DAY
+    )
 
+    # AQI for the whole series in one lookup, for pollutants that have a scale
+    daily_aqi = aqi.aqi_list(daily, output_key) if aqi.has_aqi(output_key) else None
 
-        for ts_str, val_str in zip(chunk["time"], chunk["value"]):
-            try:
-                dt = datetime.fromisoformat(ts_str.rstrip("Z")).replace(tzinfo=timezone.utc)
-                hour_bucket = dt.replace(minute=0, second=0, microsecond=0)
-                hourly_sum[hour_bucket]   += float(val_str)
-                hourly_count[hour_bucket] += 1
-            except Exception:
-                continue
+    result: List[Dict[str, Optional[float]]] = []
+    for offset, day_avg in enumerate(daily.tolist()):
+        ts_midnight = first_day + timedelta(days=offset)
+        point = {
+            "timestamp": ts_midnight.strftime("%Y-%m-%dT00:00:00"),
+            output_key: None if math.isnan(day_avg) else round(day_avg, 4)
+        }
+        if daily_aqi is not None:
+            point["aqi"] = daily_aqi[offset]
+        result.append(point)
 
 
-        # second pass: collapse each hourly bucket into the day's tally
-        for hour_dt, total in hourly_sum.items():
-            count = hourly_count[hour_dt]
-            if count == 0:
-                continue
-            hourly_avg = total / count
-            day_key = hour_dt.date()
-            daily_sum[day_key]   += hourly_avg
-            daily_count[day_key] += 1
+    return result
 
 
-    # 5️⃣ build the final list, one entry per day (fills in missing days with None)
-    result: List[Dict[str, Optional[float]]] = []
-    for offset in range(days_to_return - 1, -1, -1):
-        day = (now - timedelta(days=offset)).date()
-        if daily_count[day]:
-            day_avg = round(daily_sum[day] / daily_count[day], 4)
-        else:
-            day_avg = None
 
 
-        ts_midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
-        result.append({
-            "timestamp": ts_midnight.strftime("%Y-%m-%dT00:00:00"),
-            output_key: day_avg
-        })
+# Sources for start/end queries, finest first: 0 is the raw points, the rest
+# are the store's rollup tiers
+RANGE_TIERS = (0,) + store.ROLLUP_TIERS
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+MAX_RANGE_DAYS = store.ROLLUP_RETENTION_DAYS
+DOWNSAMPLERS = {"lttb": aggregation.lttb, "minmax": aggregation.minmax_envelope}
 
 
-    return result
+def choose_resolution(
+    sensor_id: str, api_field: str, start: int, end: int, max_points: int, raw_count: Optional[int] = None,
+) -> int:
+    """
+    Coarsest source (0 = raw) that still has at least max_points points in
+    [start, end], or the finest one available if none has. The downsampler
+    then never works on more than one tier step's worth of extra points.
+    raw_count is given for a window fetched without storing it: every tier is
+    then computed from those raw points.
+    """
+    if raw_count is None:
+        raw_floor = int(time.time()) - store.RAW_RETENTION_DAYS * 86400
+        # raw points and 5-minute rollups are pruned after RAW_RETENTION_DAYS
+        available = [t for t in RANGE_TIERS if not (t in (0, store.FIVE_MINUTES) and start < raw_floor)]
+    else:
+        available = list(RANGE_TIERS)
+    for tier in reversed(available):
+        if tier == 0:
+            n = store.count(sensor_id, api_field, start, end) if raw_count is None else raw_count
+        else:
+            n = (end - start) // tier + 1
+        if n >= max_points:
+            return tier
+    return available[0]
 
 
+def _rollup(times: np.ndarray, values: np.ndarray, tier: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The store's rollup tier computed in memory (days are means of hourly means)."""
+    mean = aggregation.bucket_mean_of_means if tier == aggregation.DAY else aggregation.bucket_mean
+    starts, means, _ = mean(times, values, tier)
+    return starts, means
 
 
-def generate_24hour_data(time, field, sensor_id) -> List[HourlyDataPoint]:
-    raw = transform_data_from_url(sensor_id, field, time, 24)
+async def _sync_range(
+    sensor_id: str, api_field: str, start: int, end: int, now: int,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Top up the store for [start, end] and return None, or, for a window apart
+    from the stored coverage, fetch just that window and return its raw points
+    without storing them: keeping the coverage contiguous would mean fetching
+    the whole gap, which for old windows is raw data pruned again anyway.
+    """
+    # History past raw retention only has to be fetched once: after that the
+    # rollups hold it (even the spans upstream had no points for) and the raw
+    # points are pruned again anyway
+    raw_floor = now - store.RAW_RETENTION_DAYS * 86400
+    if start < raw_floor:
+        rolled = await asyncio.to_thread(store.get_rollup_coverage, sensor_id, api_field)
+        if rolled is not None and rolled[0] <= start and min(end, raw_floor) <= rolled[1]:
+            if raw_floor < end:
+                await _sync_series_async(sensor_id, api_field, raw_floor, end)
+            return None
+
+    coverage = await asyncio.to_thread(store.get_coverage, sensor_id, api_field)
+    apart = end < raw_floor if coverage is None else (end < coverage[0] or start > coverage[1])
+    if not apart:
+        await _sync_series_async(sensor_id, api_field, start, end)
+        return None
+    try:
+        return await upstream.run_async(
+            ingest.fetch_window(sensor_id, api_field, start, end), deadline=REQUEST_UPSTREAM_DEADLINE
+        )
+    except Exception as e:
+        log.warning("Range fetch failed, serving stored data", sensor_id=sensor_id, field=api_field, error=repr(e))
+        return None
 
 
-    # Parse timestamps and values
-    records = [
-        (datetime.fromisoformat(ts.rstrip("Z")).replace(tzinfo=timezone.utc), float(val))
-        for ts, val in zip(raw["time"], raw["value"])
-    ]
-   
-    # Group data by hour
-    hourly_data = {}
-    for timestamp, value in records:
-        hour_key = timestamp.replace(minute=0, second=0, microsecond=0)
-        if hour_key not in hourly_data:
-            hourly_data[hour_key] = []
-        hourly_data[hour_key].append(value)
-   
-    # Calculate hourly averages
+async def generate_range_data(
+    sensor_id: str,
+    api_field: str,
+    start: int,
+    end: int,
+    max_points: int,
+    method: str = "lttb",
+) -> Tuple[int, List[Dict[str, Optional[float]]]]:
+    """
+    Series for an arbitrary [start, end] in at most max_points points.
+
+    Reads the coarsest source that still has enough points (raw, 5-minute,
+    hourly or daily means) and downsamples it with LTTB or a min/max envelope.
+    Returns (resolution seconds, 0 for raw, and the points). Empty buckets
+    are left out rather than sent as nulls.
+    """
+    output_key = INVERSE_DATA_VAL_DICT.get(api_field)
+    if output_key is None:
+        raise ValueError(f"No matching output key for API field: {api_field}")
+
+    now_ts = int(time.time())
+    fetched = None
+    if start < now_ts:
+        fetched = await _sync_range(sensor_id, api_field, start, min(end, now_ts), now_ts)
+
+    if fetched is not None:
+        times, values = fetched
+        tier = choose_resolution(sensor_id, api_field, start, end, max_points, raw_count=times.size)
+        if tier != 0:
+            times, values = _rollup(times, values, tier)
+    else:
+        # store reads wait on its lock while a refresh writes, so keep them off the event loop
+        tier = await asyncio.to_thread(choose_resolution, sensor_id, api_field, start, end, max_points)
+        if tier == 0:
+            times, values = await asyncio.to_thread(store.query, sensor_id, api_field, start, end)
+        else:
+            times, values = await asyncio.to_thread(
+                store.query_rollup, sensor_id, api_field, tier, start - start % tier, end
+            )
+    times, values = DOWNSAMPLERS[method](times, values, max_points)
+
+    stamps = np.char.add(np.datetime_as_string(times.astype("datetime64[s]"), unit="s"), "Z").tolist()
+    series_aqi = aqi.aqi_list(values, output_key) if aqi.has_aqi(output_key) else None
+    points: List[Dict[str, Optional[float]]] = []
+    for i, value in enumerate(values.tolist()):
+        point = {"timestamp": stamps[i], output_key: round(value, 4)}
+        if series_aqi is not None:
+            point["aqi"] = series_aqi[i]
+        points.append(point)
+    return tier, points
+
+
+async def generate_24hour_data(time, field, sensor_id) -> List[HourlyDataPoint]:
+    end_ts = int(datetime.fromisoformat(time).timestamp())
+    start_ts = end_ts - 24 * 3600
+    await _sync_series_async(sensor_id, field, start_ts, end_ts)
+
+    # Hourly averages come straight from the hourly rollup
+    hour_starts, hour_means = await asyncio.to_thread(
+        store.query_rollup, sensor_id, field, aggregation.HOUR, start_ts - start_ts % aggregation.HOUR, end_ts
+    )
     result = []
     metric_key = INVERSE_DATA_VAL_DICT.get(field)
-    for hour in sorted(hourly_data.keys()):
-        values = hourly_data[hour]
-        metric_avg = sum(values) / len(values)
-        aqi = calculate_aqi(metric_avg)
-       
+    hourly_aqi = aqi.aqi_list(hour_means, metric_key) if aqi.has_aqi(metric_key) else None
+    for i, (hour, metric_avg) in enumerate(zip(hour_starts, hour_means)):
         data_point = {
-            "time": hour.strftime("%Y-%m-%dT%H:00:00")
+            "time": datetime.fromtimestamp(hour, timezone.utc).strftime("%Y-%m-%dT%H:00:00")
         }
        
         if metric_key:
             data_point[metric_key] = round(metric_avg, 4)
+        if hourly_aqi is not None:
+            data_point["aqi"] = hourly_aqi[i]
 
 
         result.append(data_point)
@@ -522,129 +579,201 @@ def generate_24hour_data(time, field, sensor_id) -> List[HourlyDataPoint]:
 
 
 
-def transform_data_from_url(sensor_id: str, field: str, time: str, range_hours: int) -> dict:
-    url = f"https://www.simpleaq.org/api/getgraphdata?id={sensor_id}&field={field}&rangehours={range_hours}&time={time}"
-    timeouts = httpx.Timeout(10.0, read=60.0, write=60.0)
+def build_snapshot(state: "RegionState", previous: Snapshot) -> Snapshot:
+    # every upstream call of this refresh runs in the region's lane
+    lane = state.name
+    raw_data = fetch_pm25_data(state.region)
+
+    # Only sensors with new points upstream (or not in the table yet) get their
+    # graph data fetched; everything else keeps its previous row
     try:
-        response = httpx.get(url, timeout=timeouts)
-        response.raise_for_status()
-        data = response.json()
-    except httpx.HTTPStatusError as e:
-        print(f"HTTP error for {url}: {e}")
-        return {"time": [], "value": []}
-    except httpx.RequestError as e:
-        print(f"Request error for {url}: {e}")
-        return {"time": [], "value": []}
+        active = upstream.run(state.poller.plan(raw_data.keys()), lane=lane)
     except Exception as e:
-        print(f"An unexpected error occurred fetching {url}: {e}")
-        return {"time": [], "value": []}
-    data.pop("sensor", None)
-    return data
-
+        log.error("Error checking latest sensor points, fetching all sensors", region=state.name, error=repr(e))
+        active = set(raw_data)
+    active |= {s for s in raw_data if s not in previous.sensors.index}
 
+    # Bring the series (and rollups) of those sensors up to date, then take
+    # their latest readings from the store rather than fetching them again
+    now_ts = int(time.time())
+    try:
+        readings, failed = upstream.run(ingest.sync_readings(
+            sorted(active),
+            list(DATA_VAL_DICT.values()),
+            now_ts - ROLLUP_BACKFILL_HOURS * 3600,
+            now_ts,
+        ), lane=lane)
+        if failed:
+            log.warning("Series sync failed for some sensor/metric pairs", region=state.name, failed=failed)
+    except Exception as e:
+        log.error("Error syncing series store", region=state.name, error=repr(e))
+        readings = {}
+    fetched = [s for s, r in readings.items() if not isinstance(r, Exception)]
+    state.poller.mark_fetched(fetched)
+    log.info("Fetched readings for sensors with new data", region=state.name, fetched=len(fetched),
+             sensors=len(raw_data))
+    sensors = generate_sensors(raw_data, readings, previous.sensors)
 
 
-def calculate_statistics(sensors: List[Sensor]) -> Dict:
-    if not sensors:
-        return {}
-    pm25_values = [sensor.pm25 for sensor in sensors]
-    average = sum(pm25_values) / len(pm25_values)
-    maximum = max(pm25_values)
-    minimum = min(pm25_values)
-    aqi_distribution = {}
-    for sensor in sensors:
-        category = sensor.aqiCategory.category if sensor.aqiCategory else "Unknown"
-        aqi_distribution[category] = aqi_distribution.get(category, 0) + 1
-    return {
-        "averagePM25": average,
-        "maxPM25": maximum,
-        "minPM25": minimum,
-        "aqiDistribution": aqi_distribution
-    }
+    #Add to count to show how many datapoints were collected today
+    #Reset Every Day
+    if previous.counter["date"] == date.today():
+        counter = {"count": previous.counter["count"] + 1, "date": date.today()}
+        log.info("Count incremented", region=state.name, count=counter["count"])
+    else:
+        counter = {"count": 0, "date": date.today()}
 
 
+    # # ⚠️ Fix is here: Only generate hourly data for the first available sensor
+    if len(sensors):
+        default_sensor_id = sensors.ids[0]
+        hourly = upstream.run(
+            generate_24hour_data(datetime.now().isoformat(), "pm2.5_ug_m3", default_sensor_id), lane=lane
+        )
+        # historical = generate_historical_data(default_sensor_id, "pm2.5_ug_m3")
+    else:
+        hourly = []
+        # historical = []
 
-def refresh_data():
+    with metrics.AGGREGATION_DURATION.time("statistics"):
+        stats = compute_statistics(sensors)
 
-    global todaysPoints
+    return snapshot.encode(Snapshot(
+        **snapshot.track_changes(previous, sensors),
+        sensors=sensors,
+        hourly=tuple(hourly),
+        statistics=stats,
+        counter=counter,
+        refreshed_at=datetime.now(),
+        source="live",
+        region=state.name,
+    ))
 
-    raw_data = fetch_pm25_data()
-    sensors = generate_sensors(raw_data)
 
+class RegionState:
+    """
+    Everything one region refreshes and serves on its own: its poller, its
+    refresher (at most one refresh per region at a time, concurrent callers
+    join it), its SSE stream and its snapshot file.
+    """
 
-    #Add to count to show how many datapoints were collected today
-    #Reset Every Day
-    if todaysPoints["count"] == date.today():
-        todaysPoints["count"] += 1
-        print("🔄 Count incremented:", todaysPoints["count"])
-    else:
-        todaysPoints["count"] = 0
-        todaysPoints["date"] = date.today()
+    def __init__(self, region: Region):
+        self.region = region
+        self.name = region.name
+        # Decides each refresh which sensors have new points worth fetching
+        self.poller = PollScheduler(base_seconds=region.refresh_minutes * 60)
+        # Pushes each published snapshot to /api/sensors/stream clients
+        self.broadcaster = Broadcaster()
+        self.snapshot_path = regions.path_for(SNAPSHOT_PATH, region.name)
+        self.refresher = snapshot.Refresher(
+            lambda previous: build_snapshot(self, previous),
+            on_publish=lambda snap: _on_publish(self, snap),
+            region=region.name,
+        )
+        upstream.set_lane_limit(region.name, REGION_UPSTREAM_CONCURRENCY)
 
+    def current(self) -> Snapshot:
+        return snapshot.current(self.name)
 
+    def owns(self, key) -> bool:
+        """Whether a RESPONSE_CACHE key belongs to this region."""
+        return key[0] == self.name
 
-    #global previously_safe_ids
-    previously_safe_ids = load_prev_safe_ids()
 
-    UNHEALTHY_CATEGORIES = {"Unhealthy", "Very Unhealthy", "Hazardous", "Unhealthy for Sensitive Groups"}
-    triggered_sensors = []
+REGION_STATES: Dict[str, RegionState] = {r.name: RegionState(r) for r in regions.REGIONS}
 
-    #Detect new unhealthy sensors
-    for sensor in sensors:
-        if sensor.aqiCategory and sensor.aqiCategory.category in UNHEALTHY_CATEGORIES:
-            if sensor.id in previously_safe_ids:
-               triggered_sensors.append(sensor)        
 
-    if triggered_sensors:
-        # Send to PipeDream
-        httpx.post(os.getenv("VITE_PIPEDREAM_REALTIME"), json={
-            "sensors": [
-                {"name": s.name, "aqi": s.aqi, "category": s.aqiCategory.category}
-                for s in triggered_sensors
-                ]
-        })
-        print(f"🚨 Triggered {len(triggered_sensors)} sensors!")
-        for s in triggered_sensors:
-            print(f"  ↳ {s.name} is now {s.aqiCategory.category}")
-
-    # Update previously_safe_ids for next check
-    new_safe_ids = {
-        sensor.id
-        for sensor in sensors
-        if sensor.aqiCategory and sensor.aqiCategory.category not in UNHEALTHY_CATEGORIES
-    }
-    save_prev_safe_ids(new_safe_ids)
+def _broadcast(state: RegionState, snap: Snapshot) -> None:
+    delta = snapshot.changes_since(snap, snap.generation - 1)
+    state.broadcaster.publish(snap.generation, snap.encoded["sensors"].identity, encoding.dumps(delta))
 
 
+def _on_publish(state: RegionState, snap: Snapshot) -> None:
+    RESPONSE_CACHE.clear(state.owns)
+    _broadcast(state, snap)
+    try:
+        ALERTS.process(snap.sensors, removed=snap.removed)
+    except Exception as e:
+        log.error("Error queuing alerts", region=state.name, error=repr(e))
+    try:
+        snapshot.save(snap, state.snapshot_path)
+    except Exception as e:
+        log.error("Error saving snapshot", region=state.name, error=repr(e))
+    try:
+        CLUSTER.publish(snap)
+    except Exception as e:
+        log.error("Error writing shared snapshot", region=state.name, error=repr(e))
+    log.info("Data refreshed", region=state.name, generation=snap.generation, sensors=len(snap.sensors),
+             refreshed_at=snap.refreshed_at.isoformat())
 
 
-    # # ⚠️ Fix is here: Only generate hourly data for the first available sensor
-    if sensors:
-        default_sensor_id = sensors[0].id
-        hourly = generate_24hour_data(datetime.now().isoformat(), "pm2.5_ug_m3", default_sensor_id)
-        # historical = generate_historical_data(default_sensor_id, "pm2.5_ug_m3")
-    else:
-        hourly = []
-        # historical = []
+def refresh_data(region: str = regions.DEFAULT_REGION) -> Snapshot:
+    return REGION_STATES[region].refresher.run()
 
-    stats = calculate_statistics(sensors)
 
-    DATA["sensors"] = sensors
-    # DATA["historical"] = historical
-    DATA["hourly"] = hourly
-    DATA["statistics"] = stats
-    print("Data refreshed", datetime.now().isoformat())
+def prune_store() -> None:
+    # Keep the local series store bounded (shared by all regions)
+    try:
+        store.prune()
+    except Exception as e:
+        log.error("Error pruning series store", error=repr(e))
 
 
 
-# Initial data load
-refresh_data()
+# Initial data load: serve the last saved snapshots right away, the first live
+# refreshes are kicked off in the background when the app starts
+for _state in REGION_STATES.values():
+    _persisted = snapshot.load(_state.snapshot_path, AQI_CATEGORIES, region=_state.name)
+    if _persisted is not None:
+        snapshot.publish(_persisted)
+        _broadcast(_state, _persisted)
+        log.info("Loaded snapshot", region=_state.name, refreshed_at=_persisted.refreshed_at,
+                 sensors=len(_persisted.sensors))
 
 # ----------------------------------------
 # FastAPI App Setup
 # ----------------------------------------
 
-app = FastAPI()
+# Each region refreshes on its own interval, in its own refresh thread
+scheduler = BackgroundScheduler()
+for _state in REGION_STATES.values():
+    scheduler.add_job(_state.refresher.trigger, 'interval', minutes=_state.region.refresh_minutes,
+                      id=f"refresh-{_state.name}", max_instances=1, coalesce=True)
+scheduler.add_job(prune_store, 'interval', minutes=REFRESH_INTERVAL_MINUTES, max_instances=1, coalesce=True)
+
+
+def _start_leader() -> None:
+    # only the worker holding the cluster lock crawls SimpleAQ and sends alerts
+    ALERTS.start()
+    for state in REGION_STATES.values():
+        state.refresher.trigger()
+    scheduler.start()
+
+
+def _on_shared_snapshot(snap: Snapshot) -> None:
+    # followers: serve what the leader published
+    state = REGION_STATES[snap.region]
+    snapshot.publish(snap)
+    RESPONSE_CACHE.clear(state.owns)
+    _broadcast(state, snap)
+
+
+CLUSTER = Cluster(on_leader=_start_leader, on_snapshot=_on_shared_snapshot)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for state in REGION_STATES.values():
+        state.broadcaster.bind(asyncio.get_running_loop())
+    CLUSTER.start()
+    yield
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+        ALERTS.stop()
+    CLUSTER.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=profiling.TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -653,33 +782,156 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(refresh_data, 'interval', minutes=10)
-scheduler.start()
+app.add_middleware(profiling.ProfilingMiddleware)
+# Outermost, so request latency covers every other middleware too
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Endpoints serve one region, picked with ?region=<name> (the default region
+# when it's left out); unknown regions are a 404
+def _region_state(region: Optional[str]) -> RegionState:
+    if region is None:
+        return REGION_STATES[regions.DEFAULT_REGION]
+    state = REGION_STATES.get(region)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Unknown region {region!r}")
+    return state
+
+
+def _cache_key(key: tuple, region: Optional[str]) -> tuple:
+    """
+    RESPONSE_CACHE key for a per-sensor response key (sensor id at key[1]),
+    prefixed with the region whose refresh invalidates it: the one asked for,
+    else the first one listing the sensor.
+    """
+    if region is None:
+        for state in REGION_STATES.values():
+            if key[1] in state.current().sensors.index:
+                return (state.name,) + key
+    return (_region_state(region).name,) + key
+
+
+# Snapshot endpoints serve the bytes encoded once per refresh and answer
+# conditional GETs with 304 until the next refresh
+def _snapshot_response(name: str, request: Request, region: Optional[str] = None) -> Response:
+    snap = _region_state(region).current()
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if snap.last_modified:
+        headers["Last-Modified"] = snap.last_modified
+    if encoding.not_modified(request.headers, snap.etag, snap.refreshed_at):
+        headers["Vary"] = "Accept-Encoding"
+        return Response(status_code=304, headers=headers)
+    return encoding.respond(snap.encoded[name], request.headers.get("accept-encoding", ""), headers)
+
+
+@app.get("/api/regions")
+async def get_regions():
+    result = []
+    for state in REGION_STATES.values():
+        snap = state.current()
+        result.append({
+            "name": state.name,
+            "default": state.name == regions.DEFAULT_REGION,
+            "bbox": state.region.bbox,
+            "refreshMinutes": state.region.refresh_minutes,
+            "sensors": len(snap.sensors),
+            "refreshedAt": snap.refreshed_at,
+        })
+    return result
 
 @app.get("/api/sensors", response_model=List[Sensor])
-def get_sensors():
-    return DATA["sensors"]
+async def get_sensors(request: Request, region: Optional[str] = Query(None)):
+    return _snapshot_response("sensors", request, region)
+
+@app.get("/api/sensors/changes")
+async def get_sensor_changes(request: Request, since: int = Query(0), region: Optional[str] = Query(None)):
+    snap = _region_state(region).current()
+    # the 304 carries the same validators as the 200 it stands in for
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if snap.last_modified:
+        headers["Last-Modified"] = snap.last_modified
+    if encoding.not_modified(request.headers, snap.etag, snap.refreshed_at):
+        return Response(status_code=304, headers=headers)
+    changes = snapshot.changes_since(snap, since)
+    return Response(content=encoding.dumps(changes), media_type="application/json", headers=headers)
+
+MAX_NEAR_SENSORS = 100
+
+@app.get("/api/sensors/near")
+async def get_sensors_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=MAX_NEAR_SENSORS),
+    region: Optional[str] = Query(None),
+):
+    snap = _region_state(region).current()
+    rows, distances = snap.spatial_index.nearest(lat, lng, k)
+    sensors = snap.sensors.records(rows)
+    for sensor, distance in zip(sensors, distances.tolist()):
+        sensor["distanceKm"] = round(distance, 3)
+    return Response(content=encoding.dumps(sensors), media_type="application/json",
+                    headers={"ETag": snap.etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/sensors/bbox")
+async def get_sensors_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lng: float = Query(..., ge=-180, le=180),
+    region: Optional[str] = Query(None),
+):
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="min_lat/min_lng must not exceed max_lat/max_lng")
+    snap = _region_state(region).current()
+    rows = snap.spatial_index.within(min_lat, max_lat, min_lng, max_lng)
+    return Response(content=encoding.dumps(snap.sensors.records(rows)), media_type="application/json",
+                    headers={"ETag": snap.etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/pm25/grid")
+async def get_pm25_grid(request: Request, region: Optional[str] = Query(None)):
+    # IDW-interpolated PM2.5 over the region's bbox as a binary tile; the
+    # layout is described by spatial.RASTER_HEADER
+    return _snapshot_response("pm25_grid", request, region)
+
+@app.get("/api/sensors/stream")
+async def stream_sensors(request: Request, region: Optional[str] = Query(None)):
+    # Server-Sent Events: a full "snapshot" event on connect, then a "delta"
+    # event per refresh. Reconnecting clients resume from Last-Event-ID.
+    state = _region_state(region)
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        cursor = int(last_event_id) if last_event_id else None
+    except ValueError:
+        cursor = None
+    return StreamingResponse(
+        state.broadcaster.subscribe(cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/refreshtable")
-def get_sensors():
-    refresh_data()
-    return DATA["sensors"]
+async def refresh_table(request: Request, region: Optional[str] = Query(None)):
+    state = _region_state(region)
+    snap = state.current()
+    # followers never refresh; the leader's next snapshot arrives via the shared file
+    if CLUSTER.is_leader:
+        # join the region's in-flight refresh (or start one) without tying up a worker thread
+        try:
+            snap = await asyncio.wrap_future(state.refresher.trigger())
+        except Exception as e:
+            log.error("Error refreshing data", region=state.name, error=repr(e))
+    return encoding.respond(snap.encoded["sensors"], request.headers.get("accept-encoding", ""))
 
 
 
-@app.get("/api/historical")
-async def get_historical(
-    sensor_id: Optional[str] = Query(None),
-    metric:    Optional[str] = Query(None),
-    time_range: Optional[str] = Query(None),
-):
-    # default sensor
+def _historical_key(sensor_id: Optional[str], metric: Optional[str], time_range: Optional[str],
+                    region: Optional[str] = None):
+    """Apply the endpoint defaults; returns the response key or None if there's nothing to serve."""
+    # default sensor: the region's first
     if not sensor_id:
-        if not DATA["sensors"]:
-            return []
-        sensor_id = DATA["sensors"][0].id
+        sensors = _region_state(region).current().sensors
+        if not len(sensors):
+            return None
+        sensor_id = sensors.ids[0]
 
     # default metric
     if not metric:
@@ -687,47 +939,269 @@ async def get_historical(
 
     backend_field = DATA_VAL_DICT.get(metric)
     if backend_field is None:
+        return None
+
+    return ("historical", sensor_id, backend_field, "7d" if time_range == "7d" else "35d")
+
+
+def _epoch(value: datetime) -> int:
+    # naive datetimes are taken as UTC, like SimpleAQ's own timestamps
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+@app.get("/api/historical", dependencies=[Depends(HISTORICAL_LIMIT)])
+async def get_historical(
+    response: Response,
+    sensor_id: Optional[str] = Query(None),
+    metric:    Optional[str] = Query(None),
+    time_range: Optional[str] = Query(None),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    max_points: Optional[int] = Query(None, ge=10, le=MAX_POINTS_LIMIT),
+    downsample: str = Query("lttb"),
+    region: Optional[str] = Query(None),
+):
+    key = _historical_key(sensor_id, metric, time_range, region)
+    if key is None:
         return []
+    _, sensor_id, backend_field, time_range = key
+
+    if start is not None or end is not None or max_points is not None:
+        # arbitrary range: the server picks the resolution and downsamples
+        if downsample not in DOWNSAMPLERS:
+            raise HTTPException(status_code=400, detail=f"downsample must be one of {', '.join(DOWNSAMPLERS)}")
+        # a defaulted end is rounded so repeat requests share a cache entry
+        end_ts = _epoch(end) if end else int(time.time()) // 60 * 60
+        start_ts = _epoch(start) if start else end_ts - (7 if time_range == "7d" else 35) * 86400
+        if start_ts >= end_ts:
+            raise HTTPException(status_code=400, detail="start must be before end")
+        if end_ts - start_ts > MAX_RANGE_DAYS * 86400:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_RANGE_DAYS} days per request")
+        points = max_points or DEFAULT_MAX_POINTS
+        range_key = ("range", sensor_id, backend_field, start_ts, end_ts, points, downsample)
+        tier, data = await RESPONSE_CACHE.get_or_load_async(
+            _cache_key(range_key, region), lambda: generate_range_data(sensor_id, backend_field, start_ts, end_ts, points, downsample)
+        )
+        response.headers["X-Resolution-Seconds"] = str(tier)
+        return data
+
+    # identical concurrent requests share one fetch
+    return await RESPONSE_CACHE.get_or_load_async(
+        _cache_key(key, region), lambda: generate_historical_data(sensor_id, backend_field, time_range)
+    )
+
+
+class HistoricalQuery(BaseModel):
+    sensor_id: Optional[str] = None
+    metric: Optional[str] = None
+    time_range: Optional[str] = None
+
+
+class HistoricalBatchRequest(BaseModel):
+    queries: List[HistoricalQuery]
+
+
+MAX_BATCH_QUERIES = 50
+
 
-    # **await** your async function here
-    return await generate_historical_data(sensor_id, backend_field, time_range)
+@app.post("/api/historical/batch", dependencies=[Depends(HISTORICAL_LIMIT)])
+async def get_historical_batch(batch: HistoricalBatchRequest, region: Optional[str] = Query(None)):
+    if len(batch.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
 
+    keys = [_historical_key(q.sensor_id, q.metric, q.time_range, region) for q in batch.queries]
+    unique_keys = list(dict.fromkeys(k for k in keys if k is not None))
 
+    # One store sync per (sensor, field), covering the longest range asked for it
+    sync_days: Dict[tuple, int] = {}
+    for _, sensor_id, backend_field, time_range in unique_keys:
+        days = 7 if time_range == "7d" else 35
+        sync_days[(sensor_id, backend_field)] = max(days, sync_days.get((sensor_id, backend_field), 0))
 
+    now_ts = int(time.time())
+    sync_tasks: Dict[tuple, asyncio.Task] = {}
 
-@app.get("/api/hourly")
-def get_hourly(sensor_id: Optional[str] = Query(None), metric: Optional[str] = Query(None)):
+    def _sync_for(sensor_id: str, backend_field: str) -> asyncio.Task:
+        pair = (sensor_id, backend_field)
+        if pair not in sync_tasks:
+            start_ts = now_ts - sync_days[pair] * 86400
+            sync_tasks[pair] = asyncio.ensure_future(_sync_series_async(sensor_id, backend_field, start_ts, now_ts))
+        return sync_tasks[pair]
+
+    async def _load(sensor_id: str, backend_field: str, time_range: str):
+        await _sync_for(sensor_id, backend_field)
+        return await generate_historical_data(sensor_id, backend_field, time_range, sync=False)
+
+    # Cached series are served as-is; misses sync concurrently over the shared client
+    series = await asyncio.gather(*(
+        RESPONSE_CACHE.get_or_load_async(_cache_key(key, region), lambda key=key: _load(key[1], key[2], key[3]))
+        for key in unique_keys
+    ))
+    by_key = dict(zip(unique_keys, series))
+
+    return {
+        "results": [
+            {
+                "sensor_id": q.sensor_id if key is None else key[1],
+                "metric": q.metric or "pm2.5",
+                "time_range": q.time_range,
+                "data": [] if key is None else by_key[key],
+            }
+            for q, key in zip(batch.queries, keys)
+        ]
+    }
+
+
+
+
+@app.get("/api/hourly", dependencies=[Depends(HOURLY_LIMIT)])
+async def get_hourly(
+    sensor_id: Optional[str] = Query(None),
+    metric: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+):
     now = datetime.now().isoformat()
 
     if not sensor_id:
-        if not DATA["sensors"]:
+        sensors = _region_state(region).current().sensors
+        if not len(sensors):
             return []
-        sensor_id = DATA["sensors"][0].id
+        sensor_id = sensors.ids[0]
     if not metric:
         metric = "pm2.5"
 
 
     backend_field = DATA_VAL_DICT.get(metric)
     if backend_field is None:
-        print(f"[WARNING] Unknown metric: {metric}")
+        log.warning("Unknown metric", metric=metric)
         return []
 
-    print(f"[INFO] Fetching {metric} ({backend_field}) for sensor {sensor_id}")
-    return generate_24hour_data(now, backend_field, sensor_id)
+    request_log.info("Fetching hourly data", metric=metric, field=backend_field, sensor_id=sensor_id)
+    key = _cache_key(("hourly", sensor_id, backend_field), region)
+    return await RESPONSE_CACHE.get_or_load_async(key, lambda: generate_24hour_data(now, backend_field, sensor_id))
+
 
 
 
+@app.get("/api/export")
+async def export_data(
+    sensor_id: str = Query(...),
+    metric: str = Query("pm2.5"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    format: str = Query("csv"),
+):
+    backend_field = DATA_VAL_DICT.get(metric)
+    if backend_field is None:
+        raise HTTPException(status_code=400, detail=f"Unknown metric {metric!r}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.FORMATS)}")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the server")
+
+    end_ts = _epoch(end) if end else int(time.time())
+    start_ts = _epoch(start) if start else end_ts - 24 * 3600
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end_ts - start_ts > export.EXPORT_MAX_DAYS * 86400:
+        raise HTTPException(status_code=400, detail=f"At most {export.EXPORT_MAX_DAYS} days per export")
+
+    request_log.info("Exporting series", sensor_id=sensor_id, field=backend_field, start=start_ts, end=end_ts, format=format)
+    filename = "{}_{}_{:%Y%m%d}-{:%Y%m%d}.{}".format(
+        sensor_id, metric, datetime.fromtimestamp(start_ts, timezone.utc),
+        datetime.fromtimestamp(end_ts, timezone.utc), format,
+    )
+    # the slot is held until the body is fully streamed
+    await EXPORT_LIMIT.acquire()
+    return StreamingResponse(
+        EXPORT_LIMIT.hold(export.stream(sensor_id, backend_field, metric, start_ts, end_ts, format)),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 
 @app.get("/api/statistics")
-def get_statistics():
-    return DATA["statistics"]
+async def get_statistics(request: Request, region: Optional[str] = Query(None)):
+    return _snapshot_response("statistics", request, region)
+
+
+def _region_status(state: RegionState) -> Dict[str, Any]:
+    snap = state.current()
+    age = (datetime.now() - snap.refreshed_at).total_seconds() if snap.refreshed_at else None
+    return {
+        "source": snap.source,
+        "refreshedAt": snap.refreshed_at,
+        "ageSeconds": age,
+        "stale": snap.source != "live" or age > 2 * state.region.refresh_minutes * 60,
+        "refreshing": state.refresher.running,
+        "sensors": len(snap.sensors),
+        "generation": snap.generation,
+        "streamSubscribers": state.broadcaster.subscribers,
+        "polling": state.poller.stats(),
+    }
+
+
+@app.get("/api/status")
+def get_status():
+    regions_status = {name: _region_status(state) for name, state in REGION_STATES.items()}
+    return {
+        # top-level fields describe the default region
+        **regions_status[regions.DEFAULT_REGION],
+        "role": CLUSTER.role,
+        "alerts": ALERTS.outbox.stats(),
+        "upstream": upstream.stats(),
+        "concurrency": limits.stats(),
+        "regions": regions_status,
+    }
+
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text format
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return RESPONSE_CACHE.stats()
+
+
+def _check_debug_access(request: Request) -> None:
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if profiling.DEBUG_TOKEN and request.headers.get("X-Debug-Token") != profiling.DEBUG_TOKEN:
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Debug-Token")
+
+
+@app.get("/api/debug/profiles")
+def get_profiles(
+    request: Request,
+    limit: int = Query(20, ge=1, le=profiling.PROFILE_BUFFER_SIZE),
+    path: Optional[str] = Query(None),
+):
+    # Newest first; `path` keeps requests whose path starts with it
+    _check_debug_access(request)
+    return {
+        "sampleRate": profiling.PROFILE_SAMPLE_RATE,
+        "slowMs": profiling.PROFILE_SLOW_MS,
+        "cprofile": profiling.PROFILE_CPROFILE,
+        "captures": profiling.captures(limit, path),
+    }
+
+
+@app.delete("/api/debug/profiles")
+def clear_profiles(request: Request):
+    _check_debug_access(request)
+    profiling.clear()
+    return {"cleared": True}
 
 
-#Global Counter Variable For Data Points / Day
-scheduler.add_job(refresh_data, 'interval', minutes=10)
+#Counter For Data Points / Day
 @app.get("/api/counter")
-def get_count():
-    return {"count": todaysPoints["count"],  "date": todaysPoints["date"]}
+async def get_count(request: Request, region: Optional[str] = Query(None)):
+    return _snapshot_response("counter", request, region)
 
 
 
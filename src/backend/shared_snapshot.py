@@ -0,0 +1,170 @@
+# ----------------------------------------
+# Shared Snapshot File
+# ----------------------------------------
+# The leader process writes every published snapshot to one binary file; the
+# other workers memory-map it. Response payloads (every encoding variant) and
+# the numeric sensor columns are served as views straight into the mapping, so
+# N workers share one copy of the data through the page cache instead of each
+# building and holding their own.
+#
+# Layout: HEADER (magic, version, meta length), a JSON meta block (everything
+# small: ids, names, hourly, statistics, ... and the section table), then the
+# sections, each 8-byte aligned so columns can be viewed as NumPy arrays.
+#
+# Each region has its own file (regions.path_for).
+#
+# The file is replaced atomically (write to .tmp, os.replace). Readers keep
+# their old mapping alive until nothing references it, so in-flight responses
+# are never cut off by a newer snapshot.
+
+import json
+import mmap
+import os
+import struct
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import encoding
+import regions
+from encoding import EncodedPayload
+from sensor_table import SensorTable
+from snapshot import Snapshot
+from spatial import SpatialIndex
+
+
+MAGIC = b"CAWS"
+VERSION = 2
+HEADER = struct.Struct("<4sHHQ")
+ALIGN = 8
+
+# SensorTable columns stored as raw arrays
+ARRAY_COLUMNS = ("lat", "lng", "pm25", "temperature", "humidity", "pressure", "aqi", "category")
+
+
+def _aligned(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write(snapshot: Snapshot, path: str) -> None:
+    """Write the snapshot (with its encoded payloads) to `path`, atomically."""
+    sections: List[Tuple[str, bytes]] = []
+    media_types = {}
+    for name, payload in snapshot.encoded.items():
+        media_types[name] = payload.media_type
+        sections.append((f"payload.{name}.identity", payload.identity))
+        sections.append((f"payload.{name}.gzip", payload.gzip))
+        if payload.br is not None:
+            sections.append((f"payload.{name}.br", payload.br))
+    dtypes = {}
+    sensors = snapshot.sensors
+    for column in ARRAY_COLUMNS:
+        arr = np.ascontiguousarray(getattr(sensors, column))
+        dtypes[column] = arr.dtype.str
+        sections.append((f"column.{column}", arr.tobytes()))
+    generations = np.ascontiguousarray(snapshot.sensor_generations, dtype=np.int64)
+    dtypes["sensor_generations"] = generations.dtype.str
+    sections.append(("column.sensor_generations", generations.tobytes()))
+
+    layout: Dict[str, List[int]] = {}
+    offset = 0
+    for name, data in sections:
+        offset = _aligned(offset)
+        layout[name] = [offset, len(data)]
+        offset += len(data)
+
+    meta = encoding.dumps({
+        "generation": snapshot.generation,
+        "source": snapshot.source,
+        "region": snapshot.region,
+        "refreshed_at": snapshot.refreshed_at.isoformat() if snapshot.refreshed_at else None,
+        "hourly": list(snapshot.hourly),
+        "statistics": snapshot.statistics,
+        "counter": {"count": snapshot.counter["count"], "date": snapshot.counter["date"].isoformat()},
+        "removed": snapshot.removed,
+        "history_floor": snapshot.history_floor,
+        "ids": list(sensors.ids),
+        "names": list(sensors.names),
+        "last_updated": [t.isoformat() for t in sensors.last_updated],
+        "categories": [list(c) for c in sensors.categories],
+        "dtypes": dtypes,
+        "media_types": media_types,
+        "sections": layout,
+    })
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(meta)))
+        f.write(meta)
+        base = _aligned(HEADER.size + len(meta))
+        f.write(b"\0" * (base - HEADER.size - len(meta)))
+        for name, data in sections:
+            f.write(b"\0" * (base + layout[name][0] - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    """Cheap change marker for the file (inode, mtime, size), or None if missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def read(path: str) -> Snapshot:
+    """Map `path` and build a Snapshot whose payloads and columns are views into it."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, version, _, meta_len = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} shared snapshot")
+    meta = json.loads(bytes(view[HEADER.size:HEADER.size + meta_len]))
+    base = _aligned(HEADER.size + meta_len)
+
+    def section(name: str) -> memoryview:
+        offset, length = meta["sections"][name]
+        return view[base + offset:base + offset + length]
+
+    columns = {
+        column: np.frombuffer(section(f"column.{column}"), dtype=meta["dtypes"][column])
+        for column in ARRAY_COLUMNS
+    }
+    sensors = SensorTable(
+        ids=tuple(meta["ids"]),
+        names=tuple(meta["names"]),
+        last_updated=tuple(datetime.fromisoformat(t) for t in meta["last_updated"]),
+        categories=tuple(tuple(c) for c in meta["categories"]),
+        **columns,
+    )
+    region = regions.get(meta["region"])
+    encoded = {}
+    for name, media_type in meta["media_types"].items():
+        br = f"payload.{name}.br"
+        encoded[name] = EncodedPayload(
+            identity=section(f"payload.{name}.identity"),
+            gzip=section(f"payload.{name}.gzip"),
+            br=section(br) if br in meta["sections"] else None,
+            media_type=media_type,
+        )
+
+    return Snapshot(
+        sensors=sensors,
+        hourly=tuple(meta["hourly"]),
+        statistics=meta["statistics"],
+        counter={"count": meta["counter"]["count"], "date": date.fromisoformat(meta["counter"]["date"])},
+        refreshed_at=datetime.fromisoformat(meta["refreshed_at"]) if meta["refreshed_at"] else None,
+        source=meta["source"],
+        region=region.name,
+        encoded=encoded,
+        spatial_index=SpatialIndex.build(sensors.lat, sensors.lng, ref_lat=region.ref_lat),
+        generation=meta["generation"],
+        sensor_generations=np.frombuffer(
+            section("column.sensor_generations"), dtype=meta["dtypes"]["sensor_generations"]
+        ),
+        removed=meta["removed"],
+        history_floor=meta["history_floor"],
+    )
@@ -0,0 +1,264 @@
+# ----------------------------------------
+# Published Data Snapshot
+# ----------------------------------------
+# Readers always see one complete refresh: refresh_data builds a new Snapshot
+# off the request path and publishes it with a single reference swap. The
+# Refresher makes sure at most one build is running; anyone asking for a
+# refresh while one is in flight just waits for that one.
+#
+# The last published snapshot is also written to disk so a restarted server can
+# serve it immediately while its first live refresh runs in the background.
+#
+# encode() also derives the per-refresh spatial artifacts: the sensor location
+# index behind the near/bbox queries and the interpolated PM2.5 raster tile.
+#
+# Each configured region (see regions.py) has its own current snapshot and its
+# own Refresher, so regions refresh independently of one another.
+#
+# Every refresh bumps a generation number. Snapshots remember the generation in
+# which each sensor's readings last changed (and when sensors disappeared), so
+# pollers can ask for just the changes since the generation they already have.
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timezone
+from email.utils import format_datetime
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+import encoding
+import logs
+import metrics
+import regions
+import spatial
+from encoding import EncodedPayload
+from sensor_table import SensorTable
+from spatial import SpatialIndex
+
+
+log = logs.get_logger("snapshot")
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    sensors: SensorTable = field(default_factory=SensorTable)
+    hourly: Tuple[Dict[str, Any], ...] = ()
+    statistics: Dict[str, Any] = field(default_factory=dict)
+    counter: Dict[str, Any] = field(default_factory=lambda: {"count": 0, "date": date.today()})
+    refreshed_at: Optional[datetime] = None
+    # "empty" before anything loaded, "disk" when restored at startup, "live" after a refresh
+    source: str = "empty"
+    region: str = regions.DEFAULT_REGION
+    # Response bodies for the snapshot endpoints, built once by encode()
+    encoded: Dict[str, EncodedPayload] = field(default_factory=dict)
+    # Location index over sensors rows, built by encode()
+    spatial_index: Optional[SpatialIndex] = None
+    generation: int = 0
+    # per sensors row: generation its readings last changed in
+    sensor_generations: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    # sensor id -> generation it was dropped in (kept for REMOVED_HISTORY generations)
+    removed: Dict[str, int] = field(default_factory=dict)
+    # oldest generation a delta can be computed from; older clients get everything
+    history_floor: int = 0
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.generation}"'
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        if self.refreshed_at is None:
+            return None
+        return format_datetime(self.refreshed_at.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+# How many generations of sensor removals to remember for deltas (one day at 10 min)
+REMOVED_HISTORY = 144
+
+
+def track_changes(previous: Snapshot, sensors: SensorTable) -> Dict[str, Any]:
+    """
+    Work out the next generation's bookkeeping from the previous snapshot.
+    Returns the Snapshot fields generation, sensor_generations, removed and
+    history_floor.
+    """
+    generation = previous.generation + 1
+    changed = sensors.changed_since(previous.sensors)
+
+    if len(previous.sensor_generations) == len(previous.sensors) and len(previous.sensors):
+        prev_idx = np.fromiter(
+            (previous.sensors.index.get(s, 0) for s in sensors.ids), dtype=np.int64, count=len(sensors)
+        )
+        sensor_generations = np.where(changed, generation, previous.sensor_generations[prev_idx])
+    else:
+        sensor_generations = np.full(len(sensors), generation, dtype=np.int64)
+
+    removed = {
+        sensor_id: gen for sensor_id, gen in previous.removed.items()
+        if sensor_id not in sensors.index and gen > generation - REMOVED_HISTORY
+    }
+    for sensor_id in previous.sensors.ids:
+        if sensor_id not in sensors.index:
+            removed[sensor_id] = generation
+
+    return {
+        "generation": generation,
+        "sensor_generations": sensor_generations,
+        "removed": removed,
+        "history_floor": max(previous.history_floor, generation - REMOVED_HISTORY),
+    }
+
+
+def changes_since(snapshot: Snapshot, since: int) -> Dict[str, Any]:
+    """
+    Sensors (as JSON records) whose readings changed after generation `since`,
+    plus the ids removed since then. Falls back to the full list (full=True)
+    when `since` is outside the history this snapshot can answer for.
+    """
+    full = since < snapshot.history_floor or since > snapshot.generation
+    rows = None if full else np.flatnonzero(snapshot.sensor_generations > since)
+    removed = [] if full else [sensor_id for sensor_id, gen in snapshot.removed.items() if gen > since]
+    return {
+        "generation": snapshot.generation,
+        "full": full,
+        "sensors": snapshot.sensors.records(rows),
+        "removed": removed,
+    }
+
+
+def encode(snapshot: Snapshot) -> Snapshot:
+    """Return a copy of the snapshot with its endpoint payloads and spatial index built."""
+    sensors = snapshot.sensors
+    region = regions.get(snapshot.region)
+    with metrics.AGGREGATION_DURATION.time("raster"):
+        raster = spatial.pm25_raster(sensors.lat, sensors.lng, sensors.pm25, bbox=region.bbox)
+    with metrics.AGGREGATION_DURATION.time("encode"):
+        encoded = {
+            "sensors": encoding.encode_payload(sensors.records()),
+            "statistics": encoding.encode_payload(snapshot.statistics),
+            "counter": encoding.encode_payload(
+                {"count": snapshot.counter["count"], "date": snapshot.counter["date"].isoformat()}
+            ),
+            "pm25_grid": encoding.compress_payload(
+                spatial.encode_raster(raster, snapshot.generation, region.bbox), "application/octet-stream"
+            ),
+        }
+    for name, payload in encoded.items():
+        metrics.SNAPSHOT_PAYLOAD_SIZE.set(len(payload.identity), region.name, name, "identity")
+        metrics.SNAPSHOT_PAYLOAD_SIZE.set(len(payload.gzip), region.name, name, "gzip")
+        if payload.br is not None:
+            metrics.SNAPSHOT_PAYLOAD_SIZE.set(len(payload.br), region.name, name, "br")
+    index = SpatialIndex.build(sensors.lat, sensors.lng, ref_lat=region.ref_lat)
+    return replace(snapshot, spatial_index=index, encoded=encoded)
+
+
+_current: Dict[str, Snapshot] = {r.name: encode(Snapshot(region=r.name)) for r in regions.REGIONS}
+
+
+def current(region: str = regions.DEFAULT_REGION) -> Snapshot:
+    return _current[region]
+
+
+def publish(snapshot: Snapshot) -> None:
+    _current[snapshot.region] = snapshot
+
+
+def save(snapshot: Snapshot, path: str) -> None:
+    """Write the snapshot as JSON, atomically replacing any previous file."""
+    payload = {
+        "sensors": snapshot.sensors.records(),
+        "hourly": list(snapshot.hourly),
+        "statistics": snapshot.statistics,
+        "counter": {"count": snapshot.counter["count"], "date": snapshot.counter["date"].isoformat()},
+        "refreshed_at": snapshot.refreshed_at.isoformat() if snapshot.refreshed_at else None,
+        "generation": snapshot.generation,
+        "sensor_generations": dict(zip(snapshot.sensors.ids, snapshot.sensor_generations.tolist())),
+        "removed": snapshot.removed,
+        "history_floor": snapshot.history_floor,
+        "region": snapshot.region,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def load(path: str, categories: Sequence[Tuple[str, str]],
+         region: str = regions.DEFAULT_REGION) -> Optional[Snapshot]:
+    """Read a snapshot written by save(); returns None if missing or unreadable."""
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+        sensors = SensorTable.from_records(payload["sensors"], categories)
+        generation = payload.get("generation", 0)
+        generations = payload.get("sensor_generations", {})
+        return encode(Snapshot(
+            sensors=sensors,
+            hourly=tuple(payload["hourly"]),
+            statistics=payload["statistics"],
+            counter={"count": payload["counter"]["count"], "date": date.fromisoformat(payload["counter"]["date"])},
+            refreshed_at=datetime.fromisoformat(payload["refreshed_at"]) if payload["refreshed_at"] else None,
+            source="disk",
+            region=region,
+            generation=generation,
+            sensor_generations=np.array([generations.get(s, generation) for s in sensors.ids], dtype=np.int64),
+            removed=payload.get("removed", {}),
+            history_floor=payload.get("history_floor", 0),
+        ))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error("Error loading persisted snapshot", path=path, error=repr(e))
+        return None
+
+
+class Refresher:
+    """Runs build(previous_snapshot) for one region at most once at a time and publishes the result."""
+
+    def __init__(self, build: Callable[[Snapshot], Snapshot], on_publish: Optional[Callable[[Snapshot], None]] = None,
+                 region: str = regions.DEFAULT_REGION):
+        self.region = region
+        self._build = build
+        self._on_publish = on_publish
+        self._lock = threading.Lock()
+        self._inflight: Optional[Future] = None
+
+    def trigger(self) -> Future:
+        """Start a refresh, or return the one already running."""
+        with self._lock:
+            if self._inflight is None or self._inflight.done():
+                future = Future()
+                self._inflight = future
+                threading.Thread(target=self._run, args=(future,), name=f"refresh-{self.region}", daemon=True).start()
+            return self._inflight
+
+    @property
+    def running(self) -> bool:
+        with self._lock:
+            return self._inflight is not None and not self._inflight.done()
+
+    def run(self) -> Snapshot:
+        """Trigger (or join) a refresh and block until it is published."""
+        return self.trigger().result()
+
+    def _run(self, future: Future) -> None:
+        start = time.perf_counter()
+        try:
+            snapshot = self._build(current(self.region))
+            publish(snapshot)
+            if self._on_publish is not None:
+                self._on_publish(snapshot)
+        except BaseException as e:
+            metrics.REFRESH_FAILURES.inc(self.region)
+            log.error("Error refreshing data, keeping previous snapshot", region=self.region, error=repr(e))
+            future.set_exception(e)
+            return
+        metrics.REFRESH_DURATION.observe(time.perf_counter() - start, self.region)
+        metrics.REFRESH_SENSORS.set(len(snapshot.sensors), self.region)
+        metrics.REFRESH_LAST_SUCCESS.set(time.time(), self.region)
+        future.set_result(snapshot)
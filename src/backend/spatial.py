@@ -0,0 +1,212 @@
+# ----------------------------------------
+# Spatial Index and PM2.5 Raster
+# ----------------------------------------
+# Built once per published snapshot so map queries don't scan (or ship) the
+# whole sensor list:
+#
+# - SpatialIndex buckets sensor locations into a uniform grid of cells. Nearest
+#   neighbour queries search outward ring by ring from the query's cell and
+#   bounding-box queries only look at the cells the box overlaps.
+# - pm25_raster interpolates PM2.5 over a region's bounding box (inverse
+#   distance weighting), and encode_raster packs it as a small binary tile, so
+#   the interpolation is paid once per refresh instead of per viewer.
+#
+# Distances use an equirectangular projection around the region's centre, which
+# is accurate to well under a percent at city scale. Everything defaults to
+# REGION_BBOX; other regions pass their own box / reference latitude.
+
+import math
+import struct
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+# (min_lat, max_lat, min_lon, max_lon) of the default region (see regions.py)
+REGION_BBOX = (39.939889, 40.277507, -82.782446, -82.195962)
+
+KM_PER_DEGREE = 111.32
+# Target number of sensors per index cell
+SENSORS_PER_CELL = 2
+
+# Raster size over the region's bbox (rows run north to south)
+RASTER_ROWS = 128
+RASTER_COLS = 128
+IDW_POWER = 2.0
+# PM2.5 values are stored as uint16 in units of RASTER_SCALE ug/m3
+RASTER_SCALE = 0.1
+RASTER_NODATA = 0xFFFF
+
+# Tile header: magic, version, rows, cols, min_lat, max_lat, min_lon, max_lon,
+# scale, nodata, generation; followed by rows*cols little-endian uint16 values
+RASTER_MAGIC = b"PMGR"
+RASTER_VERSION = 1
+RASTER_HEADER = struct.Struct("<4sHHHddddfHI")
+
+
+def _ref_lat(bbox: Tuple[float, float, float, float] = REGION_BBOX) -> float:
+    return (bbox[0] + bbox[1]) / 2
+
+
+def project(lat, lng, ref_lat: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Degrees -> planar km (x east, y north) around ref_lat (default: the region's centre)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    ref_lat = _ref_lat() if ref_lat is None else ref_lat
+    return lng * KM_PER_DEGREE * math.cos(math.radians(ref_lat)), lat * KM_PER_DEGREE
+
+
+@dataclass(frozen=True)
+class SpatialIndex:
+    x: np.ndarray
+    y: np.ndarray
+    # sensor rows sorted by cell, and where each cell's rows start in that order
+    order: np.ndarray
+    cell_start: np.ndarray
+    origin: Tuple[float, float]
+    cell_km: float
+    shape: Tuple[int, int]
+    ref_lat: float
+
+    @classmethod
+    def build(cls, lat: np.ndarray, lng: np.ndarray, ref_lat: Optional[float] = None) -> "SpatialIndex":
+        ref_lat = _ref_lat() if ref_lat is None else ref_lat
+        x, y = project(lat, lng, ref_lat)
+        ok = np.isfinite(x) & np.isfinite(y)
+        if ok.any():
+            x0, y0 = float(x[ok].min()), float(y[ok].min())
+            width = max(float(x[ok].max()) - x0, 1e-6)
+            height = max(float(y[ok].max()) - y0, 1e-6)
+            n_cells = max(int(ok.sum()) // SENSORS_PER_CELL, 1)
+            cell_km = max(math.sqrt(width * height / n_cells), 1e-3)
+        else:
+            x0 = y0 = 0.0
+            width = height = cell_km = 1.0
+        shape = (int(height // cell_km) + 1, int(width // cell_km) + 1)
+
+        rows = np.flatnonzero(ok)
+        cells = cls._cell_of(x[rows], y[rows], (x0, y0), cell_km, shape)
+        sort = np.argsort(cells, kind="stable")
+        order, cells = rows[sort], cells[sort]
+        cell_start = np.searchsorted(cells, np.arange(shape[0] * shape[1] + 1))
+        return cls(x=x, y=y, order=order, cell_start=cell_start, origin=(x0, y0), cell_km=cell_km, shape=shape,
+                   ref_lat=ref_lat)
+
+    @staticmethod
+    def _cell_of(x, y, origin, cell_km, shape) -> np.ndarray:
+        cy = np.clip(((y - origin[1]) // cell_km).astype(np.int64), 0, shape[0] - 1)
+        cx = np.clip(((x - origin[0]) // cell_km).astype(np.int64), 0, shape[1] - 1)
+        return cy * shape[1] + cx
+
+    def _rows_in_cells(self, cy0: int, cy1: int, cx0: int, cx1: int) -> np.ndarray:
+        """Sensor rows in the (clipped, inclusive) cell rectangle."""
+        cy0, cy1 = max(cy0, 0), min(cy1, self.shape[0] - 1)
+        cx0, cx1 = max(cx0, 0), min(cx1, self.shape[1] - 1)
+        if cy0 > cy1 or cx0 > cx1:
+            return np.empty(0, dtype=np.int64)
+        parts = [
+            self.order[self.cell_start[cy * self.shape[1] + cx0]:self.cell_start[cy * self.shape[1] + cx1 + 1]]
+            for cy in range(cy0, cy1 + 1)
+        ]
+        return np.concatenate(parts)
+
+    def nearest(self, lat: float, lng: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the k nearest sensors and their distances in km, nearest first."""
+        k = min(k, len(self.order))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        qx, qy = (float(v) for v in project(lat, lng, self.ref_lat))
+        cx = int((qx - self.origin[0]) // self.cell_km)
+        cy = int((qy - self.origin[1]) // self.cell_km)
+        max_ring = max(abs(cx) + self.shape[1], abs(cy) + self.shape[0])
+        # Queries outside the grid start at the first ring that reaches it
+        ring = max(cx - (self.shape[1] - 1), -cx, cy - (self.shape[0] - 1), -cy, 0)
+        while True:
+            rows = self._rows_in_cells(cy - ring, cy + ring, cx - ring, cx + ring)
+            if len(rows) >= k:
+                dist = np.hypot(self.x[rows] - qx, self.y[rows] - qy)
+                top = np.argpartition(dist, k - 1)[:k]
+                # Anything outside the searched block is at least this far away
+                edge = min(
+                    qx - (self.origin[0] + (cx - ring) * self.cell_km),
+                    self.origin[0] + (cx + ring + 1) * self.cell_km - qx,
+                    qy - (self.origin[1] + (cy - ring) * self.cell_km),
+                    self.origin[1] + (cy + ring + 1) * self.cell_km - qy,
+                )
+                if dist[top].max() <= edge or ring >= max_ring:
+                    top = top[np.argsort(dist[top], kind="stable")]
+                    return rows[top], dist[top]
+            ring += 1
+
+    def within(self, min_lat: float, max_lat: float, min_lng: float, max_lng: float) -> np.ndarray:
+        """Rows of the sensors inside the bounding box, in table order."""
+        (x0, x1), (y0, y1) = project([min_lat, max_lat], [min_lng, max_lng], self.ref_lat)
+        cx0 = int((x0 - self.origin[0]) // self.cell_km)
+        cx1 = int((x1 - self.origin[0]) // self.cell_km)
+        cy0 = int((y0 - self.origin[1]) // self.cell_km)
+        cy1 = int((y1 - self.origin[1]) // self.cell_km)
+        rows = self._rows_in_cells(cy0, cy1, cx0, cx1)
+        x, y = self.x[rows], self.y[rows]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return np.sort(rows[inside])
+
+
+def pm25_raster(lat: np.ndarray, lng: np.ndarray, pm25: np.ndarray,
+                rows: int = RASTER_ROWS, cols: int = RASTER_COLS,
+                bbox: Tuple[float, float, float, float] = REGION_BBOX) -> np.ndarray:
+    """
+    IDW-interpolated PM2.5 at the centre of each cell of a rows x cols grid over
+    bbox (row 0 is the northern edge). All NaN if there are no sensors.
+    """
+    ok = np.isfinite(lat) & np.isfinite(lng) & np.isfinite(pm25)
+    if not ok.any():
+        return np.full((rows, cols), np.nan)
+    ref_lat = _ref_lat(bbox)
+    sx, sy = project(lat[ok], lng[ok], ref_lat)
+    values = np.asarray(pm25, dtype=np.float64)[ok]
+
+    min_lat, max_lat, min_lon, max_lon = bbox
+    cell_lat = max_lat - (np.arange(rows) + 0.5) * (max_lat - min_lat) / rows
+    cell_lng = min_lon + (np.arange(cols) + 0.5) * (max_lon - min_lon) / cols
+    gx, _ = project(0.0, cell_lng, ref_lat)
+    _, gy = project(cell_lat, 0.0, ref_lat)
+
+    out = np.empty((rows, cols))
+    for r in range(rows):
+        d2 = (gx[:, None] - sx[None, :]) ** 2 + (gy[r] - sy[None, :]) ** 2
+        exact = d2 == 0
+        weights = 1.0 / np.where(exact, 1.0, d2) ** (IDW_POWER / 2)
+        row = (weights @ values) / weights.sum(axis=1)
+        hit = exact.any(axis=1)
+        if hit.any():
+            row[hit] = values[exact[hit].argmax(axis=1)]
+        out[r] = row
+    return out
+
+
+def encode_raster(raster: np.ndarray, generation: int = 0,
+                  bbox: Tuple[float, float, float, float] = REGION_BBOX) -> bytes:
+    """Pack a raster into the binary tile format described by RASTER_HEADER."""
+    rows, cols = raster.shape
+    scaled = np.round(np.clip(raster, 0, (RASTER_NODATA - 1) * RASTER_SCALE) / RASTER_SCALE)
+    data = np.where(np.isnan(raster), RASTER_NODATA, scaled).astype("<u2")
+    header = RASTER_HEADER.pack(
+        RASTER_MAGIC, RASTER_VERSION, rows, cols, *bbox, RASTER_SCALE, RASTER_NODATA, generation
+    )
+    return header + data.tobytes()
+
+
+def decode_raster(tile: bytes) -> Tuple[dict, np.ndarray]:
+    """Inverse of encode_raster: (header fields, float raster with NaN for no data)."""
+    magic, version, rows, cols, min_lat, max_lat, min_lon, max_lon, scale, nodata, generation = \
+        RASTER_HEADER.unpack_from(tile)
+    if magic != RASTER_MAGIC:
+        raise ValueError("not a PM2.5 raster tile")
+    data = np.frombuffer(tile, dtype="<u2", offset=RASTER_HEADER.size, count=rows * cols).reshape(rows, cols)
+    raster = np.where(data == nodata, np.nan, data * np.float64(scale))
+    header = {
+        "version": version, "rows": rows, "cols": cols, "bbox": (min_lat, max_lat, min_lon, max_lon),
+        "scale": scale, "generation": generation,
+    }
+    return header, raster
@@ -0,0 +1,273 @@
+# ----------------------------------------
+# Local Time-Series Store
+# ----------------------------------------
+# Raw SimpleAQ readings kept on disk per (sensor, field) in SQLite. Past points
+# never change upstream, so once a window has been downloaded it is served from
+# here; the coverage table records which window each series already holds so
+# ingestion only has to fetch what is missing at either edge.
+#
+# Alongside the raw points the store keeps materialized rollups (5-minute,
+# hourly, daily means). They are recomputed only for the buckets touched by each
+# append, so reading a day or hour series costs one row per output point. The
+# rollups outlive the raw points, so rollup_coverage records the window they
+# hold separately from the (pruned) raw coverage.
+
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import aggregation
+import metrics
+from profiling import timed
+
+
+STORE_PATH = os.getenv("SERIES_STORE_PATH", "series.db")
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "40"))
+ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "400"))
+
+# Rollup tiers in bucket seconds. Daily buckets are the mean of their hourly
+# means (each hour weighs the same), matching the historical endpoint.
+FIVE_MINUTES = 5 * aggregation.MINUTE
+ROLLUP_TIERS = (FIVE_MINUTES, aggregation.HOUR, aggregation.DAY)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    sensor_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (sensor_id, field, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS coverage (
+    sensor_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    covered_from INTEGER NOT NULL,
+    covered_to INTEGER NOT NULL,
+    PRIMARY KEY (sensor_id, field)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_coverage (
+    sensor_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    covered_from INTEGER NOT NULL,
+    covered_to INTEGER NOT NULL,
+    PRIMARY KEY (sensor_id, field)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollups (
+    sensor_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    bucket_seconds INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    value REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (sensor_id, field, bucket_seconds, bucket)
+) WITHOUT ROWID;
+"""
+
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(STORE_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.executescript(SCHEMA)
+        if "rollups" not in tables:
+            _rebuild_rollups(conn)
+        if "rollup_coverage" not in tables:
+            # The rollups were built from the raw points still held
+            conn.execute("INSERT OR IGNORE INTO rollup_coverage SELECT * FROM coverage")
+        _conn = conn
+    return _conn
+
+
+def _update_rollups(conn: sqlite3.Connection, sensor_id: str, field: str, t_lo: int, t_hi: int) -> None:
+    """Recompute every rollup bucket that overlaps [t_lo, t_hi] from the raw points."""
+    hour_lo = t_lo - t_lo % aggregation.HOUR
+    hour_hi = t_hi - t_hi % aggregation.HOUR + aggregation.HOUR - 1
+    rows = conn.execute(
+        "SELECT ts, value FROM readings WHERE sensor_id = ? AND field = ? AND ts BETWEEN ? AND ?",
+        (sensor_id, field, hour_lo, hour_hi),
+    ).fetchall()
+    times = [r[0] for r in rows]
+    values = [r[1] for r in rows]
+
+    for bucket_seconds in (FIVE_MINUTES, aggregation.HOUR):
+        starts, means, counts = aggregation.bucket_mean(times, values, bucket_seconds)
+        conn.executemany(
+            "INSERT OR REPLACE INTO rollups (sensor_id, field, bucket_seconds, bucket, value, count) VALUES (?, ?, ?, ?, ?, ?)",
+            ((sensor_id, field, bucket_seconds, b, m, c) for b, m, c in zip(starts.tolist(), means.tolist(), counts.tolist())),
+        )
+
+    # Days are rebuilt from the (now current) hourly tier
+    day_lo = t_lo - t_lo % aggregation.DAY
+    day_hi = t_hi - t_hi % aggregation.DAY + aggregation.DAY - 1
+    rows = conn.execute(
+        "SELECT bucket, value FROM rollups WHERE sensor_id = ? AND field = ? AND bucket_seconds = ? AND bucket BETWEEN ? AND ?",
+        (sensor_id, field, aggregation.HOUR, day_lo, day_hi),
+    ).fetchall()
+    starts, means, counts = aggregation.bucket_mean([r[0] for r in rows], [r[1] for r in rows], aggregation.DAY)
+    conn.executemany(
+        "INSERT OR REPLACE INTO rollups (sensor_id, field, bucket_seconds, bucket, value, count) VALUES (?, ?, ?, ?, ?, ?)",
+        ((sensor_id, field, aggregation.DAY, b, m, c) for b, m, c in zip(starts.tolist(), means.tolist(), counts.tolist())),
+    )
+
+
+def _rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """Backfill rollups for raw data written before the rollup tables existed."""
+    series = conn.execute(
+        "SELECT sensor_id, field, MIN(ts), MAX(ts) FROM readings GROUP BY sensor_id, field"
+    ).fetchall()
+    if not series:
+        return
+    conn.execute("BEGIN")
+    try:
+        for sensor_id, field, t_lo, t_hi in series:
+            _update_rollups(conn, sensor_id, field, t_lo, t_hi)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _merge_coverage(conn: sqlite3.Connection, table: str, sensor_id: str, field: str,
+                    covered_from: int, covered_to: int) -> None:
+    row = conn.execute(
+        f"SELECT covered_from, covered_to FROM {table} WHERE sensor_id = ? AND field = ?",
+        (sensor_id, field),
+    ).fetchone()
+    # Extend the window if the new one touches it, otherwise the newer window wins
+    if row and covered_from <= row[1] and covered_to >= row[0]:
+        covered_from = min(covered_from, row[0])
+        covered_to = max(covered_to, row[1])
+    conn.execute(
+        f"INSERT OR REPLACE INTO {table} (sensor_id, field, covered_from, covered_to) VALUES (?, ?, ?, ?)",
+        (sensor_id, field, covered_from, covered_to),
+    )
+
+
+def _get_window(table: str, sensor_id: str, field: str) -> Optional[Tuple[int, int]]:
+    with _lock:
+        row = _get_conn().execute(
+            f"SELECT covered_from, covered_to FROM {table} WHERE sensor_id = ? AND field = ?",
+            (sensor_id, field),
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+@timed("store")
+def get_coverage(sensor_id: str, field: str) -> Optional[Tuple[int, int]]:
+    """Return (covered_from, covered_to) epoch seconds, or None if never fetched."""
+    return _get_window("coverage", sensor_id, field)
+
+
+@timed("store")
+def get_rollup_coverage(sensor_id: str, field: str) -> Optional[Tuple[int, int]]:
+    """
+    Window the rollups hold, including fetched spans that had no points.
+    Unlike get_coverage it survives raw pruning, up to rollup retention.
+    """
+    return _get_window("rollup_coverage", sensor_id, field)
+
+
+@timed("store")
+def append(
+    sensor_id: str,
+    field: str,
+    times: List[int],
+    values: List[float],
+    covered_from: Optional[int],
+    covered_to: Optional[int],
+) -> None:
+    """
+    Store points for one series and mark [covered_from, covered_to] as fetched
+    (None leaves the coverage as it is). Re-sent points overwrite themselves, so
+    overlapping fetches are harmless. Rollup buckets touched by the new points
+    are refreshed in the same transaction.
+    """
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO readings (sensor_id, field, ts, value) VALUES (?, ?, ?, ?)",
+                ((sensor_id, field, t, v) for t, v in zip(times, values)),
+            )
+            if times:
+                with metrics.AGGREGATION_DURATION.time("rollups"):
+                    _update_rollups(conn, sensor_id, field, min(times), max(times))
+            if covered_from is not None:
+                _merge_coverage(conn, "coverage", sensor_id, field, covered_from, covered_to)
+                _merge_coverage(conn, "rollup_coverage", sensor_id, field, covered_from, covered_to)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+@timed("store")
+def query(sensor_id: str, field: str, start: int, end: int) -> Tuple[List[int], List[float]]:
+    """Return (times, values) for start <= ts <= end, oldest first."""
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT ts, value FROM readings WHERE sensor_id = ? AND field = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (sensor_id, field, start, end),
+        ).fetchall()
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+@timed("store")
+def query_rollup(sensor_id: str, field: str, bucket_seconds: int, start: int, end: int) -> Tuple[List[int], List[float]]:
+    """Return (bucket_starts, means) of one rollup tier for start <= bucket <= end."""
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT bucket, value FROM rollups WHERE sensor_id = ? AND field = ? AND bucket_seconds = ? "
+            "AND bucket BETWEEN ? AND ? ORDER BY bucket",
+            (sensor_id, field, bucket_seconds, start, end),
+        ).fetchall()
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+@timed("store")
+def count(sensor_id: str, field: str, start: int, end: int) -> int:
+    """Number of raw points for start <= ts <= end."""
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT COUNT(*) FROM readings WHERE sensor_id = ? AND field = ? AND ts BETWEEN ? AND ?",
+            (sensor_id, field, start, end),
+        ).fetchone()
+    return row[0]
+
+
+def prune(retention_days: int = RAW_RETENTION_DAYS, rollup_retention_days: int = ROLLUP_RETENTION_DAYS) -> None:
+    """Drop raw points (and 5-minute rollups) older than the retention window."""
+    now = int(time.time())
+    cutoff = now - retention_days * 86400
+    rollup_cutoff = now - rollup_retention_days * 86400
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM readings WHERE ts < ?", (cutoff,))
+            conn.execute("DELETE FROM rollups WHERE bucket_seconds = ? AND bucket < ?", (FIVE_MINUTES, cutoff))
+            conn.execute("DELETE FROM rollups WHERE bucket < ?", (rollup_cutoff,))
+            conn.execute("UPDATE coverage SET covered_from = ? WHERE covered_from < ?", (cutoff, cutoff))
+            conn.execute("DELETE FROM coverage WHERE covered_to < covered_from")
+            conn.execute(
+                "UPDATE rollup_coverage SET covered_from = ? WHERE covered_from < ?", (rollup_cutoff, rollup_cutoff)
+            )
+            conn.execute("DELETE FROM rollup_coverage WHERE covered_to < covered_from")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
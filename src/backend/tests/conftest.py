@@ -0,0 +1,6 @@
+# Backend modules import each other by bare name, as they do when run from
+# src/backend
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,236 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import aggregation
+import store
+
+
+# ----------------------------------------
+# The loops the vectorized code replaced
+# ----------------------------------------
+
+
+def _old_hourly(times, values):
+    """generate_24hour_data's per-hour averages: {hour datetime: mean}."""
+    hourly_data = {}
+    for ts_str, val in zip(times, values):
+        hour_key = datetime.fromisoformat(ts_str.rstrip("Z")).replace(
+            tzinfo=timezone.utc, minute=0, second=0, microsecond=0)
+        hourly_data.setdefault(hour_key, []).append(float(val))
+    return {hour: sum(v) / len(v) for hour, v in sorted(hourly_data.items())}
+
+
+def _old_daily(chunks):
+    """generate_historical_data's raw -> hourly -> daily means: {date: mean}."""
+    daily_sum = defaultdict(float)
+    daily_count = defaultdict(int)
+    for chunk in chunks:
+        hourly_sum = defaultdict(float)
+        hourly_count = defaultdict(int)
+        for ts_str, val_str in zip(chunk["time"], chunk["value"]):
+            try:
+                dt = datetime.fromisoformat(ts_str.rstrip("Z")).replace(tzinfo=timezone.utc)
+                hour_bucket = dt.replace(minute=0, second=0, microsecond=0)
+                hourly_sum[hour_bucket] += float(val_str)
+                hourly_count[hour_bucket] += 1
+            except Exception:
+                continue
+        for hour_dt, total in hourly_sum.items():
+            count = hourly_count[hour_dt]
+            if count == 0:
+                continue
+            daily_sum[hour_dt.date()] += total / count
+            daily_count[hour_dt.date()] += 1
+    return {day: daily_sum[day] / daily_count[day] for day in sorted(daily_sum)}
+
+
+# ----------------------------------------
+# Fixtures
+# ----------------------------------------
+
+START = 1_700_000_000 - 1_700_000_000 % aggregation.DAY + 60  # 00:01 UTC
+
+
+def _series():
+    """Three days of 2-minute points with empty hours, a sparse hour and a half-empty day."""
+    times = np.arange(START, START + 3 * aggregation.DAY, 120, dtype=np.int64)
+    hour_of_series = (times - START) // aggregation.HOUR
+    keep = ~np.isin(hour_of_series, [3, 4, 30])                    # empty hours
+    keep &= ~((hour_of_series == 10) & ((times - START) % 3600 > 300))  # an hour with 3 points
+    keep &= ~((hour_of_series >= 52) & (hour_of_series < 64))      # half of day 3 missing
+    times = times[keep]
+    rng = np.random.default_rng(7)
+    values = np.round(20 + 10 * np.sin(times / 5000.0) + rng.normal(0, 2, times.size), 3)
+    return times, values
+
+
+def _iso(times):
+    return [datetime.fromtimestamp(int(t), timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z") for t in times]
+
+
+def _as_dict(starts, means, key):
+    return {key(int(s)): float(m) for s, m in zip(starts, means)}
+
+
+def _hour_key(ts):
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+def _day_key(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).date()
+
+
+def _assert_same(new, old):
+    assert list(new) == list(old)
+    np.testing.assert_allclose(list(new.values()), list(old.values()), rtol=0, atol=1e-9)
+
+
+# ----------------------------------------
+# Vectorized rollups vs the old loops
+# ----------------------------------------
+
+
+def test_hourly_means_match_old_loop():
+    times, values = _series()
+    starts, means, _ = aggregation.bucket_mean(times, values, aggregation.HOUR)
+    _assert_same(_as_dict(starts, means, _hour_key), _old_hourly(_iso(times), values.astype(str)))
+
+
+def test_daily_means_of_hourly_means_match_old_loop():
+    times, values = _series()
+    starts, means, counts = aggregation.bucket_mean_of_means(times, values, aggregation.DAY)
+    old = _old_daily([{"time": _iso(times), "value": values.astype(str).tolist()}])
+    _assert_same(_as_dict(starts, means, _day_key), old)
+    # the empty hours don't count towards their day
+    assert counts.tolist() == [22, 23, 12]
+
+
+def test_unsorted_input_gives_same_buckets():
+    times, values = _series()
+    order = np.random.default_rng(1).permutation(times.size)
+    a = aggregation.bucket_mean_of_means(times, values, aggregation.DAY)
+    b = aggregation.bucket_mean_of_means(times[order], values[order], aggregation.DAY)
+    for x, y in zip(a, b):
+        np.testing.assert_allclose(x, y)
+
+
+def test_hour_aligned_chunk_boundaries_match_old_loop():
+    # getgraphdata chunks ending on an hour boundary (the old loop bucketed
+    # per chunk, so only then are its hours whole)
+    times, values = _series()
+    boundaries = [START - START % aggregation.HOUR + h * aggregation.HOUR for h in (20, 45)]
+    edges = [0, *np.searchsorted(times, boundaries), times.size]
+    chunks = [
+        {"time": _iso(times[lo:hi]), "value": values[lo:hi].astype(str).tolist()}
+        for lo, hi in zip(edges[:-1], edges[1:])
+    ]
+    starts, means, _ = aggregation.bucket_mean_of_means(times, values, aggregation.DAY)
+    _assert_same(_as_dict(starts, means, _day_key), _old_daily(chunks))
+
+
+def test_fill_buckets_leaves_missing_days_empty():
+    starts = np.array([START - START % aggregation.DAY + 2 * aggregation.DAY])
+    filled = aggregation.fill_buckets(starts, np.array([5.0]), START - START % aggregation.DAY, 4, aggregation.DAY)
+    assert np.isnan(filled[[0, 1, 3]]).all() and filled[2] == 5.0
+
+
+# ----------------------------------------
+# Store rollups, appended in chunks
+# ----------------------------------------
+
+
+@pytest.fixture
+def series_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "STORE_PATH", str(tmp_path / "series.db"))
+    monkeypatch.setattr(store, "_conn", None)
+    yield store
+    if store._conn is not None:
+        store._conn.close()
+
+
+def test_store_rollups_match_old_loop_across_append_chunks(series_store):
+    times, values = _series()
+    # boundaries mid-hour and mid-day, as the tail/backfill windows fall
+    edges = [0, 417, 1000, 1601, times.size]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        series_store.append("s", "f", times[lo:hi].tolist(), values[lo:hi].tolist(), None, None)
+
+    old_days = _old_daily([{"time": _iso(times), "value": values.astype(str).tolist()}])
+    day_starts, day_means = series_store.query_rollup("s", "f", aggregation.DAY, 0, 2**31)
+    _assert_same(_as_dict(day_starts, day_means, _day_key), old_days)
+
+    old_hours = _old_hourly(_iso(times), values.astype(str))
+    hour_starts, hour_means = series_store.query_rollup("s", "f", aggregation.HOUR, 0, 2**31)
+    _assert_same(_as_dict(hour_starts, hour_means, _hour_key), old_hours)
+
+
+def test_store_coverage_merges_touching_windows_only(series_store):
+    series_store.append("s", "f", [], [], 100, 200)
+    series_store.append("s", "f", [], [], 200, 300)
+    assert series_store.get_coverage("s", "f") == (100, 300)
+    series_store.append("s", "f", [], [], 50, 120)
+    assert series_store.get_coverage("s", "f") == (50, 300)
+    # a window apart from the held one replaces it
+    series_store.append("s", "f", [], [], 1000, 1100)
+    assert series_store.get_coverage("s", "f") == (1000, 1100)
+
+
+# ----------------------------------------
+# Downsampling
+# ----------------------------------------
+
+
+def _reference_lttb(times, values, threshold):
+    """Straightforward per-bucket LTTB (Steinarsson), returning kept indices."""
+    n = len(times)
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_lo = int((i + 1) * every) + 1
+        avg_hi = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(times[avg_lo:avg_hi]) / (avg_hi - avg_lo)
+        avg_y = sum(values[avg_lo:avg_hi]) / (avg_hi - avg_lo)
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((times[a] - avg_x) * (values[j] - values[a]) - (times[a] - times[j]) * (avg_y - values[a]))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+@pytest.mark.parametrize("n, threshold", [(1000, 100), (997, 50), (250, 3)])
+def test_lttb_matches_reference(n, threshold):
+    rng = np.random.default_rng(n)
+    times = np.cumsum(rng.integers(30, 300, n))
+    values = rng.normal(0, 5, n).cumsum()
+    kept_times, kept_values = aggregation.lttb(times, values, threshold)
+    expected = _reference_lttb(times.tolist(), values.tolist(), threshold)
+    assert kept_times.tolist() == times[expected].tolist()
+    assert kept_values.tolist() == values[expected].tolist()
+
+
+def test_lttb_and_minmax_pass_short_series_through():
+    times, values = np.arange(10), np.arange(10.0)
+    for downsample in (aggregation.lttb, aggregation.minmax_envelope):
+        t, v = downsample(times, values, 10)
+        assert t.tolist() == times.tolist() and v.tolist() == values.tolist()
+
+
+def test_minmax_envelope_keeps_every_buckets_extremes():
+    rng = np.random.default_rng(3)
+    times = np.arange(1000)
+    values = rng.normal(0, 1, 1000)
+    values[[123, 777]] = [50.0, -50.0]
+    kept_times, kept_values = aggregation.minmax_envelope(times, values, 100)
+    assert kept_values.size <= 100
+    assert np.all(np.diff(kept_times) > 0)
+    assert {123, 777} <= set(kept_times.tolist())
+    for lo, hi in zip(range(0, 1000, 20), range(20, 1001, 20)):
+        assert values[lo:hi].min() in kept_values and values[lo:hi].max() in kept_values
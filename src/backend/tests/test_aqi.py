@@ -0,0 +1,28 @@
+import math
+
+import pytest
+
+import aqi
+
+
+@pytest.mark.parametrize("ppm, expected", [
+    (0.200, 300),   # top of the 8-hour 201-300 band
+    (0.205, 201),   # bottom of the 1-hour 201-300 band
+    (0.250, 223),
+    (0.300, 248),
+    (0.404, 300),
+    (0.405, 301),   # 1-hour Hazardous band
+])
+def test_o3_between_8_hour_and_1_hour_hazardous_bands(ppm, expected):
+    assert aqi.aqi_list([ppm], "O3") == [expected]
+
+
+def test_o3_gap_is_very_unhealthy_not_hazardous():
+    codes = aqi.category_codes([0.25, 0.30, 0.5], "O3")
+    assert [aqi.AQI_CATEGORIES[c][0] for c in codes] == ["Very Unhealthy", "Very Unhealthy", "Hazardous"]
+
+
+def test_pm25_scale_and_edges():
+    assert aqi.aqi_list([0, 12, 12.05, 35.4, 600, -1, None]) == [0, 50, 50, 100, 500, 0, None]
+    assert math.isnan(aqi.aqi_array([float("nan")])[0])
+    assert aqi.category_codes([float("nan")])[0] == aqi.UNKNOWN_CATEGORY
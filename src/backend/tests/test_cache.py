@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+
+from cache import TTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def load():
+            calls.append(1)
+            await release.wait()
+            return "value"
+
+        tasks = [asyncio.create_task(cache.get_or_load_async("k", load)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    cache = TTLCache()
+
+    async def main():
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            *(cache.get_or_load_async("k", fail) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        assert await cache.get_or_load_async("k", lambda: asyncio.sleep(0, "ok")) == "ok"
+
+    asyncio.run(main())
+
+
+def test_cancelled_leader_hands_the_load_to_a_waiter():
+    cache = TTLCache()
+
+    async def main():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        leader = asyncio.create_task(cache.get_or_load_async("k", slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_load_async("k", lambda: asyncio.sleep(0, "retried")))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await waiter == "retried"
+        assert await cache.get_or_load_async("k", lambda: asyncio.sleep(0, "unused")) == "retried"
+
+    asyncio.run(main())
+
+
+def test_load_finishing_after_clear_is_not_cached():
+    cache = TTLCache()
+    started, release = threading.Event(), threading.Event()
+    results = {}
+
+    def stale_load():
+        started.set()
+        release.wait()
+        return "before clear"
+
+    leader = threading.Thread(target=lambda: results.update(leader=cache.get_or_load("k", stale_load)))
+    leader.start()
+    started.wait()
+    cache.clear()
+    release.set()
+    leader.join()
+
+    assert results["leader"] == "before clear"
+    assert cache.get_or_load("k", lambda: "after clear") == "after clear"
+
+
+def test_selective_clear_keeps_other_loads():
+    cache = TTLCache()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def load(value):
+            await release.wait()
+            return value
+
+        a = asyncio.create_task(cache.get_or_load_async(("a", 1), lambda: load("a")))
+        b = asyncio.create_task(cache.get_or_load_async(("b", 1), lambda: load("b")))
+        await asyncio.sleep(0)
+        cache.clear(lambda key: key[0] == "a")
+        release.set()
+        await asyncio.gather(a, b)
+        assert await cache.get_or_load_async(("a", 1), lambda: asyncio.sleep(0, "fresh")) == "fresh"
+        assert await cache.get_or_load_async(("b", 1), lambda: asyncio.sleep(0, "unused")) == "b"
+
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import asyncio
+
+import upstream
+from polling import PollScheduler
+
+
+def _plan(scheduler, answers, now):
+    """Run plan() with get_latest_point answering from `answers` (value or exception)."""
+    async def fake_latest(sensor_id, stale=True):
+        assert not stale
+        answer = answers[sensor_id]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+    original = upstream.get_latest_point
+    upstream.get_latest_point = fake_latest
+    try:
+        return asyncio.run(scheduler.plan(answers, now=now))
+    finally:
+        upstream.get_latest_point = original
+
+
+def test_idle_sensor_backs_off():
+    scheduler = PollScheduler(base_seconds=600)
+    now = 1_000_000
+    assert _plan(scheduler, {"a": now - 60}, now) == {"a"}
+    scheduler.mark_fetched(["a"])
+    assert _plan(scheduler, {"a": now - 60}, now + 600) == set()
+    assert scheduler._states["a"].interval == 1200
+
+
+def test_upstream_errors_keep_interval_and_retry_next_cycle():
+    scheduler = PollScheduler(base_seconds=600)
+    now = 1_000_000
+    _plan(scheduler, {"a": now - 60}, now)
+    scheduler.mark_fetched(["a"])
+    for cycle in range(1, 6):
+        active = _plan(scheduler, {"a": upstream.CircuitOpen("open")}, now + cycle * 600)
+        assert active == set()
+        assert scheduler._states["a"].interval == 600
+    # upstream is back: the sensor is checked on the very next refresh
+    assert _plan(scheduler, {"a": now + 3000}, now + 6 * 600) == {"a"}
@@ -0,0 +1,36 @@
+import asyncio
+
+import profiling
+
+
+def _serve(app, monkeypatch):
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(profiling, "PROFILE_CPROFILE", True)
+    profiling.clear()
+    held = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("more_body"):
+            # the rest of the stream must not keep the profiler
+            held.append(profiling._profiler_lock.locked())
+
+    scope = {"type": "http", "method": "GET", "path": "/api/sensors/stream", "query_string": b""}
+    asyncio.run(profiling.ProfilingMiddleware(app)(scope, None, send))
+    return held
+
+
+def test_stream_is_captured_up_to_its_first_chunk(monkeypatch):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"first", "more_body": True})
+        for _ in range(3):
+            await asyncio.sleep(0.05)
+            await send({"type": "http.response.body", "body": b"later", "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    held = _serve(app, monkeypatch)
+    assert held == [True, False, False, False]
+    [entry] = profiling.captures()
+    assert entry["wallMs"] < 50
+    assert entry["profile"] is not None
@@ -0,0 +1,438 @@
+# ----------------------------------------
+# Shared SimpleAQ Upstream Client
+# ----------------------------------------
+# Every call to simpleaq.org goes through one keep-alive httpx.AsyncClient that
+# lives on a dedicated event loop thread. The scheduler thread (refresh_data)
+# and request handlers hand their coroutines to that loop, so all of them share
+# the same connection pool no matter which thread they start from.
+#
+# _get is the gateway every call passes through:
+#
+# - deadline: each call gets UPSTREAM_CALL_DEADLINE seconds in total, or less
+#   if the caller ran its coroutine with run(..., deadline=...); per-attempt
+#   timeouts are cut to what is left of it
+# - retries: transport errors, timeouts, 5xx and 429 are retried with full
+#   jitter backoff while the deadline allows
+# - hedging: an attempt still pending after the endpoint's recent p95 latency
+#   gets a second, identical request; the first answer wins
+# - circuit breaker: once most recent calls fail, calls are refused outright
+#   for BREAKER_COOLDOWN_SECONDS, then a single probe decides whether to close
+# - stale fallback: calls made with a stale_key fall back to the last good
+#   response for that key when upstream can't answer
+# - lanes: calls run with run(..., lane=name) also hold one of that lane's
+#   slots (set_lane_limit), so one region's crawl can't take every slot and
+#   queue ahead of everything else
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Coroutine, Deque, Dict, Optional
+
+import httpx
+
+import logs
+import metrics
+import profiling
+
+
+SIMPLEAQ_API = os.getenv("SIMPLEAQ_API_URL", "https://www.simpleaq.org/api")
+
+# Max upstream requests in flight at once (across all sensors/fields)
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "32"))
+# Connection pool limits; everything goes to one host so these are per-host
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "16"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "16"))
+
+# Per-attempt caps; the call's remaining deadline can only make them shorter
+UPSTREAM_CONNECT_TIMEOUT = 5.0
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "20"))
+UPSTREAM_TIMEOUT = httpx.Timeout(UPSTREAM_CONNECT_TIMEOUT, read=UPSTREAM_READ_TIMEOUT)
+
+# Total budget of one call, retries and hedges included
+UPSTREAM_CALL_DEADLINE = float(os.getenv("UPSTREAM_CALL_DEADLINE", "30"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 2.0
+
+# Hedge after the endpoint's recent HEDGE_QUANTILE latency (HEDGE_DEFAULT_DELAY
+# until enough samples are in)
+HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE", "1") == "1"
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_DELAY = 0.25
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Open when at least BREAKER_FAILURE_RATIO of the last BREAKER_WINDOW calls
+# failed (and at least BREAKER_MIN_CALLS were made)
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 10
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Most stale_key entries kept for stale fallback
+STALE_MAX_ENTRIES = 4096
+
+log = logs.get_logger("upstream")
+
+
+class UpstreamError(Exception):
+    """SimpleAQ could not be asked (as opposed to answering with an error)."""
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+class QueuedTooLong(DeadlineExceeded):
+    """The deadline ran out before the request was sent: local congestion, not upstream."""
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. In half-open state only one probe at a time."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._set(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record(self, ok: bool) -> None:
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            if ok:
+                self._outcomes.clear()
+                self._set(self.CLOSED)
+            else:
+                self._open()
+            return
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures >= self.failure_ratio * len(self._outcomes):
+            self._open()
+
+    def abandon(self) -> None:
+        """A call that was let through ended without an outcome (e.g. cancelled)."""
+        self._probing = False
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+        if self.state != self.OPEN:
+            log.warning("Upstream circuit opened", cooldown=self.cooldown)
+        self._set(self.OPEN)
+
+    def _set(self, state: str) -> None:
+        if state == self.CLOSED and self.state != self.CLOSED:
+            log.info("Upstream circuit closed")
+        self.state = state
+        metrics.UPSTREAM_BREAKER_STATE.set({self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[state])
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+# All of these are only touched from the upstream loop
+_breaker = CircuitBreaker()
+_latencies: Dict[str, Deque[float]] = {}
+_stale: Dict[Any, httpx.Response] = {}
+# Absolute upstream-loop time the current call chain has to finish by
+_deadline_at: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+# Lane the current call chain runs in, if any
+_lane: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("upstream_lane", default=None)
+_lane_limits: Dict[str, int] = {}
+_lane_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="upstream-loop", daemon=True)
+            thread.start()
+    return _loop
+
+
+async def _within(coro: Coroutine[Any, Any, Any], deadline: Optional[float], lane: Optional[str]) -> Any:
+    # both are inherited by every task the coroutine spawns, so one budget covers all its calls
+    if deadline is not None:
+        _deadline_at.set(asyncio.get_running_loop().time() + deadline)
+    if lane is not None:
+        _lane.set(lane)
+    return await coro
+
+
+def run(coro: Coroutine[Any, Any, Any], deadline: Optional[float] = None, lane: Optional[str] = None) -> Any:
+    """
+    Run a coroutine on the upstream loop and block until it finishes. With a
+    deadline (seconds), no SimpleAQ call it makes outlives that budget; with a
+    lane, its calls share that lane's slots.
+    """
+    return asyncio.run_coroutine_threadsafe(_within(coro, deadline, lane), _get_loop()).result()
+
+
+async def run_async(coro: Coroutine[Any, Any, Any], deadline: Optional[float] = None,
+                    lane: Optional[str] = None) -> Any:
+    """Await a coroutine on the upstream loop from another event loop (see run)."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_within(coro, deadline, lane), _get_loop()))
+
+
+def set_lane_limit(lane: str, limit: int) -> None:
+    """Cap the requests in flight for calls run in `lane`; set before the lane is used."""
+    _lane_limits[lane] = max(1, limit)
+
+
+def _lane_semaphore() -> Optional[asyncio.Semaphore]:
+    lane = _lane.get()
+    if lane is None:
+        return None
+    semaphore = _lane_semaphores.get(lane)
+    if semaphore is None:
+        semaphore = _lane_semaphores[lane] = asyncio.Semaphore(_lane_limits.get(lane, UPSTREAM_CONCURRENCY))
+    return semaphore
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client. Must be called from the upstream loop."""
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=SIMPLEAQ_API,
+            timeout=UPSTREAM_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=30.0,
+            ),
+        )
+        _semaphore = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+    return _client
+
+
+def _retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _hedge_delay(endpoint: str) -> float:
+    samples = _latencies.get(endpoint)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    ordered = sorted(samples)
+    return max(HEDGE_MIN_DELAY, ordered[int(HEDGE_QUANTILE * (len(ordered) - 1))])
+
+
+async def _attempt(endpoint: str, field: str, params: Dict[str, Any], timeout: float,
+                   sent: Optional[asyncio.Event] = None) -> httpx.Response:
+    """One request, semaphore wait included in `timeout`. Sets `sent` once it goes out."""
+    client = get_client()
+    lane = _lane_semaphore()
+
+    async def send() -> httpx.Response:
+        async with lane or contextlib.nullcontext(), _semaphore:
+            if sent is not None:
+                sent.set()
+            start = time.perf_counter()
+            try:
+                resp = await client.get(
+                    f"/{endpoint}", params=params,
+                    timeout=httpx.Timeout(min(timeout, UPSTREAM_CONNECT_TIMEOUT), read=min(timeout, UPSTREAM_READ_TIMEOUT)),
+                )
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.UPSTREAM_LATENCY.observe(elapsed, endpoint, field)
+        if resp.status_code < 400:
+            _latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+        resp.raise_for_status()
+        return resp
+
+    sent = sent or asyncio.Event()
+    try:
+        return await asyncio.wait_for(send(), timeout)
+    except asyncio.TimeoutError:
+        if not sent.is_set():
+            raise QueuedTooLong(f"{endpoint}: no free upstream slot before the deadline")
+        raise
+
+
+async def _hedged(endpoint: str, field: str, params: Dict[str, Any], remaining: float) -> httpx.Response:
+    """
+    _attempt, plus a second identical request if the first has been on the wire
+    longer than usual. Time spent queued for the semaphore doesn't count, and
+    nothing is hedged while every slot is busy (that would only add load).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + remaining
+    delay = _hedge_delay(endpoint)
+    sent = asyncio.Event()
+    first = asyncio.ensure_future(_attempt(endpoint, field, params, remaining, sent))
+    if not HEDGE_ENABLED or delay >= remaining or _breaker.state != CircuitBreaker.CLOSED:
+        return await first
+    sent_wait = asyncio.ensure_future(sent.wait())
+    await asyncio.wait({first, sent_wait}, return_when=asyncio.FIRST_COMPLETED)
+    sent_wait.cancel()
+    if not first.done():
+        await asyncio.wait({first}, timeout=delay)
+    if first.done():
+        return first.result()
+    if _semaphore.locked() or deadline - loop.time() <= 0:
+        return await first
+
+    metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "hedge")
+    pending = {first, asyncio.ensure_future(_attempt(endpoint, field, params, deadline - loop.time()))}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _get(endpoint: str, field: str, params: Dict[str, Any], stale_key: Any = None) -> httpx.Response:
+    """
+    GET one SimpleAQ endpoint through the gateway (see the module comment),
+    recording latency and outcome by endpoint/field. Raises UpstreamError when
+    upstream couldn't be asked and httpx errors for error responses, unless a
+    stale response for stale_key is available.
+    """
+    with profiling.phase("upstream"):
+        return await _call(endpoint, field, params, stale_key)
+
+
+async def _call(endpoint: str, field: str, params: Dict[str, Any], stale_key: Any) -> httpx.Response:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + UPSTREAM_CALL_DEADLINE
+    if _deadline_at.get() is not None:
+        deadline = min(deadline, _deadline_at.get())
+
+    error: Optional[BaseException] = None
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            error = DeadlineExceeded(f"{endpoint}: deadline exceeded after {attempt} attempt(s)")
+            break
+        if not _breaker.allow():
+            error = CircuitOpen(f"{endpoint}: upstream circuit open")
+            metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "rejected")
+            break
+        try:
+            resp = await _hedged(endpoint, field, params, remaining)
+        except asyncio.CancelledError:
+            _breaker.abandon()  # the caller gave up; says nothing about upstream
+            raise
+        except Exception as e:
+            retryable = _retryable(e)
+            if isinstance(e, (QueuedTooLong, httpx.PoolTimeout)):
+                _breaker.abandon()  # our own queue, upstream never saw the request
+            else:
+                _breaker.record(not retryable)
+            metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "error")
+            error = DeadlineExceeded(f"{endpoint}: timed out") if isinstance(e, asyncio.TimeoutError) else e
+            if not retryable:
+                break
+            if attempt < UPSTREAM_RETRIES:
+                backoff = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                if loop.time() + backoff >= deadline:
+                    break
+                metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "retry")
+                await asyncio.sleep(backoff)
+            continue
+        _breaker.record(True)
+        metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "ok")
+        if stale_key is not None:
+            _stale.pop(stale_key, None)
+            _stale[stale_key] = resp
+            if len(_stale) > STALE_MAX_ENTRIES:
+                del _stale[next(iter(_stale))]
+        return resp
+
+    if stale_key is not None and stale_key in _stale:
+        metrics.UPSTREAM_REQUESTS.inc(endpoint, field, "stale")
+        return _stale[stale_key]
+    raise error
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "breaker": _breaker.state,
+        # list() copies in one step; the upstream loop may be adding endpoints
+        "hedgeDelays": {endpoint: round(_hedge_delay(endpoint), 3) for endpoint, _ in list(_latencies.items())},
+        "staleEntries": len(_stale),
+        "laneLimits": dict(_lane_limits),
+    }
+
+
+async def get_sensor_list(field: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    getdata: every sensor matching params (e.g. a bounding box) with its latest
+    value. Falls back to the last good list for the same query.
+    """
+    stale_key = ("getdata", field, tuple(sorted(params.items())))
+    query = {"field": field, **params, "utc_epoch": int(time.time()) * 1000}
+    resp = await _get("getdata", field, query, stale_key=stale_key)
+    return resp.json()
+
+
+async def get_graph_data(sensor_id: str, field: str, range_hours: int, end_time: str) -> Dict[str, Any]:
+    """
+    Fetch one getgraphdata series ({"time": [...], "value": [...]}) ending at
+    end_time. Raises on network or HTTP errors so callers can isolate failures.
+    """
+    params = {"id": sensor_id, "field": field, "rangehours": range_hours, "time": end_time}
+    resp = await _get("getgraphdata", field, params)
+    data = resp.json()
+    data.pop("sensor", None)
+    return {
+        "time": data.get("time", []),
+        "value": data.get("value", []),
+    }
+
+
+async def get_latest_point(sensor_id: str, stale: bool = True) -> Optional[int]:
+    """
+    Epoch seconds of the sensor's most recent point (getmostrecentdevicepoint),
+    or None if SimpleAQ has no points for it. While upstream is down this is the
+    last known answer (so the sensor looks idle); raises if there is none, or
+    always with stale=False.
+    """
+    stale_key = ("latest", sensor_id) if stale else None
+    resp = await _get("getmostrecentdevicepoint", "", {"id": sensor_id}, stale_key=stale_key)
+    data = resp.json()
+    if not data.get("found"):
+        return None
+    return int(datetime.fromisoformat(data["timestamp"].replace("Z", "+00:00")).timestamp())